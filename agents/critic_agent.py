@@ -1,7 +1,31 @@
-from typing import Dict, List
-import json
+from typing import Dict, List, Optional, Tuple
+import os
+import re
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import llm_client
+from utils.app_logger import get_logger
 from utils.disk_cache import load, save
+from utils.criteria_matcher import CriteriaMatcher
+from utils.embedding_service import approx_tokens
+from utils.med_vocab import normalize as vocab_normalize
+from utils.trial_catalog import criteria_version, get_catalog
+
+logger = get_logger("CriticAgent")
+catalog = get_catalog()  # precomputed criteria versions for cache keys
+
+# Rule results carry a confidence; bump when the rules or the confidence heuristic change
+RULE_CRITIC_VERSION = 3
+
+# LLM critic tier: only low-confidence rule results escalate, capped per run.
+# The default budget of 0 calls keeps the critic rule-only (and free) unless enabled.
+LLM_CRITIC_MODEL = "gpt-4o-mini"
+LLM_CRITIC_PROMPT_VERSION = "critic-v1"
+LLM_CRITIC_MAX_CALLS = int(os.getenv("CRITIC_LLM_MAX_CALLS", "0"))
+LLM_CRITIC_MAX_TOKENS = int(os.getenv("CRITIC_LLM_MAX_TOKENS", "0")) or None  # 0 = no token cap
+LLM_CRITIC_CONCURRENCY = int(os.getenv("CRITIC_LLM_CONCURRENCY", "8"))
+LLM_CRITIC_OUTPUT_TOKENS = 200
 
 # ----------------------------------
 # Utilities
@@ -10,91 +34,506 @@ def normalize(items: List[str]) -> List[str]:
     return [i.lower().strip() for i in items if i]
 
 
-def _cache_key(criteria: Dict, patient_summary: Dict) -> str:
-    """Stable hash for criteria + patient"""
-    payload = {
-        "criteria": criteria,
-        "patient": patient_summary
-    }
-    raw = json.dumps(payload, sort_keys=True)
-    return hashlib.sha256(raw.encode()).hexdigest()
+def phenotype_signature(patient_summary: Dict) -> Tuple[str, ...]:
+    """
+    Canonical condition set (normalized, deduplicated, sorted). The rule
+    decision depends on nothing else, so patients sharing a signature share
+    every (phenotype, trial) result.
+    """
+    return tuple(sorted(set(normalize(patient_summary.get("conditions", [])))))
+
+
+def trial_criteria_version(nct_id: Optional[str], criteria: Dict) -> str:
+    """The catalog's precomputed version for known trials, else a content hash."""
+    record = catalog.get(nct_id) if nct_id else None
+    return record.criteria_version if record is not None else criteria_version(criteria)
+
+
+def _cache_key(nct_id: Optional[str], version: str, signature: Tuple[str, ...]) -> str:
+    """Trial id + criteria version + phenotype; no criteria JSON is serialized."""
+    return "\x1f".join((f"rule-v{RULE_CRITIC_VERSION}", nct_id or "", version, *signature))
 
 # ----------------------------------
 # 1️⃣ FAST RULE-BASED CRITIC
 # ----------------------------------
-def rule_critic_verify(criteria: Dict, patient_summary: Dict) -> Dict:
+# Substring checks go through a precompiled matcher shared by every call;
+# normalize() above stays the reference definition of what is compared.
+_matcher = CriteriaMatcher(strip=True)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Words too generic to tie a criterion to a condition on their own
+_GENERIC = frozenset({
+    "type", "disease", "disorder", "syndrome", "chronic", "acute", "history",
+    "with", "without", "other", "unspecified", "condition", "mellitus",
+})
+
+
+def _word_set(text: str) -> frozenset:
+    """Words of a text; a number is kept with the word before it ("type 2"), so stray figures do not match."""
+    tokens = _WORD.findall(text)
+    return frozenset(f"{tokens[i - 1]} {w}" if w.isdigit() and i else w for i, w in enumerate(tokens))
+
+
+def _terms(term: str) -> frozenset:
     """
-    STRICT RULES:
-    - Any exclusion match → INELIGIBLE
-    - At least one inclusion match required
+    Distinguishing words of a patient term after med_vocab normalization:
+    content words (4+ characters, not generic) plus numbers with their
+    preceding word, so "type 2 diabetes" -> {"type 2", "diabetes"} and
+    "htn" -> {"hypertension"}.
     """
+    return frozenset(
+        w for w in _word_set(vocab_normalize(term.strip()))
+        if " " in w or w.isdigit() or (len(w) >= 4 and w not in _GENERIC)
+    )
 
-    key = _cache_key(criteria, patient_summary)
 
-    # 💰 HARD CACHE HIT
-    cached = load("critic_agent", key)
-    if cached:
-        return cached
+def _patient_terms(items) -> Tuple[Tuple[str, frozenset], ...]:
+    """(text as the substring rule compares it, distinguishing terms) per patient term."""
+    return tuple((t, _terms(t)) for t in normalize(items) if _terms(t))
+
+
+# (text, word set) per criterion, memoized under the matcher's key like its compiled texts
+_criteria_words: Dict[str, tuple] = {}
+
+
+def _criteria_profile(key: str, criteria: Dict) -> tuple:
+    profile = _criteria_words.get(key)
+    if profile is None:
+        def texts(items):
+            return tuple((t, _word_set(t)) for t in normalize(items))
+        inclusion = criteria.get("inclusion", [])
+        profile = _criteria_words[key] = (any(inclusion), texts(inclusion), texts(criteria.get("exclusion", [])))
+    return profile
+
+
+def _near_misses(terms, texts, substring_decided: bool = True) -> List[str]:
+    """
+    Patient terms that a criterion text contains in other words: every
+    distinguishing term appears in it, but (when substring_decided) not the
+    term itself, which the substring rule would already have caught.
+    """
+    found = []
+    for term, words in terms:
+        for text, text_words in texts:
+            if words <= text_words and not (substring_decided and term in text):
+                found.append(term)
+                break
+    return found
+
+
+def _borderline(profile: tuple, conditions, eligible: bool) -> Optional[str]:
+    """
+    Why a phenotype-level rule decision is unsure, or None when it is
+    clear-cut. Substring rules miss paraphrases and synonyms ("type 2
+    diabetes" vs "diabetes mellitus, type 2", "htn" vs "hypertension"), so
+    a criterion holding all of a condition's terms but not the condition
+    itself is what escalates.
+    """
+    has_inclusion, inclusion, exclusion = profile
+
+    if not eligible:
+        if not has_inclusion:
+            return "trial lists no inclusion criteria"
+        shared = _near_misses(conditions, inclusion)
+        return f"inclusion may restate patient conditions: {', '.join(sorted(shared))}" if shared else None
+
+    shared = _near_misses(conditions, exclusion)
+    if shared:
+        return f"exclusion may restate patient conditions: {', '.join(sorted(shared))}"
+    return None
+
+
+def _with_medications(result: Dict, profile: tuple, medications) -> Dict:
+    """
+    Per-patient overlay on a shared phenotype result: the rules ignore
+    medications, so an eligible pair whose exclusions name one of the
+    patient's drugs is flagged low confidence (taking precedence).
+    """
+    shared = _near_misses(medications, profile[2], substring_decided=False) if result["eligible"] and medications else None
+    if not shared:
+        return result
+    return {**result, "confidence": "low",
+            "borderline": f"exclusion criteria mention patient medications: {', '.join(sorted(shared))}"}
+
 
-    inclusion = normalize(criteria.get("inclusion", []))
-    exclusion = normalize(criteria.get("exclusion", []))
-    patient_conds = normalize(patient_summary.get("conditions", []))
+def _rule_decision(criteria: Dict, hit, borderline=lambda eligible: None) -> Dict:
+    """
+    STRICT RULES:
+    - Any exclusion match → INELIGIBLE
+    - At least one inclusion match required
+    Exclusion hits are always high confidence; the other outcomes drop to
+    low when borderline(eligible) names a near miss.
+    """
+    exc_hits, inc_match = hit
 
     # 🚫 HARD EXCLUSION
-    for exc in exclusion:
-        if any(pc in exc for pc in patient_conds):
-            result = {
-                "eligible": False,
-                "reasons": [f"Hard exclusion matched: {exc}"],
-                "confidence": "high"
-            }
-            save("critic_agent", key, result)
-            return result
+    if exc_hits:
+        exc = normalize(criteria.get("exclusion", []))[exc_hits[0]]
+        return {
+            "eligible": False,
+            "reasons": [f"Hard exclusion matched: {exc}"],
+            "confidence": "high"
+        }
 
     # ✅ INCLUSION REQUIRED
-    inc_match = any(
-        any(pc in inc for pc in patient_conds)
-        for inc in inclusion
-    )
-
     if not inc_match:
         result = {
             "eligible": False,
             "reasons": ["No inclusion criteria satisfied"],
             "confidence": "high"
         }
-        save("critic_agent", key, result)
-        return result
+    else:
+        result = {
+            "eligible": True,
+            "reasons": ["Inclusion met, no exclusions"],
+            "confidence": "high"
+        }
+
+    note = borderline(result["eligible"])
+    if note:
+        result.update(confidence="low", borderline=note)
+    return result
+
+
+def rule_critic_phenotype(
+    criteria_list: List[Dict],
+    signature: Tuple[str, ...],
+    nct_ids: Optional[List[Optional[str]]] = None,
+) -> List[Dict]:
+    """
+    Rule results for one phenotype against several trials, each evaluated
+    at most once: cached under (trial id, criteria version, phenotype), the
+    misses matched in a single pass. nct_ids lets known trials use the
+    catalog's criteria version (their criteria are taken to be the
+    catalog's); without them the criteria content is hashed.
+    """
+    nct_ids = nct_ids or [None] * len(criteria_list)
+    versions = [trial_criteria_version(n, c) for n, c in zip(nct_ids, criteria_list)]
+    keys = [_cache_key(n, v, signature) for n, v in zip(nct_ids, versions)]
+    results: List[Optional[Dict]] = []
+    misses = []
+
+    for i, key in enumerate(keys):
+        # 💰 HARD CACHE HIT
+        cached = load("critic_agent", key)
+        results.append(cached or None)
+        if not cached:
+            misses.append(i)
+
+    if misses:
+        slot_keys = [f"{nct_ids[i] or ''}@{versions[i]}" for i in misses]
+        decided = _decide_phenotype([criteria_list[i] for i in misses], signature, slot_keys)
+        for i, result in zip(misses, decided):
+            save("critic_agent", keys[i], result)
+            results[i] = result
 
-    result = {
-        "eligible": True,
-        "reasons": ["Inclusion met, no exclusions"],
-        "confidence": "high"
+    return results
+
+
+def _decide_phenotype(criteria_list: List[Dict], signature: Tuple[str, ...], slot_keys: List[str]) -> List[Dict]:
+    """Uncached rule decisions for one phenotype; slot_keys name each criteria in the matcher."""
+    slots = [_matcher.add(k, c) for k, c in zip(slot_keys, criteria_list)]
+    hits = _matcher.match(list(signature), slots)
+    conditions = _patient_terms(signature)
+    results = []
+    for criteria, sk, hit in zip(criteria_list, slot_keys, hits):
+        profile = _criteria_profile(sk, criteria)
+        results.append(_rule_decision(criteria, hit, lambda eligible: _borderline(profile, conditions, eligible)))
+    return results
+
+
+def rule_critic_verify_many(
+    criteria_list: List[Dict],
+    patient_summary: Dict,
+    nct_ids: Optional[List[Optional[str]]] = None,
+) -> List[Dict]:
+    """One patient against several trials: its phenotype's results plus its medication overlay."""
+    results = rule_critic_phenotype(criteria_list, phenotype_signature(patient_summary), nct_ids)
+    medications = _patient_terms(patient_summary.get("medications", []))
+    if not medications:
+        return results
+    nct_ids = nct_ids or [None] * len(criteria_list)
+    return [
+        _with_medications(r, _criteria_profile(f"{n or ''}@{trial_criteria_version(n, c)}", c), medications)
+        for r, n, c in zip(results, nct_ids, criteria_list)
+    ]
+
+
+def rule_critic_verify(criteria: Dict, patient_summary: Dict, nct_id: Optional[str] = None) -> Dict:
+    return rule_critic_verify_many([criteria], patient_summary, [nct_id])[0]
+
+
+def prewarm_phenotypes(candidates_by_patient: Dict[str, List[Dict]]) -> Dict[str, int]:
+    """
+    Cohort pass before per-patient workflows: groups patients by phenotype
+    and evaluates each distinct (phenotype, trial) pair once, so every
+    critic_node call after it is a cache hit. Takes the
+    batch_hybrid_search_and_reason output; returns dedup counters.
+    """
+    groups: Dict[Tuple[str, ...], Dict[Tuple[str, str], Dict]] = {}
+    pairs = 0
+    for trials in candidates_by_patient.values():
+        for t in trials:
+            if not t.get("eligible"):
+                continue  # the fast filter already decided these
+            signature = phenotype_signature(t.get("patient_summary", {}))
+            version = trial_criteria_version(t.get("nct_id"), t["Criteria"])
+            groups.setdefault(signature, {})[(t.get("nct_id"), version)] = t
+            pairs += 1
+
+    for signature, trials in groups.items():
+        rule_critic_phenotype(
+            [t["Criteria"] for t in trials.values()], signature, [t.get("nct_id") for t in trials.values()]
+        )
+    return {
+        "patients": len(candidates_by_patient),
+        "phenotypes": len(groups),
+        "pairs": pairs,
+        "evaluated": sum(len(t) for t in groups.values()),
     }
 
-    save("critic_agent", key, result)
-    return result
+
+def escalation_rate(patients: List[Dict], records=None) -> Dict[str, float]:
+    """
+    Share of rule decisions that would escalate, over every patient x
+    catalog trial (records defaults to the catalog), split by outcome.
+    Nothing is cached, so this is safe to run as a check.
+    """
+    records = list(catalog) if records is None else list(records)
+    slot_keys = [f"{r.nct_id}@{r.criteria_version}" for r in records]
+    counts = {"pairs": 0, "low": 0, "eligible": 0, "eligible_low": 0}
+    for patient in patients:
+        medications = _patient_terms(patient.get("medications", []))
+        decided = _decide_phenotype([r.criteria for r in records], phenotype_signature(patient), slot_keys)
+        for r, sk, result in zip(records, slot_keys, decided):
+            if medications:
+                result = _with_medications(result, _criteria_profile(sk, r.criteria), medications)
+            low = needs_escalation(result)
+            counts["pairs"] += 1
+            counts["low"] += low
+            counts["eligible"] += result["eligible"]
+            counts["eligible_low"] += low and result["eligible"]
+    return {
+        **counts,
+        "rate": counts["low"] / counts["pairs"] if counts["pairs"] else 0.0,
+        "eligible_rate": counts["eligible_low"] / counts["eligible"] if counts["eligible"] else 0.0,
+    }
 
 # ----------------------------------
-# 2️⃣ OPTIONAL LLM CRITIC (FUTURE)
+# 2️⃣ LLM CRITIC (ESCALATION TIER)
 # ----------------------------------
-def llm_critic_verify(criteria: Dict, patient_summary: Dict, strict: bool = False) -> Dict:
+class CriticBudget:
     """
-    Placeholder for GPT-based verification
-    (Not implemented yet)
+    Per-run cap on LLM critic calls and/or tokens, shared by concurrent
+    escalations. Calls reserve their estimated tokens up front and settle
+    to the reported usage; verdicts already cached are never charged.
+    """
+
+    def __init__(self, max_calls: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.tokens = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, share: float = 1.0) -> "CriticBudget":
+        """The CRITIC_LLM_* budget, or a share of it (e.g. one shard's)."""
+        tokens = int(LLM_CRITIC_MAX_TOKENS * share) if LLM_CRITIC_MAX_TOKENS else None
+        return cls(int(LLM_CRITIC_MAX_CALLS * share), tokens)
+
+    def reserve(self, tokens: int) -> bool:
+        with self._lock:
+            over_calls = self.max_calls is not None and self.calls + 1 > self.max_calls
+            over_tokens = self.max_tokens is not None and self.tokens + tokens > self.max_tokens
+            if over_calls or over_tokens:
+                self.skipped += 1
+                return False
+            self.calls += 1
+            self.tokens += tokens
+            return True
+
+    def settle(self, reserved: int, used: int):
+        with self._lock:
+            self.tokens += used - reserved
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"calls": self.calls, "tokens": self.tokens, "skipped": self.skipped,
+                    "max_calls": self.max_calls, "max_tokens": self.max_tokens}
+
+
+_escalation_pool = ThreadPoolExecutor(max_workers=LLM_CRITIC_CONCURRENCY, thread_name_prefix="llm-critic")
+
+LLM_CRITIC_SYSTEM_PROMPT = "You are a meticulous clinical trial eligibility critic. Return JSON only."
+
+
+def llm_critic_prompt(criteria: Dict, patient_summary: Dict, strict: bool = False, note: Optional[str] = None) -> str:
+    return f"""
+    Verify whether the patient meets the clinical trial's eligibility criteria.
+
+    PATIENT:
+    - Conditions: {patient_summary.get('conditions', [])}
+    - Medications: {patient_summary.get('medications', [])}
+
+    TRIAL CRITERIA:
+    - Inclusion Criteria: {criteria.get('inclusion', [])}
+    - Exclusion Criteria: {criteria.get('exclusion', [])}
+    {f"A rule-based screen was unsure: {note}." if note else ""}
+    {"STRICT: mark eligible only if an inclusion criterion is clearly met and no exclusion could apply." if strict else ""}
+    Return a JSON object:
+    {{
+      "eligible": boolean,
+      "reasons": ["One short reason per criterion that decided it."],
+      "confidence": "high" | "medium" | "low"
+    }}
     """
+
+
+def _llm_cache_key(prompt: str) -> str:
+    return f"{LLM_CRITIC_PROMPT_VERSION}:{LLM_CRITIC_MODEL}:{hashlib.sha256(prompt.encode()).hexdigest()}"
+
+
+def _parse_verdict(payload) -> Dict:
+    if not isinstance(payload, dict) or not isinstance(payload.get("eligible"), bool):
+        raise ValueError(f"Malformed LLM critic reply: {payload!r}")
+    reasons = payload.get("reasons") or [payload.get("reasoning") or "LLM critic verdict"]
+    return {
+        "eligible": payload["eligible"],
+        "reasons": [str(r) for r in reasons] if isinstance(reasons, list) else [str(reasons)],
+        "confidence": payload.get("confidence") if payload.get("confidence") in ("high", "medium", "low") else "medium",
+    }
+
+
+def llm_critic_verify(
+    criteria: Dict,
+    patient_summary: Dict,
+    strict: bool = False,
+    note: Optional[str] = None,
+    budget: Optional[CriticBudget] = None,
+) -> Optional[Dict]:
+    """
+    GPT-based verification of one pair. Verdicts are cached in the
+    "critic_llm" namespace; a cache miss is only sent if the budget allows
+    (no budget = unlimited). Returns None when over budget. Raises on API
+    or parse failure.
+    """
+    prompt = llm_critic_prompt(criteria, patient_summary, strict, note)
+    key = _llm_cache_key(prompt)
+    cached = load("critic_llm", key)
+    if cached:
+        return cached
+
+    estimate = approx_tokens(LLM_CRITIC_SYSTEM_PROMPT + prompt) + LLM_CRITIC_OUTPUT_TOKENS
+    if budget is not None and not budget.reserve(estimate):
+        return None
+
+    used = estimate
+    try:
+        response = llm_client.complete(
+            LLM_CRITIC_SYSTEM_PROMPT,
+            prompt,
+            model=LLM_CRITIC_MODEL,
+            response_format={"type": "json_object"},
+            max_tokens=LLM_CRITIC_OUTPUT_TOKENS,
+            api="chat",
+            caller="critic_agent",
+            cache=False,  # critic_llm keeps parsed verdicts; a rejected reply must not be replayed
+        )
+        used = sum(response.usage.values()) or estimate
+        verdict = _parse_verdict(response.json())
+    finally:
+        if budget is not None:
+            budget.settle(estimate, used)
+
+    save("critic_llm", key, verdict)
+    return verdict
+
+
+def _escalate(criteria: Dict, patient_summary: Dict, rule_result: Dict, budget: CriticBudget) -> Dict:
+    """LLM verdict for a low-confidence rule result; the rule result stands if it cannot be had."""
+    try:
+        verdict = llm_critic_verify(criteria, patient_summary, note=rule_result.get("borderline"), budget=budget)
+    except Exception as e:
+        logger.warning(f"⚠️ LLM critic failed, keeping rule decision: {e}")
+        verdict = None
+    if verdict is None:
+        return {**rule_result, "tier": "rule", "escalation": "skipped"}
     return {
-        "eligible": True,
-        "reasons": ["LLM deep verification placeholder"],
-        "confidence": "low"
+        **verdict,
+        "tier": "llm",
+        "rule": {"eligible": rule_result["eligible"], "reasons": rule_result["reasons"]},
     }
 
 # ----------------------------------
 # 3️⃣ ORCHESTRATOR (WHAT YOU CALL)
 # ----------------------------------
-def critic_verify(criteria: Dict, patient_summary: Dict) -> Dict:
+default_budget = CriticBudget.from_env()  # for callers that do not run with their own budget
+
+
+def needs_escalation(result: Dict) -> bool:
+    return result.get("confidence") != "high"
+
+
+def critic_verify(
+    criteria: Dict,
+    patient_summary: Dict,
+    budget: Optional[CriticBudget] = None,
+    nct_id: Optional[str] = None,
+) -> Dict:
     """
     Default critic = fast deterministic logic
     Upgrade to LLM only if needed
     """
-    return rule_critic_verify(criteria, patient_summary)
+    return critic_verify_many([criteria], patient_summary, budget, [nct_id])[0]
+
+
+def critic_verify_many(
+    criteria_list: List[Dict],
+    patient_summary: Dict,
+    budget: Optional[CriticBudget] = None,
+    nct_ids: Optional[List[Optional[str]]] = None,
+) -> List[Dict]:
+    """
+    Batch form of critic_verify for one patient's candidate trials. The rule
+    critic decides every pair (once per phenotype, shared across patients);
+    the low-confidence ones are re-checked by the LLM critic concurrently,
+    as far as the run's budget allows.
+    """
+    results = rule_critic_verify_many(criteria_list, patient_summary, nct_ids)
+    escalate = [i for i, r in enumerate(results) if needs_escalation(r)]
+    if not escalate:
+        return results
+
+    budget = budget or default_budget
+    futures = {
+        i: _escalation_pool.submit(_escalate, criteria_list[i], patient_summary, results[i], budget)
+        for i in escalate
+    }
+    results = list(results)
+    for i, fut in futures.items():
+        results[i] = fut.result()
+    return results
+
+
+if __name__ == "__main__":
+    # python -m agents.critic_agent: escalation-rate check on the sample cohort
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rule-critic escalation rate over patients x catalog trials")
+    parser.add_argument("--patients", default="data/patients/synthetic_patients.json")
+    parser.add_argument("--max-rate", type=float, default=0.05, help="fail above this share of escalated pairs")
+    args = parser.parse_args()
+
+    with open(args.patients, "r", encoding="utf-8") as f:
+        cohort = json.load(f)
+    report = escalation_rate(cohort)
+    print(
+        f"📈 {report['low']:,}/{report['pairs']:,} pairs escalate ({report['rate']:.2%}); "
+        f"{report['eligible_low']:,}/{report['eligible']:,} of rule-eligible pairs ({report['eligible_rate']:.2%})"
+    )
+    assert report["rate"] <= args.max_rate, f"escalation rate {report['rate']:.2%} is over {args.max_rate:.0%}"
+    print("✅ Escalation rate within budget")
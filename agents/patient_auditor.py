@@ -1,40 +1,61 @@
 import os
 import sys
 import json
+import time
+import asyncio
+import hashlib
+import contextlib
+import argparse
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional, Tuple
 
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI
-from pinecone import Pinecone
 
 # Add the project root to the search path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from utils import disk_cache, llm_client
 from utils.app_logger import get_logger
+from utils.embedding_service import approx_tokens, embed
+from utils.trial_catalog import get_catalog
+from vector_store.vector_index import fetch_metadata, get_index
 
 # 1. Configuration & Clients
 load_dotenv()
 logger = get_logger("PatientAuditor")
 
-# Environment Variables
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("PINECONE_INDEX", "clinical-trials")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
 # Paths
 PATIENTS_PATH = Path(r"C:\Projects\clinical_trial_agent\data\patients\synthetic_patients.json")
 OUTPUT_PATH = Path(r"C:\Projects\clinical_trial_agent\data\matches\patient_trial_matches.json")
 
 # Matching Parameters
 MAX_PATIENTS = 10
-TOP_K_TRIALS = 5  # Number of trials to retrieve from Pinecone per patient
+TOP_K_TRIALS = 5  # Number of trials to retrieve from the vector index per patient
+
+# Audit mode: "async" fans out every (patient, trial) audit under one cap; "batch" does the same
+# with several trials per call; "serial" is one call at a time
+AUDIT_MODE = os.getenv("AUDIT_MODE", "async")
+AUDIT_CONCURRENCY = int(os.getenv("AUDIT_CONCURRENCY", "16"))
+
+# Batched audits: one patient profile + up to N trials per call, kept under a prompt token budget
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "10"))
+AUDIT_BATCH_TOKENS = int(os.getenv("AUDIT_BATCH_TOKENS", "12000"))
+OUTPUT_TOKENS_PER_TRIAL = 120  # one {"nct_id", "eligible", "reasoning"} item
+
+# Audit result cache: content-addressed by everything a verdict depends on (patient fields, trial
+# text, prompt version, model), in a disk_cache namespace shared by every process
+AUDIT_MODEL = "gpt-4o-mini"
+AUDIT_PROMPT_VERSION = "audit-v1"  # bump whenever audit_prompt / batch_audit_prompt change meaning
+AUDIT_CACHE_ENABLED = os.getenv("AUDIT_CACHE", "1") != "0"
+AUDIT_CACHE_NAMESPACE = "patient_audits"
+AUDIT_CACHE_TTL = float(os.getenv("AUDIT_CACHE_TTL", str(30 * 24 * 3600))) or None  # 0 = never expire
+AUDIT_CACHE_MAX_ENTRIES = int(os.getenv("AUDIT_CACHE_MAX_ENTRIES", "200000"))
+disk_cache.configure_retention(AUDIT_CACHE_NAMESPACE, ttl=AUDIT_CACHE_TTL, max_entries=AUDIT_CACHE_MAX_ENTRIES)
 
-# Initialize Clients
-client = OpenAI(api_key=OPENAI_API_KEY)
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(INDEX_NAME)
+# Initialize Clients (LLM calls go through utils.llm_client)
+index = get_index()  # Pinecone or local, per VECTOR_BACKEND
+catalog = get_catalog()  # trial titles + criteria, parsed once
 
 # 2. Pydantic Models
 class Criteria(BaseModel):
@@ -47,14 +68,56 @@ class Trial(BaseModel):
     criteria: Criteria
 
 # 3. Agent Functions
+def trial_from_record(record) -> Trial:
+    return Trial(
+        nct_id=record.nct_id,
+        title=record.title,
+        criteria=Criteria(inclusion=list(record.inclusion), exclusion=list(record.exclusion))
+    )
+
+def resolve_trials(matches: List[Dict]) -> List[Optional[Trial]]:
+    """Builds Trials from the catalog by ID; IDs it doesn't know use their index metadata."""
+    ids = [str(m["id"]) for m in matches]
+    records, unknown = catalog.resolve(ids)
+    fallback = fetch_metadata(index, unknown) if unknown else {}
+
+    trials = []
+    for nct_id, record in zip(ids, records):
+        if record is not None:
+            trials.append(trial_from_record(record))
+            continue
+
+        meta = fallback.get(nct_id, {})
+        try:
+            # Older payloads stored Criteria as a JSON string to avoid 'null' issues
+            criteria_data = json.loads(meta.get("structured_criteria", "{}"))
+            trials.append(Trial(nct_id=meta["nct_id"], title=meta["title"], criteria=Criteria(**criteria_data)))
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to parse metadata for {meta.get('nct_id', nct_id)}: {e}")
+            trials.append(None)
+    return trials
+
+
 def get_embedding(text: str) -> List[float]:
     """Generate 1536-dim embedding using OpenAI text-embedding-3-small."""
-    resp = client.embeddings.create(model="text-embedding-3-small", input=text)
-    return resp.data[0].embedding
+    return embed(text)
 
-def llm_audit_eligibility(patient: Dict, trial: Trial) -> Dict:
-    """Agentic reasoning using gpt-4o-mini to verify eligibility."""
-    prompt = f"""
+def retrieve_trials(patient: Dict, top_k: int = TOP_K_TRIALS) -> List[Tuple[Dict, Trial]]:
+    """Vector search on the patient's conditions -> (match, Trial) pairs, best first."""
+    # We query the vector index using the patient's conditions
+    search_query = f"Clinical trial treating {', '.join(patient.get('conditions', []))}"
+    search_results = index.query(
+        vector=get_embedding(search_query),
+        top_k=top_k,
+        include_metadata=False  # IDs only; resolved through the catalog
+    )
+    matches = search_results["matches"]
+    return [(m, t) for m, t in zip(matches, resolve_trials(matches)) if t is not None]
+
+AUDIT_SYSTEM_PROMPT = "You are a precise medical auditor. Return JSON only."
+
+def audit_prompt(patient: Dict, trial: Trial) -> str:
+    return f"""
     You are a Clinical Trial Auditor. Determine if the patient is eligible for the trial.
     
     PATIENT PROFILE:
@@ -74,88 +137,413 @@ def llm_audit_eligibility(patient: Dict, trial: Trial) -> Dict:
       "reasoning": "Explain why in one short sentence, citing specific criteria."
     }}
     """
-    
+
+# Audit Cache
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def patient_fingerprint(patient: Dict) -> str:
+    """Hash of the profile fields the audit prompt shows (list order does not matter)."""
+    demo = patient.get("demographics", {})
+    return _digest({
+        "age": demo.get("age"),
+        "sex": demo.get("sex"),
+        "conditions": sorted(set(map(str, patient.get("conditions", [])))),
+        "medications": sorted(set(map(str, patient.get("medications", [])))),
+    })
+
+def trial_fingerprint(trial: Trial) -> str:
+    return _digest({
+        "nct_id": trial.nct_id,
+        "title": trial.title,
+        "inclusion": trial.criteria.inclusion,
+        "exclusion": trial.criteria.exclusion,
+    })
+
+def audit_cache_key(patient: Dict, trial: Trial) -> str:
+    return f"{AUDIT_PROMPT_VERSION}:{AUDIT_MODEL}:{patient_fingerprint(patient)}:{trial_fingerprint(trial)}"
+
+def cached_audit(patient: Dict, trial: Trial) -> Optional[Dict]:
+    if not AUDIT_CACHE_ENABLED:
+        return None
+    return disk_cache.load(AUDIT_CACHE_NAMESPACE, audit_cache_key(patient, trial))
+
+def store_audit(patient: Dict, trial: Trial, audit: Any) -> Dict:
+    """Caches well-formed verdicts only, so a bad reply is asked again next run."""
+    if AUDIT_CACHE_ENABLED and isinstance(audit, dict) and isinstance(audit.get("eligible"), bool) and "reasoning" in audit:
+        disk_cache.save(AUDIT_CACHE_NAMESPACE, audit_cache_key(patient, trial), audit)
+    return audit
+
+def llm_audit_eligibility(patient: Dict, trial: Trial) -> Dict:
+    """Agentic reasoning using gpt-4o-mini to verify eligibility."""
+    if (hit := cached_audit(patient, trial)) is not None:
+        return hit
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a precise medical auditor. Return JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
+        response = llm_client.complete(
+            AUDIT_SYSTEM_PROMPT,
+            audit_prompt(patient, trial),
+            model=AUDIT_MODEL,
+            response_format={"type": "json_object"},
+            api="chat",
+            caller="patient_auditor",
+            cache=False,  # patient_audits is the only cache, with its own retention
         )
-        return json.loads(response.choices[0].message.content)
+        return store_audit(patient, trial, response.json())
     except Exception as e:
         logger.error(f"❌ LLM Audit failed for {trial.nct_id}: {e}")
         return {"eligible": False, "reasoning": "Internal auditor error."}
 
-# 4. Main Execution Pipeline
-def run_auditor():
-    if not PATIENTS_PATH.exists():
-        logger.error(f"❌ Patient file not found: {PATIENTS_PATH}")
+async def allm_audit_eligibility(patient: Dict, trial: Trial) -> Dict:
+    """Async twin of llm_audit_eligibility (same prompt, cache and fallback)."""
+    if (hit := cached_audit(patient, trial)) is not None:
+        return hit
+    try:
+        response = await llm_client.acomplete(
+            AUDIT_SYSTEM_PROMPT,
+            audit_prompt(patient, trial),
+            model=AUDIT_MODEL,
+            response_format={"type": "json_object"},
+            api="chat",
+            caller="patient_auditor",
+            cache=False,  # patient_audits is the only cache, with its own retention
+        )
+        return store_audit(patient, trial, response.json())
+    except Exception as e:
+        logger.error(f"❌ LLM Audit failed for {trial.nct_id}: {e}")
+        return {"eligible": False, "reasoning": "Internal auditor error."}
+
+def _patient_block(patient: Dict) -> str:
+    return f"""
+    PATIENT PROFILE:
+    - Age: {patient['demographics']['age']}
+    - Sex: {patient['demographics']['sex']}
+    - Conditions: {patient.get('conditions', [])}
+    - Medications: {patient.get('medications', [])}
+    """
+
+def _trial_block(n: int, trial: Trial) -> str:
+    return f"""
+    [{n}] {trial.nct_id}:
+    - Title: {trial.title}
+    - Inclusion Criteria: {trial.criteria.inclusion}
+    - Exclusion Criteria: {trial.criteria.exclusion}
+    """
+
+BATCH_HEADER = """
+    You are a Clinical Trial Auditor. Determine, independently for EACH clinical trial
+    below, if the patient is eligible for it.
+    """
+
+BATCH_FOOTER = """
+    Return a JSON object with exactly one result per trial, in the order listed:
+    {
+      "results": [
+        {"nct_id": "NCT...", "eligible": boolean, "reasoning": "Explain why in one short sentence, citing specific criteria."}
+      ]
+    }
+    """
+
+def batch_audit_prompt(patient: Dict, trials: List[Trial]) -> str:
+    trials_text = "".join(_trial_block(n, t) for n, t in enumerate(trials, 1))
+    return f"{BATCH_HEADER}{_patient_block(patient)}\n    CLINICAL TRIALS:{trials_text}{BATCH_FOOTER}"
+
+def plan_batches(patient: Dict, trials: List[Trial], max_items: int = AUDIT_BATCH_SIZE,
+                 max_tokens: int = AUDIT_BATCH_TOKENS) -> List[List[int]]:
+    """
+    Groups trial positions into batches of at most max_items whose prompt
+    stays under max_tokens. A trial too large for the budget goes alone.
+    """
+    fixed = approx_tokens(AUDIT_SYSTEM_PROMPT + BATCH_HEADER + _patient_block(patient) + BATCH_FOOTER)
+    batches, current, used = [], [], fixed
+    for pos, trial in enumerate(trials):
+        cost = approx_tokens(_trial_block(len(current) + 1, trial))
+        if current and (len(current) >= max_items or used + cost > max_tokens):
+            batches.append(current)
+            current, used = [], fixed
+        current.append(pos)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch(payload: Any, trials: List[Trial]) -> Dict[str, Dict]:
+    """Well-formed items for requested trials; anything else is treated as missing."""
+    wanted = {t.nct_id for t in trials}
+    audits = {}
+    items = payload.get("results") if isinstance(payload, dict) else None
+    for item in items if isinstance(items, list) else []:
+        if (isinstance(item, dict) and item.get("nct_id") in wanted
+                and isinstance(item.get("eligible"), bool) and isinstance(item.get("reasoning"), str)):
+            audits.setdefault(item["nct_id"], {"eligible": item["eligible"], "reasoning": item["reasoning"]})
+    return audits
+
+def _batch_request(patient: Dict, trials: List[Trial]) -> Dict[str, Any]:
+    return dict(
+        system_prompt=AUDIT_SYSTEM_PROMPT,
+        user_prompt=batch_audit_prompt(patient, trials),
+        model=AUDIT_MODEL,
+        response_format={"type": "json_object"},
+        max_tokens=50 + OUTPUT_TOKENS_PER_TRIAL * len(trials),
+        api="chat",
+        caller="patient_auditor_batch",
+        cache=False,  # patient_audits is the only cache, with its own retention
+    )
+
+def _cached_batch(patient: Dict, trials: List[Trial]) -> Tuple[Dict[str, Dict], List[Trial]]:
+    audits = {t.nct_id: hit for t in trials if (hit := cached_audit(patient, t)) is not None}
+    return audits, [t for t in trials if t.nct_id not in audits]
+
+def _store_batch(patient: Dict, trials: List[Trial], audits: Dict[str, Dict]):
+    for trial in trials:
+        if trial.nct_id in audits:
+            store_audit(patient, trial, audits[trial.nct_id])
+
+def llm_audit_batch(patient: Dict, trials: List[Trial]) -> List[Dict]:
+    """
+    Audits one patient against several trials in a single call (cached
+    verdicts are not asked again). Trials the reply leaves out or gets wrong
+    are re-audited one at a time.
+    """
+    audits, todo = _cached_batch(patient, trials)
+    try:
+        if todo:
+            fresh = _parse_batch(llm_client.complete(**_batch_request(patient, todo)).json(), todo)
+            _store_batch(patient, todo, fresh)
+            audits.update(fresh)
+    except Exception as e:
+        logger.warning(f"⚠️ Batch audit of {len(todo)} trials failed: {e}")
+    missing = [t for t in trials if t.nct_id not in audits]
+    if missing:
+        logger.warning(f"🔁 Re-auditing {len(missing)}/{len(trials)} trials individually")
+    for trial in missing:
+        audits[trial.nct_id] = llm_audit_eligibility(patient, trial)
+    return [audits[t.nct_id] for t in trials]
+
+async def allm_audit_batch(patient: Dict, trials: List[Trial],
+                           gate: Optional[asyncio.Semaphore] = None) -> List[Dict]:
+    """
+    Async twin of llm_audit_batch; the individual retries run concurrently.
+    With a gate, each request (the batch and every retry) holds it while in flight.
+    """
+    gate = gate or contextlib.nullcontext()
+    audits, todo = _cached_batch(patient, trials)
+    try:
+        if todo:
+            async with gate:
+                reply = await llm_client.acomplete(**_batch_request(patient, todo))
+            fresh = _parse_batch(reply.json(), todo)
+            _store_batch(patient, todo, fresh)
+            audits.update(fresh)
+    except Exception as e:
+        logger.warning(f"⚠️ Batch audit of {len(todo)} trials failed: {e}")
+    missing = [t for t in trials if t.nct_id not in audits]
+    if missing:
+        logger.warning(f"🔁 Re-auditing {len(missing)}/{len(trials)} trials individually")
+
+        async def retry_one(trial: Trial) -> Dict:
+            async with gate:
+                return await allm_audit_eligibility(patient, trial)
+
+        for trial, audit in zip(missing, await asyncio.gather(*(retry_one(t) for t in missing))):
+            audits[trial.nct_id] = audit
+    return [audits[t.nct_id] for t in trials]
+
+def match_entry(patient_id: str, match: Dict, trial: Trial, audit: Dict) -> Dict:
+    entry = {
+        "patient_id": patient_id,
+        "nct_id": trial.nct_id,
+        "vector_score": round(match["score"], 4),
+        "eligible": audit["eligible"],
+        "reasoning": audit["reasoning"]
+    }
+    status = "✅" if audit["eligible"] else "❌"
+    logger.info(f"  {status} {patient_id} / Trial {trial.nct_id}: {audit['reasoning']}")
+    return entry
+
+# 4. Audit Runners
+# Each entry is keyed (patient position, retrieval rank) so the final report
+# has the serial order no matter which audit finishes first.
+def audit_serial(patients: List[Dict], sink: Callable[[Tuple[int, int], Dict], None]):
+    for i, p_raw in enumerate(patients):
+        logger.info(f"🚀 Auditing Patient {p_raw.get('patient_id')} ({', '.join(p_raw.get('conditions', []))})")
+        for rank, (match, trial) in enumerate(retrieve_trials(p_raw)):
+            audit = llm_audit_eligibility(p_raw, trial)  # Reason with gpt-4o-mini
+            sink((i, rank), match_entry(p_raw.get("patient_id"), match, trial, audit))
+
+async def _audit_patient(i: int, p_raw: Dict, pairs: List[Tuple[Dict, Trial]], gate: asyncio.Semaphore, sink,
+                         batched: bool = False):
+    async def audit_one(rank: int, match: Dict, trial: Trial):
+        async with gate:
+            audit = await allm_audit_eligibility(p_raw, trial)
+        sink((i, rank), match_entry(p_raw.get("patient_id"), match, trial, audit))
+
+    async def audit_batch(ranks: List[int]):
+        audits = await allm_audit_batch(p_raw, [pairs[r][1] for r in ranks], gate)
+        for rank, audit in zip(ranks, audits):
+            match, trial = pairs[rank]
+            sink((i, rank), match_entry(p_raw.get("patient_id"), match, trial, audit))
+
+    if batched:
+        batches = plan_batches(p_raw, [t for _, t in pairs])
+        await asyncio.gather(*(audit_batch(ranks) for ranks in batches))
+    else:
+        await asyncio.gather(*(audit_one(rank, m, t) for rank, (m, t) in enumerate(pairs)))
+
+async def audit_async(patients: List[Dict], sink, max_concurrency: int = AUDIT_CONCURRENCY, batched: bool = False):
+    """
+    Every patient retrieves on a worker thread (embeddings coalesce across
+    them) and then fans out all of its trial audits (or audit batches); the
+    semaphore caps the calls in flight across all patients.
+    """
+    gate = asyncio.Semaphore(max_concurrency)
+
+    async def one_patient(i: int, p_raw: Dict):
+        pairs = await asyncio.to_thread(retrieve_trials, p_raw)
+        logger.info(f"🚀 Auditing Patient {p_raw.get('patient_id')}: {len(pairs)} trials")
+        await _audit_patient(i, p_raw, pairs, gate, sink, batched)
+
+    await asyncio.gather(*(one_patient(i, p) for i, p in enumerate(patients)))
+
+class _StreamingReport:
+    """Appends each audit to an NDJSON file as it completes and keeps it for the ordered report."""
+
+    def __init__(self, stream_path: Path):
+        stream_path.parent.mkdir(parents=True, exist_ok=True)
+        self.entries: Dict[Tuple[int, int], Dict] = {}
+        self._file = open(stream_path, "w", encoding="utf-8")
+
+    def __call__(self, key: Tuple[int, int], entry: Dict):
+        self.entries[key] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def ordered(self) -> List[Dict]:
+        return [self.entries[k] for k in sorted(self.entries)]
+
+    def close(self):
+        self._file.close()
+
+# 5. Main Execution Pipeline
+def run_auditor(
+    mode: str = AUDIT_MODE,
+    max_concurrency: int = AUDIT_CONCURRENCY,
+    patients_path: Path = PATIENTS_PATH,
+    output_path: Path = OUTPUT_PATH,
+    max_patients: int = MAX_PATIENTS,
+):
+    if not patients_path.exists():
+        logger.error(f"❌ Patient file not found: {patients_path}")
         return
 
     # Load Patients
-    with open(PATIENTS_PATH, "r", encoding="utf-8") as f:
-        patients = json.load(f)
-
-    all_matches = []
-
-    for p_raw in patients[:MAX_PATIENTS]:
-        p_id = p_raw.get("patient_id")
-        conditions = p_raw.get("conditions", [])
-        
-        logger.info(f"🚀 Auditing Patient {p_id} ({', '.join(conditions)})")
-
-        # STEP 1: Vector Search (Retrieval)
-        # We query Pinecone using the patient's conditions
-        search_query = f"Clinical trial treating {', '.join(conditions)}"
-        query_vec = get_embedding(search_query)
-        
-        search_results = index.query(
-            vector=query_vec, 
-            top_k=TOP_K_TRIALS, 
-            include_metadata=True
-        )
+    with open(patients_path, "r", encoding="utf-8") as f:
+        patients = json.load(f)[:max_patients]
 
-        # STEP 2: Agentic Audit
-        for match in search_results["matches"]:
-            meta = match["metadata"]
-            
-            # Reconstruct Trial from Pinecone Metadata
-            try:
-                # We stored Criteria as a JSON string in Pinecone to avoid 'null' issues
-                criteria_data = json.loads(meta.get("structured_criteria", "{}"))
-                trial = Trial(
-                    nct_id=meta["nct_id"],
-                    title=meta["title"],
-                    criteria=Criteria(**criteria_data)
-                )
-            except Exception as e:
-                logger.warning(f"⚠️ Failed to parse metadata for {meta.get('nct_id')}: {e}")
-                continue
-
-            # Reason with gpt-4o-mini
-            audit = llm_audit_eligibility(p_raw, trial)
-
-            match_entry = {
-                "patient_id": p_id,
-                "nct_id": trial.nct_id,
-                "vector_score": round(match["score"], 4),
-                "eligible": audit["eligible"],
-                "reasoning": audit["reasoning"]
-            }
-            all_matches.append(match_entry)
-            
-            status = "✅" if audit["eligible"] else "❌"
-            logger.info(f"  {status} Trial {trial.nct_id}: {audit['reasoning']}")
-
-    # STEP 3: Save results
-    OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+    # STEP 1 + 2: Vector Search (Retrieval) and Agentic Audit, streamed to NDJSON as audits finish
+    stream_path = output_path.with_suffix(".ndjson")
+    report = _StreamingReport(stream_path)
+    started = time.perf_counter()
+    try:
+        if mode == "serial":
+            audit_serial(patients, report)
+        else:
+            asyncio.run(audit_async(patients, report, max_concurrency, batched=(mode == "batch")))
+    finally:
+        report.close()
+    all_matches = report.ordered()
+
+    # STEP 3: Save results (deterministic order: patient, then retrieval rank)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output_path.with_name(output_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(all_matches, f, indent=2)
+    os.replace(tmp, output_path)
     
-    logger.info(f"🏁 Matching complete. {len(all_matches)} audits saved to {OUTPUT_PATH}")
+    logger.info(f"🏁 Matching complete ({mode}, {time.perf_counter() - started:.1f}s). "
+                f"{len(all_matches)} audits saved to {output_path}")
+    return all_matches
+
+# 6. Benchmark against the local fake LLM
+def _usage_snapshot() -> Tuple[int, int]:
+    """(API calls, tokens) so far across the auditor's llm_client callers."""
+    stats = [m for name, m in llm_client.metrics().items() if name.startswith("patient_auditor")]
+    return (sum(m["calls"] - m["cache_hits"] for m in stats),
+            sum(m["input_tokens"] + m["output_tokens"] for m in stats))
+
+def benchmark(latency: float = 0.2, n_patients: int = MAX_PATIENTS, top_k: int = TOP_K_TRIALS,
+              concurrency: int = AUDIT_CONCURRENCY, patients_path: Path = PATIENTS_PATH) -> Dict:
+    """
+    Times serial, async and batched audits of the same (patient, trial)
+    pairs against utils/fake_openai_server with the given per-call latency,
+    and counts API calls and tokens per patient. Retrieval is skipped (pairs
+    come straight from the catalog) and the response and audit caches are
+    off, so only the audit calls are measured.
+    """
+    global AUDIT_CACHE_ENABLED
+    from utils import fake_openai_server
+
+    server = fake_openai_server.serve(port=0, latency=latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    llm_client.CACHE_ENABLED = AUDIT_CACHE_ENABLED = False
+    llm_client.configure(max_concurrency=concurrency, rpm=1e6, tpm=1e9)
+
+    with open(patients_path, "r", encoding="utf-8") as f:
+        patients = json.load(f)[:n_patients]
+    records = list(catalog)[:top_k]
+    pairs = [({"id": r.nct_id, "score": 1.0}, trial_from_record(r)) for r in records]
+
+    def serial(results):
+        for i, p_raw in enumerate(patients):
+            for rank, (match, trial) in enumerate(pairs):
+                results[(i, rank)] = llm_audit_eligibility(p_raw, trial)
+
+    def fan_out(batched):
+        async def run(results):
+            gate = asyncio.Semaphore(concurrency)
+            sink = lambda key, entry: results.__setitem__(key, {k: entry[k] for k in ("eligible", "reasoning")})
+            await asyncio.gather(*(_audit_patient(i, p, pairs, gate, sink, batched) for i, p in enumerate(patients)))
+        return lambda results: asyncio.run(run(results))
+
+    report, outputs = {}, {}
+    try:
+        for mode, runner in (("serial", serial), ("async", fan_out(False)), ("batch", fan_out(True))):
+            results: Dict = {}
+            calls, tokens = _usage_snapshot()
+            started = time.perf_counter()
+            runner(results)
+            elapsed = time.perf_counter() - started
+            after_calls, after_tokens = _usage_snapshot()
+            outputs[mode] = [results[k] for k in sorted(results)]
+            report[mode] = {
+                "seconds": round(elapsed, 3),
+                "calls_per_patient": (after_calls - calls) / len(patients),
+                "tokens_per_patient": (after_tokens - tokens) / len(patients),
+            }
+    finally:
+        server.shutdown()
+
+    # The fake LLM's verdicts depend only on the trial, so every mode must agree
+    assert outputs["serial"] == outputs["async"] == outputs["batch"]
+    print(f"⏱️ {len(patients)} patients x {len(pairs)} trials @ {latency}s fake latency (cap {concurrency})")
+    for mode, r in report.items():
+        print(f"  {mode:>6}: {r['seconds']:6.2f}s | {r['calls_per_patient']:5.1f} calls/patient | "
+              f"{r['tokens_per_patient']:8,.0f} tokens/patient")
+    return report
 
 if __name__ == "__main__":
-    run_auditor()
+    parser = argparse.ArgumentParser(description="Retrieve and LLM-audit trials for synthetic patients")
+    parser.add_argument("--mode", choices=["async", "batch", "serial"], default=AUDIT_MODE)
+    parser.add_argument("--concurrency", type=int, default=AUDIT_CONCURRENCY)
+    parser.add_argument("--max-patients", type=int, default=MAX_PATIENTS)
+    parser.add_argument("--patients", type=Path, default=PATIENTS_PATH)
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH)
+    parser.add_argument("--benchmark", action="store_true", help="serial vs async vs batch against the local fake LLM")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency for --benchmark")
+    parser.add_argument("--top-k", type=int, default=TOP_K_TRIALS, help="trials per patient for --benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.latency, args.max_patients, args.top_k, args.concurrency, args.patients)
+    else:
+        run_auditor(args.mode, args.concurrency, args.patients, args.output, args.max_patients)
@@ -1,10 +1,9 @@
-import os
 import json
 import hashlib
 from pathlib import Path
 from typing import Dict
-from openai import OpenAI
 from dotenv import load_dotenv
+from utils import llm_client
 from utils.app_logger import get_logger
 
 # 1. Config & Logger
@@ -14,8 +13,6 @@ logger = get_logger("ProtocolAgent")
 # THE CACH: Save parsed JSON to avoid re-parsing same text
 PROTOCOL_CACHE_PATH = Path(r"C:\Projects\clinical_trial_agent\data\cache\protocol_parsing_cache.json")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # 2. Logic: The Specialist
 class ProtocolAgent:
     def __init__(self):
@@ -56,16 +53,16 @@ class ProtocolAgent:
         """
 
         try:
-            response = client.chat.completions.create(
+            response = llm_client.complete(
+                "You are a clinical data scientist. Output valid JSON only.",
+                prompt,
                 model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a clinical data scientist. Output valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                api="chat",
+                caller="protocol_agent",
             )
             
-            structured_data = json.loads(response.choices[0].message.content)
+            structured_data = response.json()
             
             # 3. Update the Catch
             self.cache[text_hash] = structured_data
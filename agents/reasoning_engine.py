@@ -1,24 +1,27 @@
 import os
 import json
 from typing import List, Dict
-from openai import OpenAI
-from pinecone import Pinecone
 from dotenv import load_dotenv
 from pathlib import Path
 
+from utils.query_embedding_cache import get_query_embedding, get_query_embeddings, query_key
+from utils.criteria_matcher import CriteriaMatcher
+from utils.trial_catalog import get_catalog
+from vector_store.vector_index import fetch_metadata, get_index, query_many
+
 load_dotenv()
 
 # Configuration
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("PINECONE_INDEX", "clinical-trials")
 OUTPUT_PATH = Path("data/matches/patient_trial_matches.json")
-# 💰 CREDIT SAVER: Cache for embeddings
-EMBED_CACHE_PATH = Path("data/cache/patient_embed_cache.json")
+# 💰 CREDIT SAVER: patient -> query key map (vectors live in utils.query_embedding_cache)
+PATIENT_KEYS_PATH = Path("data/cache/patient_query_keys.json")
 
 # Clients
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(INDEX_NAME)
+index = get_index()  # Pinecone or local, per VECTOR_BACKEND
+catalog = get_catalog()  # trial details resolved by ID, parsed once
+
+# Veto matcher: catalog trials are keyed by ID, legacy payloads by their criteria JSON
+_veto_matcher = CriteriaMatcher(strip=False)
 
 def load_cache(path: Path) -> Dict:
     if path.exists():
@@ -32,51 +35,57 @@ def save_cache(path: Path, data: Dict):
         json.dump(data, f, indent=2)
 
 def get_embedding_with_cache(text: str, patient_id: str, cache: Dict) -> List[float]:
-    """Checks cache first to save OpenAI credits."""
-    if patient_id in cache:
-        return cache[patient_id]
-    
-    print(f"💸 API CALL: Embedding patient {patient_id}...")
-    resp = client.embeddings.create(model="text-embedding-3-small", input=text)
-    embedding = resp.data[0].embedding
-    
-    # Update cache
-    cache[patient_id] = embedding
-    return embedding
+    """
+    Vectors are cached by (model, normalized query text), so patients with the
+    same conditions share one embedding. `cache` records patient_id -> query key.
+    """
+    cache[patient_id] = query_key(text)
+    return get_query_embedding(text)
 
-def hybrid_search_and_reason(patient: Dict, embed_cache: Dict, top_k: int = 5) -> List[Dict]:
-    # 1. Create a query 
-    query_text = f"Trial for {', '.join(patient.get('conditions', []))}"
-    
-    # 2. Get embedding (Uses Catch/Cache)
-    query_vec = get_embedding_with_cache(query_text, patient["patient_id"], embed_cache)
-
-    # 3. Query Pinecone
-    res = index.query(vector=query_vec, top_k=top_k, include_metadata=True)
+def build_query_text(patient: Dict) -> str:
+    return f"Trial for {', '.join(patient.get('conditions', []))}"
 
+def _enrich_matches(patient: Dict, matches: List[Dict]) -> List[Dict]:
+    """Turns raw index matches into the handoff records consumed by the Critic."""
     enriched_results = []
-    patient_conds = [c.lower() for c in patient.get("conditions", [])]
 
-    for match in res.get("matches", []):
-        meta = match.get("metadata", {})
-        
-        # Parse Criteria safely
+    # Resolve trials through the catalog; unknown IDs fall back to index metadata
+    ids = [str(m.get("id") or (m.get("metadata") or {}).get("nct_id")) for m in matches]
+    records, unknown = catalog.resolve(ids)
+    fallback = {}
+    if unknown:
+        fallback = {i: m["metadata"] for i, m in zip(ids, matches) if m.get("metadata")}
+        fallback.update(fetch_metadata(index, [i for i in unknown if i not in fallback]))
+
+    parsed = []
+    for match, nct_id, record in zip(matches, ids, records):
+        if record is not None:
+            rules = record.exclusion
+            slot = _veto_matcher.add(
+                f"catalog:{nct_id}", {"inclusion": record.inclusion_lc, "exclusion": record.exclusion_lc}
+            )
+            parsed.append((match, record.nct_id, record.title, record.criteria, rules, slot))
+            continue
+
+        # Parse Criteria safely (older payloads carried them as JSON)
+        meta = fallback.get(nct_id, {})
         criteria_raw = meta.get("structured_criteria")
         criteria_dict = json.loads(criteria_raw) if isinstance(criteria_raw, str) else {"inclusion": [], "exclusion": []}
+        slot = _veto_matcher.add(criteria_raw if isinstance(criteria_raw, str) else "", criteria_dict)
+        parsed.append((match, meta.get("nct_id"), meta.get("title", ""), criteria_dict, criteria_dict.get("exclusion", []), slot))
+
+    # Initial reasoning: every exclusion rule containing a patient condition vetoes
+    vetoes = _veto_matcher.match(patient.get("conditions", []), [p[-1] for p in parsed])
 
-        # Initial reasoning
-        eligible = True
-        reasons = []
-        for rule in criteria_dict.get("exclusion", []):
-            if any(cond in rule.lower() for cond in patient_conds):
-                eligible = False
-                reasons.append(f"Reasoning Engine Veto: {rule}")
+    for (match, nct_id, title, criteria_dict, rules, _), (exc_hits, _) in zip(parsed, vetoes):
+        reasons = [f"Reasoning Engine Veto: {rules[i]}" for i in exc_hits]
+        eligible = not reasons
 
         # Handoff context for the Critic
         enriched_results.append({
             "patient_id": patient["patient_id"],
-            "nct_id": meta.get("nct_id"),
-            "title": meta.get("title", ""),
+            "nct_id": nct_id,
+            "title": title,
             "eligible": eligible,
             "reasons": reasons,
             "match_score": round(match.get("score", 0), 4),
@@ -89,9 +98,42 @@ def hybrid_search_and_reason(patient: Dict, embed_cache: Dict, top_k: int = 5) -
 
     return enriched_results
 
+def hybrid_search_and_reason(patient: Dict, embed_cache: Dict, top_k: int = 5) -> List[Dict]:
+    # 1. Create a query 
+    query_text = build_query_text(patient)
+    
+    # 2. Get embedding (Uses Catch/Cache)
+    query_vec = get_embedding_with_cache(query_text, patient["patient_id"], embed_cache)
+
+    # 3. Query the vector index (IDs only; the catalog supplies titles and criteria)
+    res = index.query(vector=query_vec, top_k=top_k, include_metadata=False)
+
+    return _enrich_matches(patient, res.get("matches", []))
+
+def batch_hybrid_search_and_reason(patients: List[Dict], embed_cache: Dict, top_k: int = 5) -> Dict[str, List[Dict]]:
+    """
+    Cohort variant of hybrid_search_and_reason: stacks every patient's query
+    vector and retrieves all top-k lists in one vectorized pass (chunked by
+    the index). Returns {patient_id: enriched_results}, ready to be handed to
+    the workflow as candidate_trials.
+    """
+    # Distinct uncached query texts are embedded in batched requests
+    texts = [build_query_text(p) for p in patients]
+    query_vecs = get_query_embeddings(texts)
+    for p, text in zip(patients, texts):
+        embed_cache[p["patient_id"]] = query_key(text)
+
+    # IDs only; the catalog supplies titles and criteria
+    responses = query_many(index, query_vecs, top_k=top_k, include_metadata=False)
+
+    return {
+        p["patient_id"]: _enrich_matches(p, res.get("matches", []))
+        for p, res in zip(patients, responses)
+    }
+
 if __name__ == "__main__":
     # Load Catch
-    embed_cache = load_cache(EMBED_CACHE_PATH)
+    embed_cache = load_cache(PATIENT_KEYS_PATH)
     
     test_patient = {
         "patient_id": "PAT_0001",
@@ -108,6 +150,6 @@ if __name__ == "__main__":
         json.dump(matches, f, indent=2)
     
     # 💰 SAVE THE CATCH
-    save_cache(EMBED_CACHE_PATH, embed_cache)
+    save_cache(PATIENT_KEYS_PATH, embed_cache)
     
     print(f"✅ Handoff file created for Critic: {OUTPUT_PATH}")
@@ -1,14 +1,75 @@
-from fastapi import FastAPI
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from fastapi.responses import HTMLResponse
+import os
+import json
+import asyncio
+import codecs
+import hashlib
+from html import escape
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Query, Request
+from pydantic import BaseModel, Field, ValidationError
+from typing import AsyncIterator, Dict, List, Optional
+from fastapi.responses import HTMLResponse, StreamingResponse
+
+from utils import disk_cache
+from utils.app_logger import get_logger
+from utils.patient_index import PatientIndex
+from utils.trial_catalog import get_catalog
+
+logger = get_logger("EligibilityAPI")
+
+# Pipeline requests block on retrieval, embeddings and the critic; they run on
+# this many worker threads so the event loop keeps serving other requests
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+# Batch endpoint: patients parsed and retrieved together, the unit of memory use
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+MAX_RECORD_BYTES = 1_000_000  # one patient record; larger means malformed input
+
+# -----------------------------
+# Shared State (loaded once per process)
+# -----------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads the trial catalog, vector index, embedding store, workflow and
+    recruitment index before the first request; every request shares them.
+    """
+    from agents.reasoning_engine import build_query_text, index
+    from graph.workflow_manager import build_workflow
+    from utils import query_embedding_cache
+
+    app.state.executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+    loop = asyncio.get_running_loop()
+
+    def load():
+        app.state.catalog = get_catalog()
+        app.state.index = index
+        query_embedding_cache.get_store()
+        app.state.workflow = build_workflow()  # critic budgets are per request (run_pipeline)
+        app.state.patient_index = PatientIndex.from_file(query_text=build_query_text, index=index)
+        app.state.patient_index.warm(app.state.catalog)
+
+    await loop.run_in_executor(app.state.executor, load)
+    logger.info(f"🚀 Ready: {len(app.state.catalog)} trials, {len(app.state.patient_index.patients)} patients, "
+                f"{PIPELINE_WORKERS} pipeline workers")
+    try:
+        yield
+    finally:
+        app.state.executor.shutdown(wait=True)
+        disk_cache.flush()
+        query_embedding_cache.save()
 
 app = FastAPI(
     title="🧬 Clinical Trial Eligibility API",
     description="Check patient eligibility for trials with JSON or HTML (clinician-friendly) output.",
-    version="1.1"
+    version="1.2",
+    lifespan=lifespan,
 )
 
+async def offload(request: Request, fn, *args):
+    """Runs blocking work on the pipeline pool."""
+    return await asyncio.get_running_loop().run_in_executor(request.app.state.executor, fn, *args)
+
 # -----------------------------
 # Patient Model (optional fields, examples for Swagger)
 # -----------------------------
@@ -18,71 +79,311 @@ class PatientCriteria(BaseModel):
     conditions: Optional[List[str]] = Field([], description="List of medical conditions", example=["diabetes"])
     medications: Optional[List[str]] = Field([], description="List of current medications", example=["metformin"])
 
+class BatchPatient(PatientCriteria):
+    patient_id: Optional[str] = Field(None, description="Caller's patient reference, echoed back", example="PAT_00001")
+
+class MatchRequest(BatchPatient):
+    max_trials: int = Field(10, ge=1, le=50, description="Trials retrieved before filtering")
+
 # -----------------------------
-# Sample Trials
+# Result Schema (shared by /match, /check_eligibility and every batch line)
 # -----------------------------
-TRIALS = [
-    {"trial_id": 1, "name": "Trial A", "min_age": 18, "max_age": 65, "exclude_conditions": ["cancer"]},
-    {"trial_id": 2, "name": "Trial B", "min_age": 50, "max_age": 80, "exclude_conditions": []},
-    {"trial_id": 3, "name": "Trial C", "min_age": 30, "max_age": 60, "exclude_conditions": ["diabetes"]}
-]
+class TrialMatch(BaseModel):
+    nct_id: str
+    title: str
+    eligible: bool
+    reasons: List[str]
+    match_score: Optional[float] = None
+    critic_tier: Optional[str] = None
+
+class MatchResponse(BaseModel):
+    patient_id: str
+    patient: PatientCriteria
+    eligible_trials: List[TrialMatch]
+    ineligible_trials: List[TrialMatch]
+
+class BatchMatchLine(MatchResponse):
+    index: int  # position in the request body; lines arrive in completion order
 
 # -----------------------------
-# Eligibility Logic
+# Matching Pipeline (retrieve -> fast filter -> critic)
 # -----------------------------
-def evaluate_trial(patient, trial):
-    reasons = []
+def pipeline_patient(request: PatientCriteria) -> Dict:
+    """
+    Workflow input for an API patient. The id is derived from the clinical
+    content, so identical patients in one batch share a retrieval.
+    """
+    clinical = {
+        "demographics": {"age": request.age, "sex": request.sex},
+        "conditions": request.conditions or [],
+        "medications": request.medications or [],
+    }
+    digest = hashlib.sha256(json.dumps(clinical, sort_keys=True).encode()).hexdigest()[:16]
+    return {"patient_id": f"API_{digest}", **clinical}
 
-    # Age check
-    if patient.get("age") is not None:
-        if not (trial["min_age"] <= patient["age"] <= trial["max_age"]):
-            reasons.append(f"Age {patient['age']} not in range {trial['min_age']}-{trial['max_age']}")
-    else:
-        reasons.append("Age not provided")
+def run_pipeline(workflow, patient: Dict, max_trials: int, candidates: Optional[List[Dict]] = None,
+                 embed_cache: Optional[Dict] = None, critic_budget=None) -> Dict:
+    """
+    Always runs the pipeline: API results skip the workflow_patient cache,
+    whose records do not track max_trials or catalog/index changes. The
+    shared retrieval, embedding and critic caches still apply. critic_budget
+    defaults to a fresh CRITIC_LLM_* budget for this call.
+    """
+    from agents.critic_agent import CriticBudget
+
+    state = {
+        "patient": patient,
+        "embed_cache": {} if embed_cache is None else embed_cache,
+        "max_trials": max_trials,
+        "persist": False,
+        "critic_budget": critic_budget or CriticBudget.from_env(),
+    }
+    if candidates is not None:
+        state["candidate_trials"] = candidates  # retrieved for the whole batch already
+    return workflow.invoke(state)["final"]
 
-    # Conditions check
-    patient_conditions = patient.get("conditions") or []
-    excluded_conditions = [c for c in patient_conditions if c in trial["exclude_conditions"]]
-    if excluded_conditions:
-        reasons.append(f"Excluded conditions: {', '.join(excluded_conditions)}")
+def match_response(body: BatchPatient, patient: Dict, final: Dict) -> Dict:
+    """Pipeline result as a MatchResponse dict, the one shape every endpoint returns."""
+    trials = []
+    for t in final["trials"]:
+        reasons = t.get("final_reason") or t["reasons"]
+        trials.append(TrialMatch(
+            nct_id=t["nct_id"],
+            title=t["title"],
+            eligible=bool(t["final_eligible"]),
+            reasons=reasons if isinstance(reasons, list) else [str(reasons)],
+            match_score=t["match_score"],
+            critic_tier=t.get("critic_tier"),
+        ))
 
-    eligible = len(reasons) == 0
-    reason_text = "Eligible" if eligible else "; ".join(reasons)
+    return MatchResponse(
+        patient_id=body.patient_id or patient["patient_id"],
+        patient=PatientCriteria(**body.dict(exclude={"patient_id", "max_trials"})),
+        eligible_trials=[t for t in trials if t.eligible],
+        ineligible_trials=[t for t in trials if not t.eligible],
+    ).dict()
 
-    return {
-        "trial_id": trial["trial_id"],
-        "name": trial["name"],
-        "eligible": eligible,
-        "reason": reason_text
-    }
+@app.post("/match", response_model=MatchResponse)
+async def match_patient(body: MatchRequest, request: Request):
+    patient = pipeline_patient(body)
+    final = await offload(request, run_pipeline, request.app.state.workflow, patient, body.max_trials)
+    return match_response(body, patient, final)
 
 # -----------------------------
 # JSON Response Endpoint
 # -----------------------------
-@app.post("/check_eligibility")
-def check_eligibility(patient: PatientCriteria):
-    patient_data = patient.dict()
-    trials_result = [evaluate_trial(patient_data, t) for t in TRIALS]
+# Same pipeline and result schema as /match and each /check_eligibility/batch line
+@app.post("/check_eligibility", response_model=MatchResponse)
+async def check_eligibility(
+    body: BatchPatient,
+    request: Request,
+    max_trials: int = Query(10, ge=1, le=50, description="Trials retrieved before filtering"),
+):
+    patient = pipeline_patient(body)
+    final = await offload(request, run_pipeline, request.app.state.workflow, patient, max_trials)
+    return match_response(body, patient, final)
 
-    eligible_trials = [t for t in trials_result if t["eligible"]]
-    ineligible_trials = [t for t in trials_result if not t["eligible"]]
+# -----------------------------
+# Batch Eligibility (NDJSON streaming)
+# -----------------------------
+# Request bodies are parsed incrementally and patients are processed
+# BATCH_CHUNK_SIZE at a time (one vectorized retrieval per chunk, then the
+# critic per patient), so memory does not grow with the batch. Each result
+# is written as one NDJSON line as soon as its patient completes.
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that may read the request body while streaming.
+    Starlette's default disconnect listener consumes receive() messages,
+    which would swallow body chunks not yet parsed; disconnects surface as
+    ClientDisconnect from the body reader instead.
+    """
+    media_type = "application/x-ndjson"
 
-    return {
-        "patient": patient_data,
-        "eligible_trials": eligible_trials,
-        "ineligible_trials": ineligible_trials
-    }
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+class BodyError(ValueError):
+    """The request body cannot be read any further (records already parsed still count)."""
+
+async def ndjson_records(chunks: AsyncIterator[bytes]):
+    """One dict per non-empty line; an unparseable line yields its ValueError."""
+    decoder, buffer = codecs.getincrementaldecoder("utf-8")(), ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield e
+        if len(buffer) > MAX_RECORD_BYTES:
+            raise BodyError("NDJSON line too long")
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except ValueError as e:
+            yield e
+
+async def json_array_records(chunks: AsyncIterator[bytes]):
+    """Items of a top-level JSON array, decoded one at a time as the body arrives."""
+    decoder, parser = codecs.getincrementaldecoder("utf-8")(), json.JSONDecoder()
+    buffer, pos, opened = "", 0, False
+    async for chunk in chunks:
+        buffer = buffer[pos:] + decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not opened:
+                if buffer[pos] != "[":
+                    raise BodyError("Expected a JSON array of patients")
+                opened, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = parser.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # record continues in the next chunk
+            yield item
+        if len(buffer) - pos > MAX_RECORD_BYTES:
+            raise BodyError("Malformed JSON array (record too large)")
+    raise BodyError("Truncated JSON array")
+
+async def chunked(records, size: int):
+    """Lists of up to size records; a BodyError ends the last one."""
+    chunk = []
+    try:
+        async for record in records:
+            chunk.append(record)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    except BodyError as e:
+        chunk.append(e)
+    if chunk:
+        yield chunk
+
+def retrieve_batch(patients: List[Dict], embed_cache: Dict, max_trials: int) -> Dict[str, List[Dict]]:
+    from agents.reasoning_engine import batch_hybrid_search_and_reason
+    return batch_hybrid_search_and_reason(patients, embed_cache, top_k=max_trials)
+
+async def stream_batch(request: Request, records, max_trials: int):
+    from agents.critic_agent import CriticBudget
+
+    state = request.app.state
+    index = done = errors = 0
+    budget = CriticBudget.from_env()  # one request, one budget across its patients
+
+    async def run_one(i: int, body: BatchPatient, patient: Dict, candidates, embed_cache) -> Dict:
+        try:
+            final = await offload(request, run_pipeline, state.workflow, patient, max_trials, candidates, embed_cache, budget)
+            return BatchMatchLine(index=i, **match_response(body, patient, final)).dict()
+        except Exception as e:
+            logger.error(f"❌ Batch patient {i} failed: {e}")
+            return {"index": i, "patient_id": body.patient_id, "error": str(e)}
+
+    async for chunk in chunked(records, BATCH_CHUNK_SIZE):
+        valid, body_error = [], None
+        for record in chunk:
+            if isinstance(record, BodyError):
+                body_error = record
+                continue
+            i, index = index, index + 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                body = BatchPatient.parse_obj(record)
+            except (ValueError, ValidationError) as e:
+                errors += 1
+                yield json.dumps({"index": i, "error": f"Invalid patient record: {e}"}) + "\n"
+                continue
+            valid.append((i, body, pipeline_patient(body)))
+
+        if valid:
+            embed_cache: Dict[str, str] = {}
+            try:
+                candidates = await offload(request, retrieve_batch, [p for _, _, p in valid], embed_cache, max_trials)
+            except Exception as e:
+                logger.error(f"❌ Batch retrieval failed: {e}")
+                candidates = {}  # each patient falls back to its own retrieval
+
+            tasks = [run_one(i, body, p, candidates.get(p["patient_id"]), embed_cache) for i, body, p in valid]
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                done += "error" not in result
+                errors += "error" in result
+                yield json.dumps(result) + "\n"
+
+        if body_error is not None:
+            # The status is already sent, so an unreadable body is reported in-band
+            errors += 1
+            yield json.dumps({"error": str(body_error)}) + "\n"
+
+    yield json.dumps({"summary": {"patients": index, "completed": done, "errors": errors}}) + "\n"
+
+@app.post("/check_eligibility/batch")
+async def check_eligibility_batch(
+    request: Request,
+    max_trials: int = Query(10, ge=1, le=50, description="Trials retrieved per patient"),
+):
+    """
+    Body: a JSON array of patients (application/json) or one patient per line
+    (application/x-ndjson). Response: one NDJSON line per patient (a
+    MatchResponse, as from /check_eligibility, plus its input index) in
+    completion order, then a summary line.
+    """
+    content_type = request.headers.get("content-type", "")
+    ndjson = "ndjson" in content_type or "jsonl" in content_type
+    records = (ndjson_records if ndjson else json_array_records)(request.stream())
+    return NDJSONStreamingResponse(stream_batch(request, records, max_trials))
+
+@app.get("/health")
+async def health(request: Request):
+    state = request.app.state
+    return {"trials": len(state.catalog), "patients": len(state.patient_index.patients), "workers": PIPELINE_WORKERS}
+
+# -----------------------------
+# Reverse Recruitment (trial -> patients)
+# -----------------------------
+@app.get("/trials/{nct_id}/patients")
+async def recruit_patients(
+    request: Request,
+    nct_id: str,
+    page: int = Query(1, ge=1, description="1-based page number"),
+    page_size: int = Query(20, ge=1, le=500, description="Patients per page"),
+):
+    trial = request.app.state.catalog.get(nct_id)
+    if trial is None:
+        raise HTTPException(status_code=404, detail=f"Unknown trial {nct_id}")
+    # Sub-millisecond over the warmed index, so it stays on the event loop
+    return request.app.state.patient_index.search(trial, page=page, page_size=page_size)
 
 # -----------------------------
 # HTML Response Endpoint (clinician-friendly)
 # -----------------------------
 @app.post("/check_eligibility_html", response_class=HTMLResponse)
-def check_eligibility_html(patient: PatientCriteria):
-    patient_data = patient.dict()
-    trials_result = [evaluate_trial(patient_data, t) for t in TRIALS]
+async def check_eligibility_html(
+    body: BatchPatient,
+    request: Request,
+    max_trials: int = Query(10, ge=1, le=50, description="Trials retrieved before filtering"),
+):
+    result = await check_eligibility(body, request, max_trials)
+    patient_data = result["patient"]
 
-    eligible_trials = [t for t in trials_result if t["eligible"]]
-    ineligible_trials = [t for t in trials_result if not t["eligible"]]
+    def render(trials, css, mark):
+        rows = [
+            f'<div class="trial {css}">{escape(t["nct_id"])}. {escape(t["title"])} {mark} '
+            f'{escape("; ".join(t["reasons"]))}</div>'
+            for t in trials
+        ]
+        return "<br>".join(rows) or "<p>None</p>"
 
     html = f"""
     <html>
@@ -98,16 +399,16 @@ def check_eligibility_html(patient: PatientCriteria):
     </head>
     <body>
         <h2>Patient Info</h2>
-        <p>Age: {patient_data.get('age', 'N/A')}</p>
-        <p>Sex: {patient_data.get('sex', 'N/A')}</p>
-        <p>Conditions: {', '.join(patient_data.get('conditions', []) or ['None'])}</p>
-        <p>Medications: {', '.join(patient_data.get('medications', []) or ['None'])}</p>
+        <p>Age: {escape(str(patient_data.get('age') or 'N/A'))}</p>
+        <p>Sex: {escape(str(patient_data.get('sex') or 'N/A'))}</p>
+        <p>Conditions: {escape(', '.join(patient_data.get('conditions') or ['None']))}</p>
+        <p>Medications: {escape(', '.join(patient_data.get('medications') or ['None']))}</p>
 
         <div class="section-title">Eligible Trials</div>
-        {"<br>".join([f'<div class="trial eligible">{t["trial_id"]}. {t["name"]} ✅ {t["reason"]}</div>' for t in eligible_trials]) or "<p>None</p>"}
+        {render(result["eligible_trials"], "eligible", "✅")}
 
         <div class="section-title">Ineligible Trials</div>
-        {"<br>".join([f'<div class="trial ineligible">{t["trial_id"]}. {t["name"]} ❌ {t["reason"]}</div>' for t in ineligible_trials]) or "<p>None</p>"}
+        {render(result["ineligible_trials"], "ineligible", "❌")}
     </body>
     </html>
     """
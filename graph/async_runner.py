@@ -0,0 +1,136 @@
+# graph/async_runner.py
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Add the project root to the search path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from graph.workflow_manager import build_workflow
+from utils import disk_cache
+from utils.app_logger import get_logger
+from utils.rate_limit import TokenBucket
+from utils.retry import aretry
+
+logger = get_logger("AsyncRunner")
+
+PATIENTS_PATH = "data/patients/synthetic_patients.json"
+
+# -----------------------------
+# Defaults
+# -----------------------------
+CONCURRENCY = 32       # patients in flight at once
+MAX_TRIALS = 10
+RETRIES = 3
+PROGRESS_EVERY = 100   # log throughput every N finished patients
+
+
+class _Progress:
+    def __init__(self, total: int, every: int):
+        self.total = total
+        self.every = every
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+
+    def tick(self, ok: bool):
+        self.done += 1
+        self.failed += 0 if ok else 1
+        if self.done % self.every == 0 or self.done == self.total:
+            elapsed = time.perf_counter() - self.started
+            rate = self.done / elapsed * 60 if elapsed else 0.0
+            logger.info(
+                f"⏱️ {self.done}/{self.total} patients ({self.failed} failed) "
+                f"| {rate:,.0f} patients/min | {elapsed:,.1f}s elapsed"
+            )
+
+
+async def run_cohort_async(
+    patients: List[Dict],
+    concurrency: int = CONCURRENCY,
+    max_trials: int = MAX_TRIALS,
+    stage_limits: Optional[Dict[str, TokenBucket]] = None,
+    retries: int = RETRIES,
+    progress_every: int = PROGRESS_EVERY,
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Runs the matching graph for every patient with `workflow.ainvoke`, at most
+    `concurrency` at a time. Each patient is retried with jittered backoff;
+    results come back in input order (None for patients that kept failing).
+    """
+    workflow = build_workflow(stage_limits)
+    embed_cache: Dict[str, str] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = _Progress(len(patients), progress_every)
+
+    # Sync nodes run on the loop's default executor; size it to the concurrency cap
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="workflow")
+    loop.set_default_executor(executor)
+
+    async def run_one(patient: Dict):
+        state = {"patient": patient, "embed_cache": embed_cache, "max_trials": max_trials}
+        async with semaphore:
+            try:
+                result = await aretry(
+                    lambda: workflow.ainvoke(state),
+                    attempts=retries,
+                    label=f"patient {patient['patient_id']}",
+                )
+                progress.tick(True)
+                return result["final"]
+            except Exception as e:
+                logger.error(f"❌ {patient['patient_id']} failed after {retries} attempts: {e}")
+                progress.tick(False)
+                return None
+
+    try:
+        return await asyncio.gather(*(run_one(p) for p in patients))
+    finally:
+        disk_cache.flush()
+        executor.shutdown(wait=False)
+
+
+def run_cohort(patients: List[Dict], **kwargs) -> List[Optional[Dict[str, Any]]]:
+    return asyncio.run(run_cohort_async(patients, **kwargs))
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent cohort matching")
+    parser.add_argument("--limit", type=int, default=None, help="only the first N patients")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--max-trials", type=int, default=MAX_TRIALS)
+    parser.add_argument("--retries", type=int, default=RETRIES)
+    parser.add_argument("--retrieve-per-min", type=float, default=None, help="rate cap on the retrieve stage")
+    parser.add_argument("--critic-per-min", type=float, default=None, help="rate cap on the critic stage")
+    args = parser.parse_args()
+
+    with open(PATIENTS_PATH, "r", encoding="utf-8") as f:
+        patients = json.load(f)[:args.limit]
+
+    limits = {}
+    if args.retrieve_per_min:
+        limits["retrieve"] = TokenBucket.per_minute(args.retrieve_per_min)
+    if args.critic_per_min:
+        limits["critic"] = TokenBucket.per_minute(args.critic_per_min)
+
+    started = time.perf_counter()
+    results = run_cohort(
+        patients,
+        concurrency=args.concurrency,
+        max_trials=args.max_trials,
+        stage_limits=limits,
+        retries=args.retries,
+    )
+    elapsed = time.perf_counter() - started
+    ok = sum(r is not None for r in results)
+    print(f"✅ {ok}/{len(patients)} patients in {elapsed:,.1f}s ({ok / elapsed * 60:,.0f} patients/min)")
@@ -0,0 +1,186 @@
+# graph/sharded_runner.py
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
+
+# Add the project root to the search path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.app_logger import get_logger
+
+logger = get_logger("ShardedRunner")
+
+# -----------------------------
+# Configuration
+# -----------------------------
+PATIENTS_PATH = Path("data/patients/synthetic_patients.json")
+SHARD_DIR = Path("data/matches/shards")
+REPORT_PATH = Path("data/matches/final_workflow_report.json")
+
+WORKERS = os.cpu_count() or 4
+MAX_TRIALS = 10
+FLUSH_EVERY = 200  # patients between cache flushes inside a worker
+
+
+def shard_path(shard: int) -> Path:
+    return SHARD_DIR / f"shard_{shard:03d}.jsonl"
+
+
+def to_report_entry(final: Dict) -> Dict:
+    """workflow_patient record -> final_workflow_report.json entry."""
+    if "verified_trials" in final:  # already in report shape (older workflow_patient records)
+        return {"patient_id": final["patient_id"], "verified_trials": final["verified_trials"]}
+    verified = []
+    for t in final.get("trials", []):
+        eligible = t.get("final_eligible")
+        verified.append({
+            "nct_id": t.get("nct_id"),
+            "title": t.get("title", ""),
+            "eligible": bool(t.get("eligible") if eligible is None else eligible),
+            "score": t.get("match_score"),
+            "reasoning": t.get("final_reason") or t.get("reasons") or "Clinical criteria met.",
+        })
+    return {"patient_id": final["patient_id"], "verified_trials": verified}
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+def _run_shard(shard: int, patients: List[Dict], max_trials: int, critic_share: float = 1.0) -> Dict:
+    """
+    Runs one shard in its own process. Every finished patient is appended
+    to the shard's JSONL file, which is the completion marker: patients
+    already in it are skipped, so a restarted shard resumes after its last
+    completed patient. Patients persisted in the workflow_patient cache are
+    written from there without running again. The shard gets
+    critic_share of the run's LLM critic budget.
+    """
+    from agents.critic_agent import CriticBudget
+    from graph.workflow_manager import build_workflow  # heavy imports stay in the worker
+    from utils import disk_cache, query_embedding_cache
+
+    workflow = build_workflow(critic_budget=CriticBudget.from_env(share=critic_share))
+    path = shard_path(shard)
+    written = set()
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    written.add(json.loads(line)["patient_id"])
+                except (json.JSONDecodeError, KeyError):
+                    continue  # torn last line from a crash
+
+    embed_cache: Dict[str, str] = {}
+    done = skipped = failed = 0
+    with open(path, "a", encoding="utf-8") as out:
+        for patient in patients:
+            pid = patient["patient_id"]
+            if pid in written:
+                # Already in the shard file, which is flushed per patient; the cache is write-behind
+                skipped += 1
+                continue
+            final = disk_cache.load("workflow_patient", pid)
+            if final is None:
+                try:
+                    state = workflow.invoke({
+                        "patient": patient,
+                        "embed_cache": embed_cache,
+                        "max_trials": max_trials,
+                    })
+                    final = state["final"]
+                    done += 1
+                except Exception as e:
+                    logger.error(f"❌ [shard {shard}] {pid} failed: {e}")
+                    failed += 1
+                    continue
+            else:
+                skipped += 1
+
+            out.write(json.dumps(to_report_entry(final)) + "\n")
+            out.flush()
+            written.add(pid)
+
+            if (done + skipped) % FLUSH_EVERY == 0:
+                disk_cache.flush()
+                query_embedding_cache.save()
+
+    # Pool workers exit without running atexit hooks
+    disk_cache.flush()
+    query_embedding_cache.save()
+    return {"shard": shard, "done": done, "skipped": skipped, "failed": failed}
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def merge_shards(patients: List[Dict], n_shards: int, report_path: Path = REPORT_PATH) -> int:
+    """Concatenates shard files into the report, in cohort order."""
+    entries = {}
+    for shard in range(n_shards):
+        path = shard_path(shard)
+        if not path.exists():
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[entry["patient_id"]] = entry
+
+    report = [entries[p["patient_id"]] for p in patients if p["patient_id"] in entries]
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = report_path.with_name(report_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, report_path)
+    return len(report)
+
+
+def run_sharded(
+    patients: List[Dict],
+    workers: int = WORKERS,
+    max_trials: int = MAX_TRIALS,
+    report_path: Path = REPORT_PATH,
+) -> List[Dict]:
+    """
+    Splits the cohort round-robin into `workers` shards (stable across runs,
+    so a restart resumes the same shards) and merges them into the report.
+    """
+    SHARD_DIR.mkdir(parents=True, exist_ok=True)
+    shards = [patients[i::workers] for i in range(workers)]
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_shard, i, shard, max_trials, 1 / len(shards)) for i, shard in enumerate(shards)]
+        summaries = []
+        for fut in as_completed(futures):
+            summary = fut.result()
+            summaries.append(summary)
+            logger.info(
+                f"✅ Shard {summary['shard']}: {summary['done']} matched, "
+                f"{summary['skipped']} resumed from cache, {summary['failed']} failed"
+            )
+
+    merged = merge_shards(patients, workers, report_path)
+    logger.info(f"🏁 Merged {merged} patients into {report_path} in {time.perf_counter() - started:,.1f}s")
+    return sorted(summaries, key=lambda s: s["shard"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded, resumable cohort matching")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--limit", type=int, default=None, help="only the first N patients")
+    parser.add_argument("--max-trials", type=int, default=MAX_TRIALS)
+    args = parser.parse_args()
+
+    with open(PATIENTS_PATH, "r", encoding="utf-8") as f:
+        cohort = json.load(f)[:args.limit]
+
+    run_sharded(cohort, workers=args.workers, max_trials=args.max_trials)
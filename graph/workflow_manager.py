@@ -1,18 +1,32 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, TypedDict
 from langgraph.graph import StateGraph, END
 
 from agents.reasoning_engine import hybrid_search_and_reason
-from agents.critic_agent import critic_verify
+from agents.critic_agent import CriticBudget, critic_verify_many
 from utils.disk_cache import load, save
-
-class WorkflowState(Dict[str, Any]):
-    pass
+from utils.rate_limit import TokenBucket
+
+class WorkflowState(TypedDict, total=False):
+    # LangGraph only carries the keys declared here between nodes
+    patient: Dict[str, Any]
+    embed_cache: Dict[str, Any]
+    max_trials: int
+    candidate_trials: List[Dict[str, Any]]
+    fast_path: List[Dict[str, Any]]
+    verified: List[Dict[str, Any]]
+    final: Dict[str, Any]
+    persist: bool  # False: neither read nor write the workflow_patient cache (ad-hoc API patients)
+    critic_budget: CriticBudget  # per-invocation override of the workflow's critic budget
 
 # -----------------------------
 # Nodes
 # -----------------------------
 
 def retrieve_node(state: WorkflowState):
+    # Batch runners precompute candidates with batch_hybrid_search_and_reason
+    if state.get("candidate_trials") is not None:
+        return state
+
     state["candidate_trials"] = hybrid_search_and_reason(
         patient=state["patient"],
         embed_cache=state["embed_cache"],
@@ -37,20 +51,33 @@ def route(state: WorkflowState):
         return "critic"
     return "persist"
 
-def critic_node(state: WorkflowState):
+def critic_node(state: WorkflowState, budget: Optional[CriticBudget] = None):
     verified = []
 
+    # Every trial carries the same patient summary; audit them in one pass.
+    # Rule results are cached per (trial, criteria version, phenotype), so
+    # patients with the same conditions reuse each other's decisions.
+    # Low-confidence rule decisions escalate to the LLM critic within the run's budget.
+    pending = [t for t in state["fast_path"] if t["final_eligible"] is not False]
+    audits = iter(critic_verify_many(
+        [t["Criteria"] for t in pending],
+        pending[0]["patient_summary"] if pending else {},
+        budget,
+        [t.get("nct_id") for t in pending],
+    ))
+
     for t in state["fast_path"]:
         if t["final_eligible"] is False:
             verified.append(t)
             continue
 
-        audit = critic_verify(t["Criteria"], t["patient_summary"])
+        audit = next(audits)
 
         verified.append({
             **t,
             "final_eligible": t["eligible"] and audit["eligible"],
-            "final_reason": audit["reasons"]
+            "final_reason": audit["reasons"],
+            "critic_tier": audit.get("tier", "rule")
         })
 
     state["verified"] = verified
@@ -59,6 +86,10 @@ def critic_node(state: WorkflowState):
 def persist_node(state: WorkflowState):
     pid = state["patient"]["patient_id"]
 
+    if state.get("persist") is False:
+        state["final"] = {"patient_id": pid, "trials": state.get("verified", state["fast_path"])}
+        return state
+
     cached = load("workflow_patient", pid)
     if cached:
         state["final"] = cached
@@ -70,7 +101,9 @@ def persist_node(state: WorkflowState):
     }
 
     save("workflow_patient", pid, result)
-    save("embedding_cache", "global", state["embed_cache"])
+    # Vectors are content-addressed; only the patient -> query key link is stored here
+    if pid in state["embed_cache"]:
+        save("patient_query_key", pid, state["embed_cache"][pid])
 
     state["final"] = result
     return state
@@ -78,13 +111,40 @@ def persist_node(state: WorkflowState):
 # -----------------------------
 # Build Graph
 # -----------------------------
-def build_workflow():
+def _rate_limited(node, bucket: TokenBucket):
+    def limited(state: WorkflowState):
+        bucket.acquire()
+        return node(state)
+    limited.__name__ = node.__name__
+    return limited
+
+def _with_budget(budget: CriticBudget):
+    def critic(state: WorkflowState):
+        return critic_node(state, state.get("critic_budget") or budget)
+    critic.__name__ = critic_node.__name__
+    return critic
+
+def build_workflow(stage_limits: Optional[Dict[str, TokenBucket]] = None, critic_budget: Optional[CriticBudget] = None):
+    """
+    stage_limits maps a node name ("retrieve", "critic", ...) to a shared
+    TokenBucket, capping how often that stage runs across concurrent patients.
+    critic_budget caps LLM critic escalations for everything this workflow
+    runs (default: a fresh CRITIC_LLM_* budget per built workflow).
+    """
+    stage_limits = stage_limits or {}
+    nodes = {
+        "retrieve": retrieve_node,
+        "fast": fast_filter_node,
+        "critic": _with_budget(critic_budget or CriticBudget.from_env()),
+        "persist": persist_node,
+    }
+
     g = StateGraph(WorkflowState)
 
-    g.add_node("retrieve", retrieve_node)
-    g.add_node("fast", fast_filter_node)
-    g.add_node("critic", critic_node)
-    g.add_node("persist", persist_node)
+    for name, node in nodes.items():
+        if name in stage_limits:
+            node = _rate_limited(node, stage_limits[name])
+        g.add_node(name, node)
 
     g.set_entry_point("retrieve")
     g.add_edge("retrieve", "fast")
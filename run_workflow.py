@@ -1,20 +1,36 @@
 #Workflow
 import json
 from graph.workflow_manager import workflow
-from utils.disk_cache import load
+from agents.critic_agent import prewarm_phenotypes
+from agents.reasoning_engine import batch_hybrid_search_and_reason
+from utils import disk_cache
 
 patients = json.loads(
     open("data/patients/synthetic_patients.json").read()
 )
 
-embed_cache = load("embedding_cache", "global") or {}
+embed_cache = {}  # patient_id -> query key, filled during retrieval
 
-for patient in patients[:5]:
+cohort = patients[:5]
+MAX_TRIALS = 10
+
+# One vectorized retrieval for the whole cohort; the graph skips its own query
+candidates = batch_hybrid_search_and_reason(cohort, embed_cache, top_k=MAX_TRIALS)
+
+# Each distinct (phenotype, trial) pair is rule-checked once for the cohort
+print(f"🧬 Critic prewarm: {prewarm_phenotypes(candidates)}")
+
+for patient in cohort:
     state = {
         "patient": patient,
         "embed_cache": embed_cache,
-        "max_trials": 10
+        "max_trials": MAX_TRIALS,
+        "candidate_trials": candidates[patient["patient_id"]]
     }
 
     result = workflow.invoke(state)
     print(f"✅ {patient['patient_id']} done")
+
+# Memory-tier counters, useful for sizing DISK_CACHE_MAX_ENTRIES / _BYTES
+disk_cache.flush()
+print(json.dumps(disk_cache.stats(), indent=2))
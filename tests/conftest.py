@@ -0,0 +1,30 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Modules build their clients at import time; keep them offline
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("VECTOR_BACKEND", "local")
+
+# Data paths (catalog, patients) are relative to the project root
+os.chdir(ROOT)
+
+
+@pytest.fixture(scope="session")
+def patients():
+    import json
+
+    with open(ROOT / "data" / "patients" / "synthetic_patients.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def catalog():
+    from utils.trial_catalog import get_catalog
+
+    return list(get_catalog())
@@ -0,0 +1,90 @@
+import json
+import threading
+
+from utils.criteria_matcher import CriteriaMatcher, _legacy_critic, _legacy_veto
+
+
+def _fast(criteria, conditions, critic, veto):
+    """Critic decision and veto reasons rebuilt from matcher hits, as the agents do."""
+    key = json.dumps(criteria, sort_keys=True)
+    (exc, inc), = critic.match(conditions, [critic.add(key, criteria)])
+    (vexc, _), = veto.match(conditions, [veto.add(key, criteria)])
+    if exc:
+        decision = (False, f"Hard exclusion matched: {critic.normalize(criteria.get('exclusion', []))[exc[0]]}")
+    elif not inc:
+        decision = (False, "No inclusion criteria satisfied")
+    else:
+        decision = (True, "Inclusion met, no exclusions")
+    return decision, [f"Reasoning Engine Veto: {criteria['exclusion'][i]}" for i in vexc]
+
+
+def test_matches_legacy_loops_on_cohort(patients, catalog):
+    criteria = [{"inclusion": list(t.inclusion), "exclusion": list(t.exclusion)} for t in catalog]
+    critic, veto = CriteriaMatcher(strip=True), CriteriaMatcher(strip=False)
+    for p in patients[:500]:
+        for c in criteria:
+            expected = (_legacy_critic(c, p["conditions"]), _legacy_veto(c, p["conditions"]))
+            assert _fast(c, p["conditions"], critic, veto) == expected
+
+
+def test_edge_cases_match_legacy_loops():
+    criteria = [
+        {"inclusion": ["Adults with Type 2 Diabetes"], "exclusion": ["  Asthma requiring steroids", "", "ASTHMA"]},
+        {"inclusion": [], "exclusion": []},
+        {"inclusion": ["Heart failure"], "exclusion": ["Pregnancy"]},
+    ]
+    cohorts = [
+        ["type 2 diabetes"],
+        ["  Asthma "],
+        ["", "heart failure"],
+        [],
+        ["Diabetes", "asthma", "pregnancy"],
+        ["failure\x00pregnancy"],
+    ]
+    critic, veto = CriteriaMatcher(strip=True), CriteriaMatcher(strip=False)
+    for conditions in cohorts:
+        for c in criteria:
+            expected = (_legacy_critic(c, conditions), _legacy_veto(c, conditions))
+            assert _fast(c, conditions, critic, veto) == expected, (conditions, c)
+
+
+def test_trials_added_after_a_condition_is_memoized():
+    matcher = CriteriaMatcher()
+    first = matcher.add("a", {"inclusion": ["asthma"], "exclusion": []})
+    assert matcher.match(["asthma"], [first]) == [((), True)]
+
+    second = matcher.add("b", {"inclusion": [], "exclusion": ["severe asthma", "copd", "asthma (any)"]})
+    assert matcher.add("b", {}) == second  # idempotent per key
+    assert matcher.match(["asthma"], [first, second]) == [((), True), ((0, 2), False)]
+    assert matcher.hits("Asthma") == {first: ((), True), second: ((0, 2), False)}
+
+
+def test_concurrent_adds_and_matches():
+    matcher = CriteriaMatcher()
+    errors = []
+
+    def writer(n):
+        for i in range(200):
+            matcher.add(f"{n}-{i}", {"inclusion": [f"condition {i}"], "exclusion": [f"condition {i} severe"]})
+
+    def reader():
+        try:
+            for i in range(200):
+                matcher.match([f"condition {i}", "condition 1"], [0])
+        except Exception as e:  # e.g. dict changed size during iteration
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(2)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    slots = list(range(400))
+    hits = matcher.match(["condition 1"], slots)
+    assert all(h == _scan(matcher, s, "condition 1") for s, h in zip(slots, hits))
+
+
+def _scan(matcher, slot, cond):
+    return CriteriaMatcher._scan_slot(cond, matcher._exclusion[slot], matcher._inclusion[slot])
@@ -0,0 +1,55 @@
+from typing import Dict
+
+import numpy as np
+
+from utils.criteria_matcher import _legacy_critic
+from utils.eligibility_matrix import SEX_CODES, EligibilityMatrix, _padded_trials, parse_age, terms
+from utils.med_vocab import normalize as vocab_normalize
+from utils.trial_catalog import TrialRecord
+
+
+def _reference(patient: Dict, trial: TrialRecord) -> bool:
+    """Nested-loop definition: rule critic on conditions, plus age and sex bounds."""
+    criteria = {"inclusion": [vocab_normalize(c) for c in trial.inclusion],
+                "exclusion": [vocab_normalize(c) for c in trial.exclusion]}
+    ok, _ = _legacy_critic(criteria, terms(patient.get("conditions", [])))
+    demo = patient.get("demographics") or {}
+    age = demo.get("age")
+    if age is not None and not (parse_age(trial.min_age, 0.0) <= age <= parse_age(trial.max_age, np.inf)):
+        return False
+    sex = SEX_CODES.get(str(demo.get("sex", "")).upper(), 0)
+    trial_sex = SEX_CODES.get(str(trial.sex).upper(), 0)
+    return ok and (not sex or not trial_sex or sex == trial_sex)
+
+
+def test_conditions_match_nested_loop_rules(patients, catalog):
+    cohort, trials = patients[:1500], _padded_trials(catalog, 200)
+    rules_only = EligibilityMatrix.build(cohort, trials, medications=False)
+
+    rng = np.random.default_rng(0)
+    sample = zip(rng.integers(len(cohort), size=20_000), rng.integers(len(trials), size=20_000))
+    mismatches = [(i, j) for i, j in sample if rules_only.matrix[i, j] != _reference(cohort[i], trials[j])]
+    assert not mismatches
+    assert rules_only.matrix.any()
+
+
+def test_medications_only_exclude(patients, catalog):
+    cohort, trials = patients[:1500], _padded_trials(catalog, 200)
+    full = EligibilityMatrix.build(cohort, trials)
+    rules_only = EligibilityMatrix.build(cohort, trials, medications=False)
+    assert not (full.matrix & ~rules_only.matrix).any()
+
+
+def test_empty_vocabulary_is_all_false(catalog):
+    cohort = [{"patient_id": "P1", "conditions": []}, {"patient_id": "P2", "conditions": ["", None]}]
+    em = EligibilityMatrix.build(cohort, catalog)
+    assert em.matrix.shape == (2, len(catalog))
+    assert em.matrix.dtype == bool and not em.matrix.any()
+    assert em.vocabulary == 0
+    assert em.trials_for("P1") == []
+
+
+def test_empty_inputs():
+    assert EligibilityMatrix.build([], []).matrix.shape == (0, 0)
+    em = EligibilityMatrix.build([{"patient_id": "P1", "conditions": ["asthma"]}], [])
+    assert em.matrix.shape == (1, 0) and em.counts("patient") == {"P1": 0}
@@ -0,0 +1,77 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from utils.embedding_service import EmbeddingService, approx_tokens
+
+
+class StubClient:
+    """Records every embeddings.create call; a text's vector is [len(text), call number]."""
+
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, model, input):
+        self.calls.append(list(input))
+        if self.fail:
+            raise ValueError("bad request")
+        data = [SimpleNamespace(index=i, embedding=[float(len(t)), float(len(self.calls))])
+                for i, t in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)), usage=SimpleNamespace(prompt_tokens=len(input)))
+
+
+def test_concurrent_callers_share_one_request():
+    client = StubClient()
+    service = EmbeddingService(client=client, max_wait=0.5)
+    texts = [f"patient {i}" for i in range(20)]
+    results, start = {}, threading.Barrier(len(texts))
+
+    def caller(text):
+        start.wait()
+        results[text] = service.embed(text)
+
+    threads = [threading.Thread(target=caller, args=(t,)) for t in texts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(client.calls) == 1
+    assert sorted(client.calls[0]) == sorted(texts)
+    assert all(results[t] == [float(len(t)), 1.0] for t in texts)
+
+
+def test_duplicate_texts_are_sent_once_and_fanned_out():
+    client = StubClient()
+    service = EmbeddingService(client=client, max_wait=0.2)
+    vectors = service.embed_many(["asthma", "copd", "asthma", "asthma"])
+
+    assert client.calls == [["asthma", "copd"]]
+    assert vectors[0] == vectors[2] == vectors[3] == [6.0, 1.0]
+    assert vectors[1] == [4.0, 1.0]
+    assert service.stats == {"requests": 1, "texts": 4, "unique_texts": 2}
+
+
+def test_batches_respect_item_and_token_caps():
+    client = StubClient()
+    service = EmbeddingService(client=client, max_batch_items=3, max_wait=0.2)
+    texts = [f"t{i}" for i in range(7)]
+    assert service.embed_many(texts) == [[2.0, float(i // 3 + 1)] for i in range(7)]
+    assert [len(c) for c in client.calls] == [3, 3, 1]
+
+    client = StubClient()
+    long = "x" * 400
+    service = EmbeddingService(client=client, max_batch_tokens=approx_tokens(long) + 50, max_wait=0.2)
+    service.embed_many([long + str(i) for i in range(3)])
+    assert [len(c) for c in client.calls] == [1, 1, 1]  # each carried over to the next batch in order
+
+
+def test_failed_batch_fails_every_waiting_caller():
+    service = EmbeddingService(client=StubClient(fail=True), max_wait=0.2)
+    futures = [service.submit(t) for t in ("a", "b", "a")]
+    for f in futures:
+        with pytest.raises(ValueError):
+            f.result(timeout=5)
@@ -0,0 +1,64 @@
+import copy
+
+import pytest
+
+pytest.importorskip("jsonschema")  # criteria_fingerprint lives in format_clinical_trial
+
+from utils import fake_ctgov_server
+from utils.format_clinical_trial import load_raw_trials
+from utils.ingest_clinical_trial import _TrialSink, ingest_raw_trials, iter_ndjson, make_session
+
+
+def _study(nct_id, criteria):
+    return {"protocolSection": {
+        "identificationModule": {"nctId": nct_id, "briefTitle": f"{nct_id} in diabetes"},
+        "conditionsModule": {"conditions": ["Diabetes"]},
+        "eligibilityModule": {"eligibilityCriteria": criteria, "minimumAge": "18 Years", "sex": "ALL"},
+    }}
+
+
+@pytest.fixture
+def ctgov():
+    server = fake_ctgov_server.serve(port=0, studies=[])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _ingest(server, path, maximum=10):
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v2"
+    return ingest_raw_trials(maximum, ["Diabetes"], base_url, str(path), page_size=2, session=make_session(2))
+
+
+def test_changed_eligibility_text_is_appended_again(ctgov, tmp_path):
+    path = tmp_path / "trials.ndjson"
+    path.touch()  # no legacy JSON import
+    studies = [_study(f"NCT{i:08d}", f"Inclusion: adults with diabetes {i}") for i in range(3)]
+    fake_ctgov_server.FakeCtGovHandler.studies = copy.deepcopy(studies)
+    assert _ingest(ctgov, path) == 3
+
+    # Unchanged and whitespace-only edits are not written again
+    studies[0]["protocolSection"]["eligibilityModule"]["eligibilityCriteria"] = "Inclusion:  adults with\ndiabetes 0"
+    studies[1]["protocolSection"]["eligibilityModule"]["eligibilityCriteria"] = "Inclusion: adults with type 2 diabetes"
+    fake_ctgov_server.FakeCtGovHandler.studies = copy.deepcopy(studies)
+    assert _ingest(ctgov, path) == 0
+
+    lines = list(iter_ndjson(str(path)))
+    assert [t["nct_id"] for t in lines] == ["NCT00000000", "NCT00000001", "NCT00000002", "NCT00000001"]
+    latest = {t["nct_id"]: t["eligibilityCriteria"] for t in load_raw_trials(path)}
+    assert latest["NCT00000001"] == "Inclusion: adults with type 2 diabetes"
+    assert latest["NCT00000000"] == "Inclusion: adults with diabetes 0"
+
+
+def test_updates_do_not_use_the_new_trial_budget(tmp_path):
+    path = tmp_path / "trials.ndjson"
+    sink = _TrialSink(str(path), {}, maximum_trials=1)
+    try:
+        assert sink.add({"nct_id": "A", "eligibilityCriteria": "v1"}) is True
+        assert sink.add({"nct_id": "B", "eligibilityCriteria": "v1"}) is False  # budget spent
+        assert sink.add({"nct_id": "A", "eligibilityCriteria": "v2"}) is False  # update, still written
+        assert sink.add({"nct_id": "A", "eligibilityCriteria": " v2 "}) is False  # same text
+    finally:
+        sink.close()
+    assert (sink.added, sink.updated) == (1, 1)
+    assert [(t["nct_id"], t["eligibilityCriteria"]) for t in iter_ndjson(str(path))] == [("A", "v1"), ("A", "v2")]
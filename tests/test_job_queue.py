@@ -0,0 +1,91 @@
+import pytest
+
+from utils.job_queue import DONE, FAILED, PENDING, RUNNING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = JobQueue(tmp_path / "jobs.db")
+    yield q
+    q.close()
+
+
+def test_enqueue_is_idempotent_per_id(queue):
+    assert queue.enqueue({"a": "text a", "b": "text b"}) == 2
+    assert queue.enqueue({"a": "changed", "c": "text c"}) == 1
+    assert queue.claim() == ("a", "text a")
+
+
+def test_failed_jobs_are_retried_and_results_kept(queue):
+    queue.enqueue({"a": 1, "b": 2})
+    job_a, job_b = queue.claim(), queue.claim()
+    queue.complete(job_a[0], {"ok": True})
+    queue.fail(job_b[0], "rate limited")
+    assert queue.claim() is None
+    assert queue.counts() == {PENDING: 0, RUNNING: 0, DONE: 1, FAILED: 1}
+
+    assert queue.requeue_failed() == 1
+    assert queue.claim() == ("b", 2)
+    queue.complete("b", {"ok": "retry"})
+    assert queue.results() == {"a": {"ok": True}, "b": {"ok": "retry"}}
+    attempts = dict(queue._conn.execute("SELECT id, attempts FROM jobs"))
+    assert attempts == {"a": 1, "b": 2}
+
+
+def test_restart_resumes_interrupted_jobs(tmp_path):
+    path = tmp_path / "jobs.db"
+    first = JobQueue(path)
+    first.enqueue({"a": 1, "b": 2, "c": 3})
+    first.complete(first.claim()[0], "done a")
+    first.claim()  # "b" is running when the process dies
+    first.close()
+
+    second = JobQueue(path)
+    assert second.recover() == 1
+    assert [second.claim(), second.claim(), second.claim()] == [("b", 2), ("c", 3), None]
+    assert second.results() == {"a": "done a"}
+    second.close()
+
+
+def test_prune_drops_only_unfinished_jobs_not_kept(queue):
+    queue.enqueue({"a": 1, "b": 2, "c": 3, "d": 4})
+    queue.complete(queue.claim()[0], "done a")
+    queue.fail(queue.claim()[0], "boom")  # b
+    assert queue.prune(["c"]) == 2  # b and d; finished a stays
+    assert queue.results() == {"a": "done a"}
+    assert queue.counts() == {PENDING: 1, RUNNING: 0, DONE: 1, FAILED: 0}
+
+
+def test_run_extraction_resumes_and_retries(tmp_path, monkeypatch):
+    pytest.importorskip("jsonschema")
+    from utils import format_clinical_trial as fct
+
+    calls = []
+
+    def extract(text):
+        calls.append(text)
+        if text == "flaky" and calls.count("flaky") == 1:
+            raise RuntimeError("timeout")
+        return {"inclusion": [text], "exclusion": []}
+
+    monkeypatch.setattr(fct, "extract_criteria", extract)
+    monkeypatch.setattr(fct.llm_client, "configure", lambda **kw: None)
+    trials = [{"nct_id": f"NCT{i}", "eligibilityCriteria": t} for i, t in enumerate(["one", "flaky", "three"])]
+    path = tmp_path / "jobs.db"
+
+    # A previous run finished NCT0, died while NCT2 was running, and queued a job this build dropped
+    old = JobQueue(path)
+    ids = {t["nct_id"]: fct._job_id(t["nct_id"], fct.criteria_fingerprint(t["eligibilityCriteria"])) for t in trials}
+    old.enqueue({ids["NCT0"]: "one", ids["NCT2"]: "three", "NCT9@stale": "gone"})
+    old.complete(old.claim()[0], {"inclusion": ["from the first run"], "exclusion": []})
+    old.claim()
+    old.close()
+
+    cache = {}
+    assert sorted(fct.run_extraction(trials, cache, queue_path=path, workers=2)) == ["NCT0", "NCT2"]
+    assert cache["NCT0"]["criteria"]["inclusion"] == ["from the first run"]
+    assert sorted(calls) == ["flaky", "three"]
+
+    assert sorted(fct.run_extraction(trials, cache, queue_path=path, workers=2)) == ["NCT1"]
+    assert cache["NCT1"]["criteria"]["inclusion"] == ["flaky"]
+    assert "gone" not in calls
@@ -0,0 +1,116 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from agents import patient_auditor as pa
+
+
+def _verdict(patient, trial):
+    """Deterministic stand-in for the model: eligible when a condition is named in the inclusion criteria."""
+    conds = [c.lower() for c in patient["conditions"]]
+    eligible = any(c in text.lower() for c in conds for text in trial.criteria.inclusion)
+    return {"eligible": eligible, "reasoning": f"{trial.nct_id}: {'inclusion met' if eligible else 'no inclusion'}"}
+
+
+class StubLLM:
+    """Answers single and batched audit prompts with _verdict; batch replies can drop or garble items."""
+
+    def __init__(self, trials, drop=(), garble=(), fail_batch=False):
+        self.trials = {t.nct_id: t for t in trials}
+        self.drop, self.garble, self.fail_batch = set(drop), set(garble), fail_batch
+        self.single_calls, self.batch_calls = [], []
+        self.in_flight = self.peak = 0
+
+    def reply(self, user_prompt, caller, **kwargs):
+        assert kwargs["cache"] is False  # patient_audits is the only cache
+        patient = self.patient
+        if caller == "patient_auditor_batch":
+            ids = re.findall(r"\[\d+\] (\S+):", user_prompt)
+            self.batch_calls.append(ids)
+            if self.fail_batch:
+                raise RuntimeError("context length exceeded")
+            results = []
+            for nct_id in ids:
+                if nct_id in self.drop:
+                    continue
+                item = {"nct_id": nct_id, **_verdict(patient, self.trials[nct_id])}
+                if nct_id in self.garble:
+                    item["eligible"] = "yes"
+                results.append(item)
+            payload = {"results": list(reversed(results))}
+        else:
+            nct_id = re.search(r"CLINICAL TRIAL \((\S+)\)", user_prompt).group(1)
+            self.single_calls.append(nct_id)
+            payload = _verdict(patient, self.trials[nct_id])
+        return SimpleNamespace(json=lambda: payload)
+
+    def complete(self, system_prompt, user_prompt, caller, **kwargs):
+        return self.reply(user_prompt, caller, **kwargs)
+
+    async def acomplete(self, system_prompt, user_prompt, caller, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.005)
+        self.in_flight -= 1
+        return self.reply(user_prompt, caller, **kwargs)
+
+
+@pytest.fixture
+def setup(monkeypatch, patients, catalog):
+    monkeypatch.setattr(pa, "AUDIT_CACHE_ENABLED", False)
+    patient = next(p for p in patients if p["conditions"])
+    trials = [pa.trial_from_record(r) for r in catalog[:12]]
+
+    def make(**kwargs):
+        llm = StubLLM(trials, **kwargs)
+        llm.patient = patient
+        monkeypatch.setattr(pa.llm_client, "complete", llm.complete)
+        monkeypatch.setattr(pa.llm_client, "acomplete", llm.acomplete)
+        return llm
+
+    return patient, trials, make
+
+
+def _single(patient, trials, make):
+    make()
+    return [pa.llm_audit_eligibility(patient, t) for t in trials]
+
+
+def test_batch_matches_single_calls(setup):
+    patient, trials, make = setup
+    single = _single(patient, trials, make)
+    llm = make()
+    assert pa.llm_audit_batch(patient, trials) == single
+    assert len(llm.batch_calls) == 1 and not llm.single_calls
+
+
+def test_missing_and_malformed_items_are_reaudited(setup):
+    patient, trials, make = setup
+    single = _single(patient, trials, make)
+    llm = make(drop={trials[2].nct_id}, garble={trials[5].nct_id})
+    assert pa.llm_audit_batch(patient, trials) == single
+    assert sorted(llm.single_calls) == sorted([trials[2].nct_id, trials[5].nct_id])
+
+    llm = make(fail_batch=True)  # a failed batch falls back to one call per trial
+    assert pa.llm_audit_batch(patient, trials) == single
+    assert sorted(llm.single_calls) == sorted(t.nct_id for t in trials)
+
+
+def test_async_batched_matches_async_single(setup):
+    patient, trials, make = setup
+    pairs = [({"id": t.nct_id, "score": 1.0 - n / 100}, t) for n, t in enumerate(trials)]
+
+    def run(batched, **kwargs):
+        llm = make(**kwargs)
+        entries = {}
+        gate = asyncio.Semaphore(2)
+        asyncio.run(pa._audit_patient(0, patient, pairs, gate, entries.__setitem__, batched))
+        return [entries[k] for k in sorted(entries)], llm
+
+    single, _ = run(False)
+    batched, llm = run(True, drop={t.nct_id for t in trials[::2]})
+    assert batched == single
+    assert len(llm.single_calls) == len(trials[::2])
+    assert llm.peak <= 2  # batch calls and their retries share the gate
@@ -0,0 +1,246 @@
+# utils/criteria_matcher.py
+
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+# -----------------------------
+# Precompiled Criteria Matcher
+# -----------------------------
+# The critic and the reasoning-engine veto both ask "is any patient condition
+# a substring of this criterion?" for every (patient, trial, criterion). Here
+# the criteria of every trial seen so far are joined into one corpus string;
+# each distinct condition is located with a single str.find sweep over it
+# and the hits are memoized as an inverted index
+#     condition -> {trial slot: (exclusion indices, inclusion hit)}
+# Conditions repeat heavily across a cohort, so evaluating a patient against
+# any number of trials becomes a few dict lookups per condition.
+#
+# Two normalizations exist in the codebase and both are kept exactly:
+#   strip=True  -> lower().strip(), falsy items dropped  (critic_agent)
+#   strip=False -> lower() only, nothing dropped          (reasoning veto)
+_SEP = "\x00"  # never part of a criterion or condition, so no hit spans two texts
+
+Hit = Tuple[Tuple[int, ...], bool]
+_MISS: Hit = ((), False)
+
+
+class CriteriaMatcher:
+    def __init__(self, strip: bool = True):
+        self.strip = strip
+        self._lock = threading.RLock()
+        self._slots: Dict[str, int] = {}
+        self._exclusion: List[List[str]] = []
+        self._inclusion: List[List[str]] = []
+        self._hits: Dict[str, Dict[int, Hit]] = {}
+
+        # Corpus of all criterion texts, rebuilt lazily after adds
+        self._corpus = ""
+        self._starts: List[int] = []
+        self._owners: List[Tuple[int, bool, int]] = []  # (slot, is_exclusion, index)
+        self._indexed = 0  # slots already in the corpus
+
+    def normalize(self, items: Iterable[str]) -> List[str]:
+        if self.strip:
+            return [i.lower().strip() for i in items if i]
+        return [i.lower() for i in items]
+
+    # ---------- trials ----------
+    def add(self, key: str, criteria: Dict) -> int:
+        """Registers a trial's criteria under `key` (idempotent) and returns its slot."""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                return slot
+            slot = len(self._exclusion)
+            self._slots[key] = slot
+            exclusion = self.normalize(criteria.get("exclusion", []))
+            inclusion = self.normalize(criteria.get("inclusion", []))
+            self._exclusion.append(exclusion)
+            self._inclusion.append(inclusion)
+
+            # Conditions already memoized only need checking against the new texts
+            for cond, hits in self._hits.items():
+                hit = self._scan_slot(cond, exclusion, inclusion)
+                if hit is not _MISS:
+                    hits[slot] = hit
+            return slot
+
+    # ---------- queries ----------
+    def match(self, conditions: Iterable[str], slots: List[int]) -> List[Hit]:
+        """
+        For each slot: (sorted indices of exclusion criteria containing any
+        condition, whether any inclusion criterion does). Indices refer to the
+        normalized criteria lists.
+        """
+        conds = self.normalize(conditions)
+        # The memoized dicts grow under add(), so they are only read under the lock
+        with self._lock:
+            per_cond = [self._condition_hits(c) for c in dict.fromkeys(conds)]
+
+            if len(per_cond) == 1:
+                only = per_cond[0]
+                return [only.get(slot, _MISS) for slot in slots]
+
+            merged: Dict[int, Hit] = {}
+            for hits in per_cond:
+                for slot, hit in hits.items():
+                    prev = merged.get(slot)
+                    if prev is None:
+                        merged[slot] = hit
+                    else:
+                        exc = tuple(sorted(set(prev[0]) | set(hit[0])))
+                        merged[slot] = (exc, prev[1] or hit[1])
+            return [merged.get(slot, _MISS) for slot in slots]
+
+    def hits(self, condition: str) -> Dict[int, Hit]:
+        """Inverted-index entry for one condition: {slot: hit} for every slot it touches."""
+        cond = self.normalize([condition])
+        if not cond:
+            return {}
+        with self._lock:
+            return dict(self._condition_hits(cond[0]))  # snapshot; the memoized dict keeps growing
+
+    # ---------- internals ----------
+    @staticmethod
+    def _scan_slot(cond: str, exclusion: List[str], inclusion: List[str]) -> Hit:
+        exc = tuple(i for i, text in enumerate(exclusion) if cond in text)
+        inc = any(cond in text for text in inclusion)
+        return (exc, inc) if exc or inc else _MISS
+
+    def _rebuild_corpus(self):
+        parts, starts, owners = [], [], []
+        offset = 0
+        for slot, (exclusion, inclusion) in enumerate(zip(self._exclusion, self._inclusion)):
+            for is_exc, texts in ((True, exclusion), (False, inclusion)):
+                for i, text in enumerate(texts):
+                    starts.append(offset)
+                    owners.append((slot, is_exc, i))
+                    parts.append(text)
+                    offset += len(text) + 1
+        self._corpus = _SEP.join(parts)
+        self._starts, self._owners = starts, owners
+        self._indexed = len(self._exclusion)
+
+    def _condition_hits(self, cond: str) -> Dict[int, Hit]:
+        hits = self._hits.get(cond)
+        if hits is not None:
+            return hits
+        if self._indexed != len(self._exclusion):
+            self._rebuild_corpus()
+
+        found: Dict[int, Tuple[List[int], bool]] = {}
+        if cond == "":
+            # The empty string is a substring of every criterion
+            owners = self._owners
+        elif _SEP in cond:
+            # Could straddle two texts in the corpus; check each text on its own
+            owners = [
+                (slot, is_exc, i) for slot, is_exc, i in self._owners
+                if cond in (self._exclusion if is_exc else self._inclusion)[slot][i]
+            ]
+        else:
+            owners = []
+            corpus, starts = self._corpus, self._starts
+            pos = corpus.find(cond)
+            while pos != -1:
+                text_no = bisect_right(starts, pos) - 1
+                owners.append(self._owners[text_no])
+                nxt = text_no + 1
+                if nxt == len(starts):
+                    break
+                pos = corpus.find(cond, starts[nxt])  # one hit per text is enough
+
+        for slot, is_exc, i in owners:
+            exc, inc = found.setdefault(slot, ([], False))
+            if is_exc:
+                exc.append(i)
+            elif not inc:
+                found[slot] = (exc, True)
+
+        hits = {slot: (tuple(exc), inc) for slot, (exc, inc) in found.items()}
+        self._hits[cond] = hits
+        return hits
+
+
+# -----------------------------
+# Benchmark (6,000 patients x 100 trials)
+# -----------------------------
+def _legacy_critic(criteria: Dict, conditions: List[str]) -> Tuple[bool, str]:
+    norm = lambda items: [i.lower().strip() for i in items if i]
+    patient_conds = norm(conditions)
+    for exc in norm(criteria.get("exclusion", [])):
+        if any(pc in exc for pc in patient_conds):
+            return False, f"Hard exclusion matched: {exc}"
+    if not any(any(pc in inc for pc in patient_conds) for inc in norm(criteria.get("inclusion", []))):
+        return False, "No inclusion criteria satisfied"
+    return True, "Inclusion met, no exclusions"
+
+
+def _legacy_veto(criteria: Dict, conditions: List[str]) -> List[str]:
+    patient_conds = [c.lower() for c in conditions]
+    return [
+        f"Reasoning Engine Veto: {rule}"
+        for rule in criteria.get("exclusion", [])
+        if any(cond in rule.lower() for cond in patient_conds)
+    ]
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+    with open("data/processed/trials_agent_ready.json", "r", encoding="utf-8") as f:
+        trials = json.load(f)
+    with open("data/patients/synthetic_patients.json", "r", encoding="utf-8") as f:
+        patients = json.load(f)
+
+    # Pad to 100 trials by rotating criteria lists, so copies are distinct
+    base = [t.get("Criteria", {}) for t in trials]
+    criteria = list(base)
+    while len(criteria) < 100:
+        c = base[len(criteria) % len(base)]
+        k = len(criteria) // len(base)
+        criteria.append({
+            "inclusion": c.get("inclusion", [])[k:] + c.get("inclusion", [])[:k],
+            "exclusion": c.get("exclusion", [])[k:] + c.get("exclusion", [])[:k],
+        })
+    print(f"📊 {len(patients):,} patients x {len(criteria)} trials")
+
+    started = time.perf_counter()
+    legacy = [
+        [(_legacy_critic(c, p["conditions"]), _legacy_veto(c, p["conditions"])) for c in criteria]
+        for p in patients
+    ]
+    legacy_s = time.perf_counter() - started
+    print(f"🐢 Nested loops:  {legacy_s:,.2f}s")
+
+    started = time.perf_counter()
+    critic, veto = CriteriaMatcher(strip=True), CriteriaMatcher(strip=False)
+    keys = [json.dumps(c, sort_keys=True) for c in criteria]
+    critic_slots = [critic.add(k, c) for k, c in zip(keys, criteria)]
+    veto_slots = [veto.add(k, c) for k, c in zip(keys, criteria)]
+    excl_norm = [critic.normalize(c.get("exclusion", [])) for c in criteria]
+
+    fast = []
+    for p in patients:
+        rows = []
+        critic_hits = critic.match(p["conditions"], critic_slots)
+        veto_hits = veto.match(p["conditions"], veto_slots)
+        for c, exc_norm, (exc, inc), (vexc, _) in zip(criteria, excl_norm, critic_hits, veto_hits):
+            if exc:
+                decision = (False, f"Hard exclusion matched: {exc_norm[exc[0]]}")
+            elif not inc:
+                decision = (False, "No inclusion criteria satisfied")
+            else:
+                decision = (True, "Inclusion met, no exclusions")
+            rows.append((decision, [f"Reasoning Engine Veto: {c['exclusion'][i]}" for i in vexc]))
+        fast.append(rows)
+    fast_s = time.perf_counter() - started
+    print(f"⚡ Matcher:       {fast_s:,.2f}s ({legacy_s / fast_s:,.1f}x faster)")
+
+    assert fast == legacy, "matcher decisions differ from the nested loops"
+    print("✅ Decisions and reason strings identical")
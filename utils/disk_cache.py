@@ -1,26 +1,430 @@
+# utils/disk_cache.py
+
+import os
+import sys
 import json
+import time
+import atexit
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 CACHE_DIR = Path("data/cache")
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# -----------------------------
+# Storage Engine
+# -----------------------------
+# One SQLite file per namespace (data/cache/<namespace>.db) with a primary-key
+# index on the hashed key. WAL mode gives atomic, crash-safe commits and lets
+# several processes share a namespace. Pages freed by overwrites are returned
+# to the OS by a periodic incremental vacuum.
+COMPACT_EVERY = 1000        # writes between free-page checks
+COMPACT_FREE_RATIO = 0.25   # vacuum once this share of pages is free
+BUSY_TIMEOUT_MS = 30_000
+
+# -----------------------------
+# Memory Tier & Write-Behind
+# -----------------------------
+# Each namespace keeps a bounded LRU of decoded values in front of the file.
+# save() lands in the LRU plus a pending buffer; the buffer is written in one
+# transaction once it reaches FLUSH_BATCH entries, every FLUSH_INTERVAL
+# seconds, or at process exit. Values handed out by load() are shared with the
+# LRU, so treat them as read-only.
+MEMORY_MAX_ENTRIES = int(os.getenv("DISK_CACHE_MAX_ENTRIES", "20000"))
+MEMORY_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+FLUSH_BATCH = int(os.getenv("DISK_CACHE_FLUSH_BATCH", "500"))
+FLUSH_INTERVAL = float(os.getenv("DISK_CACHE_FLUSH_INTERVAL", "5"))
+
+# -----------------------------
+# Retention
+# -----------------------------
+# Entries may carry an expiry (save(..., ttl=) or a namespace default set by
+# configure_retention); expired entries read as missing and are deleted by
+# evict(). A namespace can also be capped by entry count and/or stored bytes:
+# evict() drops the least recently written entries first. It runs every
+# COMPACT_EVERY writes for namespaces with a policy, under a write
+# transaction, so processes sharing the file can all evict safely.
+_namespaces = {}
+_limits = {}
+_retention = {}  # namespace -> {"ttl", "max_entries", "max_bytes"}
+_registry_lock = threading.Lock()
+_flusher = None
+
+
+class _MemoryTier:
+    """LRU of decoded values bounded by entry count and serialized bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # hashed key -> (value, size, expires)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, k):
+        entry = self.entries.get(k)
+        if entry is not None and entry[2] is not None and entry[2] <= time.time():
+            self.discard(k)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(k)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, k, value, size: int, expires: float = None):
+        self.discard(k)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        self.entries[k] = (value, size, expires)
+        self.bytes += size
+        self.trim()
+
+    def discard(self, k):
+        if k in self.entries:
+            self.bytes -= self.entries.pop(k)[1]
+
+    def trim(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, old_size, _) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+
+
+class _Namespace:
+    def __init__(self, name: str, conn):
+        self.name = name
+        self.conn = conn
+        self.lock = threading.RLock()
+        max_entries, max_bytes = _limits.get(name, (MEMORY_MAX_ENTRIES, MEMORY_MAX_BYTES))
+        self.memory = _MemoryTier(max_entries, max_bytes)
+        self.pending = {}  # hashed key -> (raw json, expires, written) awaiting flush
+        self.writes = 0
+        self.flushes = 0
+
+
 def _path(namespace: str) -> Path:
+    return CACHE_DIR / f"{namespace}.db"
+
+
+def _legacy_file(namespace: str) -> Path:
     return CACHE_DIR / f"{namespace}.json"
 
+
+def _key(key) -> str:
+    """Keys may be strings or JSON-able dicts; both hash to a fixed-size id."""
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _open(namespace: str) -> _Namespace:
+    """Opens the namespace once per process (connections are not fork-safe)."""
+    handle = (os.getpid(), namespace)
+    with _registry_lock:
+        if handle in _namespaces:
+            return _namespaces[handle]
+
+        path = _path(namespace)
+        conn = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # auto_vacuum must be chosen before the first table is created
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT NOT NULL, expires REAL, written REAL) WITHOUT ROWID"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT) WITHOUT ROWID")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(kv)")}
+        for column in ("expires", "written"):  # files created before retention support
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE kv ADD COLUMN {column} REAL")
+                except sqlite3.OperationalError:
+                    pass  # another process added it first
+
+        ns = _namespaces[handle] = _Namespace(namespace, conn)
+
+    if not _migrated(ns):
+        _import_legacy(ns)
+    return ns
+
+
+# -----------------------------
+# Public API
+# -----------------------------
 def load(namespace: str, key: str):
-    path = _path(namespace)
-    if not path.exists():
-        return None
+    ns = _open(namespace)
+    k = _key(key)
+    with ns.lock:
+        found, value = ns.memory.get(k)
+        if found:
+            return value
+        if k in ns.pending:
+            raw, expires, _ = ns.pending[k]
+        else:
+            row = ns.conn.execute("SELECT v, expires FROM kv WHERE k = ?", (k,)).fetchone()
+            if row is None:
+                return None
+            raw, expires = row
+        if expires is not None and expires <= time.time():
+            return None
+        value = json.loads(raw)
+        ns.memory.put(k, value, len(raw), expires)
+        return value
+
+
+def save(namespace: str, key: str, value, ttl: float = None):
+    """ttl (seconds) overrides the namespace default from configure_retention."""
+    ns = _open(namespace)
+    k = _key(key)
+    raw = json.dumps(value)
+    now = time.time()
+    if ttl is None:
+        ttl = _retention.get(namespace, {}).get("ttl")
+    expires = now + ttl if ttl is not None else None
+    with ns.lock:
+        # Cache the serialized form, not the caller's live object
+        ns.memory.put(k, json.loads(raw), len(raw), expires)
+        ns.pending[k] = (raw, expires, now)
+        if len(ns.pending) >= FLUSH_BATCH:
+            _flush(ns)
+    _start_flusher()
+
+
+def flush(namespace: str = None):
+    """Writes buffered saves to disk (all namespaces by default)."""
+    for ns in _open_namespaces():
+        if namespace is None or ns.name == namespace:
+            with ns.lock:
+                _flush(ns)
+
+
+def configure(namespace: str, max_entries: int = None, max_bytes: int = None):
+    """Overrides the memory-tier limits for one namespace."""
+    _limits[namespace] = (
+        MEMORY_MAX_ENTRIES if max_entries is None else max_entries,
+        MEMORY_MAX_BYTES if max_bytes is None else max_bytes,
+    )
+    for ns in _open_namespaces():
+        if ns.name == namespace:
+            with ns.lock:
+                ns.memory.max_entries, ns.memory.max_bytes = _limits[namespace]
+                ns.memory.trim()
+
+
+def configure_retention(namespace: str, ttl: float = None, max_entries: int = None, max_bytes: int = None):
+    """Default TTL (seconds) and on-disk caps for one namespace; None leaves that limit off."""
+    _retention[namespace] = {"ttl": ttl, "max_entries": max_entries, "max_bytes": max_bytes}
+
+
+def evict(namespace: str) -> int:
+    """Deletes expired entries, then the oldest-written ones over the namespace caps."""
+    ns = _open(namespace)
+    with ns.lock:
+        _flush(ns)
+        return _evict(ns)
+
+
+def stats(namespace: str = None) -> dict:
+    """Hit/miss/eviction counters per namespace, for sizing the memory tier."""
+    report = {}
+    for ns in _open_namespaces():
+        if namespace is not None and ns.name != namespace:
+            continue
+        m = ns.memory
+        lookups = m.hits + m.misses
+        report[ns.name] = {
+            "hits": m.hits,
+            "misses": m.misses,
+            "hit_rate": round(m.hits / lookups, 4) if lookups else 0.0,
+            "evictions": m.evictions,
+            "entries": len(m.entries),
+            "bytes": m.bytes,
+            "pending_writes": len(ns.pending),
+            "flushes": ns.flushes,
+        }
+    return report
+
+
+def compact(namespace: str):
+    """Full rewrite of the namespace file and WAL truncation."""
+    ns = _open(namespace)
+    with ns.lock:
+        _flush(ns)
+        ns.conn.execute("VACUUM")
+        ns.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _open_namespaces():
+    pid = os.getpid()
+    with _registry_lock:
+        return [ns for (p, _), ns in _namespaces.items() if p == pid]
+
+
+def _flush(ns: _Namespace):
+    """Caller holds ns.lock."""
+    if not ns.pending:
+        return
+    rows = [(k, raw, expires, written) for k, (raw, expires, written) in ns.pending.items()]
+    ns.conn.execute("BEGIN IMMEDIATE")
+    try:
+        ns.conn.executemany("INSERT OR REPLACE INTO kv (k, v, expires, written) VALUES (?, ?, ?, ?)", rows)
+        ns.conn.execute("COMMIT")
+    except Exception:
+        ns.conn.execute("ROLLBACK")
+        raise
+    ns.pending.clear()
+    ns.flushes += 1
+    _maybe_compact(ns, len(rows))
+
+
+def _evict(ns: _Namespace) -> int:
+    """Caller holds ns.lock with nothing pending."""
+    policy = _retention.get(ns.name, {})
+    ns.conn.execute("BEGIN IMMEDIATE")
+    try:
+        removed = ns.conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)).rowcount
+        if policy.get("max_entries") is not None:
+            removed += ns.conn.execute(
+                "DELETE FROM kv WHERE k IN (SELECT k FROM kv ORDER BY written DESC LIMIT -1 OFFSET ?)",
+                (policy["max_entries"],),
+            ).rowcount
+        if policy.get("max_bytes") is not None:
+            removed += ns.conn.execute(
+                "DELETE FROM kv WHERE k IN (SELECT k FROM ("
+                "  SELECT k, SUM(LENGTH(v)) OVER (ORDER BY written DESC, k) AS kept FROM kv"
+                ") WHERE kept > ?)",
+                (policy["max_bytes"],),
+            ).rowcount
+        ns.conn.execute("COMMIT")
+    except Exception:
+        ns.conn.execute("ROLLBACK")
+        raise
+    if removed:
+        # Other processes may have evicted too; keep this one's memory tier honest
+        ns.memory.entries.clear()
+        ns.memory.bytes = 0
+    return removed
+
+
+def _maybe_compact(ns: _Namespace, n_written: int):
+    before = ns.writes
+    ns.writes += n_written
+    if ns.writes // COMPACT_EVERY == before // COMPACT_EVERY:
+        return
+
+    if ns.name in _retention:
+        _evict(ns)
+    free = ns.conn.execute("PRAGMA freelist_count").fetchone()[0]
+    total = ns.conn.execute("PRAGMA page_count").fetchone()[0]
+    if total and free / total >= COMPACT_FREE_RATIO:
+        ns.conn.execute("PRAGMA incremental_vacuum")
+    ns.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None and _flusher[0] == os.getpid():
+        return
+    with _registry_lock:
+        if _flusher is not None and _flusher[0] == os.getpid():
+            return
+        thread = threading.Thread(target=_flush_loop, name="disk-cache-flush", daemon=True)
+        _flusher = (os.getpid(), thread)
+    thread.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+atexit.register(flush)
+
+
+# -----------------------------
+# Migration from JSON namespaces
+# -----------------------------
+def _legacy_records(namespace: str):
+    """
+    Yields (hashed_key, raw_json) from data/cache/<ns>.json.
+    The per-key data/cache/<ns>/*.json directories predate the JSON namespaces,
+    were never read by this module and use older record schemas, so they are
+    not imported.
+    """
+    legacy_file = _legacy_file(namespace)
+    if legacy_file.is_file():
+        try:
+            data = json.loads(legacy_file.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            data = {}
+        if isinstance(data, dict):
+            for k, v in data.items():
+                yield _key(k), json.dumps(v)
+
+
+def _migrated(ns: _Namespace) -> bool:
+    with ns.lock:
+        row = ns.conn.execute("SELECT v FROM meta WHERE k = 'legacy_migrated'").fetchone()
+    return row is not None
+
+
+def _import_legacy(ns: _Namespace, overwrite: bool = False) -> int:
+    """Imports and records completion in one transaction, so a crash leaves nothing half-done."""
+    verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+    count = 0
+    with ns.lock:
+        _flush(ns)
+        ns.conn.execute("BEGIN IMMEDIATE")
+        try:
+            done = ns.conn.execute("SELECT 1 FROM meta WHERE k = 'legacy_migrated'").fetchone()
+            if done and not overwrite:
+                ns.conn.execute("COMMIT")
+                return 0  # another process finished it first
+            for k, raw in _legacy_records(ns.name):
+                ns.conn.execute(f"{verb} INTO kv (k, v) VALUES (?, ?)", (k, raw))
+                count += 1
+            ns.conn.execute(
+                "INSERT OR REPLACE INTO meta (k, v) VALUES ('legacy_migrated', ?)", (str(time.time()),)
+            )
+            ns.conn.execute("COMMIT")
+        except Exception:
+            ns.conn.execute("ROLLBACK")
+            raise
+        ns.memory.entries.clear()
+        ns.memory.bytes = 0
+    return count
+
+
+def migrate(namespace: str, overwrite: bool = False) -> int:
+    """
+    Imports legacy JSON entries into the namespace store.
+    Runs automatically when a namespace is opened until one import has
+    committed (tracked in the meta table); call again with
+    overwrite=True to let the JSON files win over existing entries.
+    """
+    return _import_legacy(_open(namespace), overwrite=overwrite)
 
-    data = json.loads(path.read_text())
-    return data.get(key)
 
-def save(namespace: str, key: str, value):
-    path = _path(namespace)
+def legacy_namespaces():
+    return sorted(p.stem for p in CACHE_DIR.glob("*.json"))
 
-    data = {}
-    if path.exists():
-        data = json.loads(path.read_text())
 
-    data[key] = value
-    path.write_text(json.dumps(data, indent=2))
+if __name__ == "__main__":
+    # python -m utils.disk_cache [namespace ...]
+    for ns in sys.argv[1:] or legacy_namespaces():
+        n = migrate(ns)
+        print(f"📦 {ns}: {n} legacy entries checked into {_path(ns)}")
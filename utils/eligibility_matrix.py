@@ -0,0 +1,213 @@
+# utils/eligibility_matrix.py
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from utils.criteria_matcher import CriteriaMatcher
+from utils.med_vocab import normalize as vocab_normalize
+from utils.trial_catalog import TrialRecord, get_catalog
+
+# -----------------------------
+# Cohort Eligibility Matrix
+# -----------------------------
+# All patients x all trials in one vectorized pass, for questions the
+# per-patient graph cannot answer cheaply ("who qualifies for trial X?").
+#
+#   vocabulary  = every normalized patient condition / medication
+#   patients    -> condition and medication bitsets over the vocabulary
+#   trials      -> inclusion / exclusion bitsets: which vocabulary terms occur
+#                  in the trial's criteria (substring, as in the rule critic)
+#
+#   eligible = (conditions @ inclusion > 0)
+#              & ~((conditions | medications) @ exclusion > 0)
+#              & age within [minimumAge, maximumAge] & sex matches
+#
+# Patients collapse to a few hundred distinct bitsets, so the products run
+# once per phenotype and are broadcast back to patient rows. Conditions
+# follow the critic's rules exactly; medications only ever exclude.
+AGE_UNITS = {"year": 1.0, "month": 1 / 12, "week": 1 / 52, "day": 1 / 365}
+_AGE = re.compile(r"([\d.]+)\s*([a-z]+)")
+SEX_CODES = {"MALE": 1, "FEMALE": 2}  # 0 = ALL / unknown
+
+
+def parse_age(value, default: float) -> float:
+    """ClinicalTrials.gov age ("18 Years", "6 Months") in years; default when absent or unreadable."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _AGE.match(str(value).strip().lower())
+    if not m:
+        return default
+    unit = AGE_UNITS.get(m.group(2).rstrip("s"), 1.0)
+    return float(m.group(1)) * unit
+
+
+def terms(items: Iterable[str]) -> List[str]:
+    """Patient terms as the critic compares them, with med_vocab synonyms resolved."""
+    return [vocab_normalize(i.strip()) for i in items if i]
+
+
+class EligibilityMatrix:
+    def __init__(
+        self,
+        patient_ids: List[str],
+        trial_ids: List[str],
+        matrix: np.ndarray,
+        phenotypes: int,
+        vocabulary: int,
+    ):
+        self.patient_ids = patient_ids
+        self.trial_ids = trial_ids
+        self.matrix = matrix  # bool, patients x trials
+        self.phenotypes = phenotypes
+        self.vocabulary = vocabulary
+        self._patient_rows = {p: i for i, p in enumerate(patient_ids)}
+        self._trial_cols = {t: i for i, t in enumerate(trial_ids)}
+
+    # ---------- build ----------
+    @classmethod
+    def build(
+        cls,
+        patients: List[Dict],
+        trials: Iterable[TrialRecord],
+        medications: bool = True,
+    ) -> "EligibilityMatrix":
+        """
+        Computes the full matrix. medications=False leaves medications out,
+        which reproduces the rule critic's decisions plus age and sex bounds.
+        """
+        trials = list(trials)
+
+        # Vocabulary and patient bitsets
+        vocab: Dict[str, int] = {}
+        cond_rows = [[vocab.setdefault(t, len(vocab)) for t in terms(p.get("conditions", []))] for p in patients]
+        med_rows = [
+            [vocab.setdefault(t, len(vocab)) for t in terms(p.get("medications", []))] if medications else []
+            for p in patients
+        ]
+        patient_ids, trial_ids = [p["patient_id"] for p in patients], [t.nct_id for t in trials]
+        if not vocab:
+            # No patient terms: nothing satisfies an inclusion criterion
+            return cls(patient_ids, trial_ids, np.zeros((len(patients), len(trials)), dtype=bool),
+                       1 if patients else 0, 0)
+
+        bits = np.zeros((len(patients), 2 * len(vocab)), dtype=bool)  # [conditions | medications]
+        for i, (conds, meds) in enumerate(zip(cond_rows, med_rows)):
+            bits[i, conds] = True
+            bits[i, [len(vocab) + m for m in meds]] = True
+
+        # Trial bitsets from one substring sweep per term over all criteria
+        matcher = CriteriaMatcher(strip=True)
+        slots = np.array([
+            matcher.add(t.nct_id, {
+                "inclusion": [vocab_normalize(c) for c in t.inclusion],
+                "exclusion": [vocab_normalize(c) for c in t.exclusion],
+            })
+            for t in trials
+        ], dtype=np.intp)
+        n_slots = int(slots.max()) + 1 if len(slots) else 0
+        inclusion = np.zeros((len(vocab), n_slots), dtype=np.float32)
+        exclusion = np.zeros((len(vocab), n_slots), dtype=np.float32)
+        for term, row in vocab.items():
+            for slot, (exc, inc) in matcher.hits(term).items():
+                inclusion[row, slot] = inc
+                exclusion[row, slot] = bool(exc)
+        inclusion, exclusion = inclusion[:, slots], exclusion[:, slots]
+
+        # Criteria algebra once per distinct phenotype
+        phenotypes, inverse = np.unique(bits, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        conds = phenotypes[:, :len(vocab)].astype(np.float32)
+        either = (phenotypes[:, :len(vocab)] | phenotypes[:, len(vocab):]).astype(np.float32)
+        by_phenotype = (conds @ inclusion > 0) & ~(either @ exclusion > 0)
+
+        # Demographic bounds, per patient
+        age = np.array([parse_age((p.get("demographics") or {}).get("age"), np.nan) for p in patients])
+        min_age = np.array([parse_age(t.min_age, 0.0) for t in trials])
+        max_age = np.array([parse_age(t.max_age, np.inf) for t in trials])
+        known = ~np.isnan(age)[:, None]  # unknown age is not held against the patient
+        age_ok = ~known | ((age[:, None] >= min_age) & (age[:, None] <= max_age))
+
+        patient_sex = np.array([SEX_CODES.get(str((p.get("demographics") or {}).get("sex", "")).upper(), 0) for p in patients])
+        trial_sex = np.array([SEX_CODES.get(str(t.sex).upper(), 0) for t in trials])
+        sex_ok = (trial_sex == 0) | (patient_sex[:, None] == 0) | (patient_sex[:, None] == trial_sex)
+
+        matrix = by_phenotype[inverse] & age_ok & sex_ok
+        return cls(patient_ids, trial_ids, matrix, len(phenotypes), len(vocab))
+
+    @classmethod
+    def from_catalog(cls, patients: List[Dict], medications: bool = True) -> "EligibilityMatrix":
+        return cls.build(patients, get_catalog(), medications)
+
+    # ---------- queries ----------
+    def trials_for(self, patient_id: str) -> List[str]:
+        row = self.matrix[self._patient_rows[patient_id]]
+        return [self.trial_ids[j] for j in np.flatnonzero(row)]
+
+    def patients_for(self, nct_id: str) -> List[str]:
+        col = self.matrix[:, self._trial_cols[nct_id]]
+        return [self.patient_ids[i] for i in np.flatnonzero(col)]
+
+    def is_eligible(self, patient_id: str, nct_id: str) -> bool:
+        return bool(self.matrix[self._patient_rows[patient_id], self._trial_cols[nct_id]])
+
+    def counts(self, axis: str = "trial") -> Dict[str, int]:
+        """Eligible patients per trial (axis="trial") or eligible trials per patient."""
+        if axis == "trial":
+            return dict(zip(self.trial_ids, self.matrix.sum(axis=0).tolist()))
+        return dict(zip(self.patient_ids, self.matrix.sum(axis=1).tolist()))
+
+    def __repr__(self) -> str:
+        return (f"EligibilityMatrix({len(self.patient_ids)} patients x {len(self.trial_ids)} trials, "
+                f"{int(self.matrix.sum())} eligible pairs, {self.phenotypes} phenotypes)")
+
+
+# -----------------------------
+# Benchmark (6,000 patients x 10,000 trials)
+# -----------------------------
+def _padded_trials(records: List[TrialRecord], n: int) -> List[TrialRecord]:
+    """Pads to n trials by rotating criteria lists, so copies are distinct."""
+    trials = list(records)
+    while len(trials) < n:
+        r = records[len(trials) % len(records)]
+        k = len(trials) // len(records)
+        inc, exc = list(r.inclusion), list(r.exclusion)
+        trials.append(TrialRecord({
+            "nct_id": f"{r.nct_id}-{k}", "title": r.title,
+            "minimumAge": r.min_age, "maximumAge": r.max_age, "sex": r.sex,
+            "Criteria": {"inclusion": inc[k:] + inc[:k], "exclusion": exc[k:] + exc[:k]},
+        }))
+    return trials
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+    parser = argparse.ArgumentParser(description="Cohort eligibility matrix (all patients x all trials)")
+    parser.add_argument("--patients", default="data/patients/synthetic_patients.json")
+    parser.add_argument("--trials", type=int, default=10_000, help="pad the catalog to this many trials")
+    parser.add_argument("--patient", help="list eligible trials for this patient_id")
+    parser.add_argument("--trial", help="list eligible patients for this nct_id")
+    args = parser.parse_args()
+
+    with open(args.patients, "r", encoding="utf-8") as f:
+        patients = json.load(f)
+    trials = _padded_trials(list(get_catalog()), args.trials)
+    print(f"📊 {len(patients):,} patients x {len(trials):,} trials")
+
+    started = time.perf_counter()
+    em = EligibilityMatrix.build(patients, trials)
+    print(f"⚡ Built in {time.perf_counter() - started:,.2f}s: {em}")
+
+    if args.patient:
+        print(f"🧑 {args.patient}: {em.trials_for(args.patient)[:50]}")
+    if args.trial:
+        print(f"🧪 {args.trial}: {len(em.patients_for(args.trial))} eligible patients")
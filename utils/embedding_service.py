@@ -0,0 +1,154 @@
+# utils/embedding_service.py
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from utils import llm_client
+from utils.app_logger import get_logger
+
+load_dotenv()
+logger = get_logger("EmbeddingService")
+
+# -----------------------------
+# Configuration
+# -----------------------------
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", "2048"))      # API cap on inputs per request
+MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "250000"))  # stay under the per-request token cap
+MAX_WAIT_SECONDS = float(os.getenv("EMBED_MAX_WAIT_SECONDS", "0.02"))  # coalescing window
+
+
+def approx_tokens(text: str) -> int:
+    """~4 characters per token for English text; good enough for batch sizing."""
+    return len(text) // 4 + 1
+
+
+# -----------------------------
+# Service
+# -----------------------------
+class EmbeddingService:
+    """
+    Coalesces embedding requests from any number of callers (threads) into
+    batched `embeddings.create` calls, sent through llm_client.embed for the
+    shared retries and RPM/TPM/concurrency limits. Identical texts in a batch
+    are sent once and fanned back out to every waiting caller.
+    """
+
+    def __init__(
+        self,
+        client: Optional[OpenAI] = None,
+        model: str = EMBED_MODEL,
+        max_batch_items: int = MAX_BATCH_ITEMS,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_wait: float = MAX_WAIT_SECONDS,
+    ):
+        self.client = client  # None: llm_client's pooled client
+        self.model = model
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._carry = None  # request that did not fit in the previous batch
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+        self.stats = {"requests": 0, "texts": 0, "unique_texts": 0}
+
+    # ---------- caller API ----------
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        futures = [self.submit(t) for t in texts]
+        return [f.result() for f in futures]
+
+    # ---------- batching loop ----------
+    def _next_batch(self) -> List[tuple]:
+        first = self._carry or self._queue.get()
+        self._carry = None
+        batch = [first]
+        unique = {first[0]}
+        tokens = approx_tokens(first[0])
+        deadline = time.monotonic() + self.max_wait
+
+        while len(unique) < self.max_batch_items:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] not in unique:
+                cost = approx_tokens(item[0])
+                if tokens + cost > self.max_batch_tokens:
+                    self._carry = item
+                    break
+                unique.add(item[0])
+                tokens += cost
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            waiting: Dict[str, List[Future]] = {}
+            for text, future in batch:
+                if future.set_running_or_notify_cancel():
+                    waiting.setdefault(text, []).append(future)
+            if not waiting:
+                continue
+
+            texts = list(waiting)
+            try:
+                vectors = llm_client.embed(texts, self.model, client=self.client)
+            except Exception as e:
+                logger.error(f"❌ Embedding batch of {len(texts)} failed: {e}")
+                for futures in waiting.values():
+                    for f in futures:
+                        f.set_exception(e)
+                continue
+
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(batch)
+            self.stats["unique_texts"] += len(texts)
+            for text, vector in zip(texts, vectors):
+                for f in waiting[text]:
+                    f.set_result(vector)
+
+
+# -----------------------------
+# Shared instance
+# -----------------------------
+_service: Optional[EmbeddingService] = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """One service per process; forked workers get their own batching thread."""
+    global _service, _service_pid
+    with _service_lock:
+        if _service is None or _service_pid != os.getpid():
+            _service = EmbeddingService()
+            _service_pid = os.getpid()
+        return _service
+
+
+def embed(text: str) -> List[float]:
+    return get_embedding_service().embed(text)
+
+
+def embed_many(texts: List[str]) -> List[List[float]]:
+    return get_embedding_service().embed_many(texts)
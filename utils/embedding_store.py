@@ -0,0 +1,215 @@
+# utils/embedding_store.py
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer only
+    fcntl = None
+
+# -----------------------------
+# Binary Embedding Store
+# -----------------------------
+# <base>.npy holds one row per vector, <base>.index.json maps id -> row (plus
+# an optional per-id tag such as a content hash). The matrix is opened with
+# mmap, so loading is O(1) and float32 rows are served without copying.
+#
+# dtype="float16" halves the file; dtype="int8" quarters it with one float32
+# scale per row in <base>.scales.npy (reads are dequantized per row).
+#
+# New vectors are buffered in memory and merged into the files by save(),
+# which re-reads the on-disk copy first. An exclusive flock on <base>.lock is
+# held across the whole load-merge-write-replace, and readers take it shared,
+# so several processes can share a store without an index ever pointing at
+# another writer's rows.
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+class EmbeddingStore:
+    def __init__(self, base_path: Path, dim: int = 1536, dtype: str = "float32", mmap: bool = True):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype}; use one of {SUPPORTED_DTYPES}")
+        self.base_path = Path(base_path)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.mmap = mmap
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=self.dtype)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._rows: Dict[str, int] = {}
+        self._tags: Dict[str, str] = {}
+        self._pending: Dict[str, np.ndarray] = {}
+        self._pending_tags: Dict[str, str] = {}
+        self._load()
+
+    @property
+    def npy_path(self) -> Path:
+        return self.base_path.with_suffix(".npy")
+
+    @property
+    def index_path(self) -> Path:
+        return self.base_path.with_suffix(".index.json")
+
+    @property
+    def scales_path(self) -> Path:
+        return self.base_path.with_suffix(".scales.npy")
+
+    @property
+    def lock_path(self) -> Path:
+        return self.base_path.with_suffix(".lock")
+
+    # ---------- reads ----------
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """float32 vector (a zero-copy view for float32 stores)."""
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            return self._decode(self._matrix[row], self._scales[row] if self._is_int8 else None)
+
+    def get_many(self, keys: List[str]) -> np.ndarray:
+        """Stacked float32 matrix for keys (all must be present)."""
+        with self._lock:
+            return np.stack([self.get(k) for k in keys]) if keys else np.zeros((0, self.dim), np.float32)
+
+    def tag(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._pending_tags.get(key, self._tags.get(key))
+
+    def matrix(self):
+        """(ids, float32 matrix) of everything on disk; zero-copy for float32 stores."""
+        with self._lock:
+            ids = sorted(self._rows, key=self._rows.get)
+            if self.dtype == np.float32:
+                return ids, self._matrix
+            scales = self._scales if self._is_int8 else None
+            return ids, self._decode(self._matrix, None if scales is None else scales[:, None])
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._pending or key in self._rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows) + sum(1 for k in self._pending if k not in self._rows)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._rows) + [k for k in self._pending if k not in self._rows]
+
+    # ---------- writes ----------
+    def put(self, key: str, vector: Iterable[float], tag: Optional[str] = None):
+        vec = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._pending[key] = vec
+            if tag is not None:
+                self._pending_tags[key] = tag
+
+    def save(self):
+        """Merges buffered vectors into the files with atomic replaces."""
+        with self._lock:
+            if not self._pending and not self._pending_tags:
+                return
+            self.base_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._file_lock(exclusive=True):
+                self._merge_and_write()
+
+    # ---------- internals ----------
+    def _merge_and_write(self):
+        """Caller holds self._lock and the exclusive file lock."""
+        self._read_files()  # pick up rows written by other processes
+
+        matrix = np.array(self._matrix)  # writable copy of the mmap
+        scales = np.array(self._scales)
+        new_keys = [k for k in self._pending if k not in self._rows]
+        if new_keys:
+            start = len(matrix)
+            matrix = np.concatenate([matrix, np.zeros((len(new_keys), self.dim), self.dtype)])
+            scales = np.concatenate([scales, np.zeros(len(new_keys), np.float32)])
+            for i, k in enumerate(new_keys):
+                self._rows[k] = start + i
+        for k, vec in self._pending.items():
+            matrix[self._rows[k]], scales[self._rows[k]] = self._encode(vec)
+        self._tags.update(self._pending_tags)
+        self._matrix, self._scales = matrix, scales  # release our mmap before replacing the file
+
+        # Matrix (and scales) first: an index never points past the end of its matrix
+        self._write_npy(self.npy_path, matrix)
+        if self._is_int8:
+            self._write_npy(self.scales_path, scales)
+        index = {"dim": self.dim, "dtype": self.dtype.name, "rows": self._rows, "tags": self._tags}
+        tmp_index = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        tmp_index.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(tmp_index, self.index_path)
+
+        self._pending.clear()
+        self._pending_tags.clear()
+        self._read_files()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @property
+    def _is_int8(self) -> bool:
+        return self.dtype == np.int8
+
+    def _encode(self, vec: np.ndarray):
+        if self._is_int8:
+            scale = float(np.abs(vec).max()) / 127 or 1.0
+            return np.round(vec / scale).astype(np.int8), scale
+        return vec.astype(self.dtype), 1.0
+
+    def _decode(self, values: np.ndarray, scale=None) -> np.ndarray:
+        if self.dtype == np.float32:
+            return values
+        out = values.astype(np.float32)
+        return out * scale if scale is not None else out
+
+    @staticmethod
+    def _write_npy(path: Path, array: np.ndarray):
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")  # per-process, writers may overlap
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+    def _load(self):
+        if not (self.npy_path.exists() and self.index_path.exists()):
+            return
+        with self._file_lock(exclusive=False):
+            self._read_files()
+
+    def _read_files(self):
+        """Caller holds the file lock (shared or exclusive)."""
+        if not (self.npy_path.exists() and self.index_path.exists()):
+            return
+        index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        if np.dtype(index["dtype"]) != self.dtype:
+            raise ValueError(
+                f"{self.npy_path} holds {index['dtype']} vectors; open it with dtype={index['dtype']!r}"
+            )
+
+        matrix = np.load(self.npy_path, mmap_mode="r" if self.mmap else None)
+        scales = np.load(self.scales_path) if self._is_int8 else np.ones(len(matrix), np.float32)
+        if len(matrix) < len(index["rows"]) or len(scales) < len(index["rows"]):
+            return  # files written by a writer without the lock; keep ours
+        self._matrix, self._scales = matrix, scales
+        self._rows, self._tags = index["rows"], index["tags"]
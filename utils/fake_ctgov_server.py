@@ -0,0 +1,150 @@
+# utils/fake_ctgov_server.py
+"""
+Local stand-in for the ClinicalTrials.gov v2 /studies endpoint, serving
+recorded pages for offline ingestion runs and load checks.
+
+    python -m utils.fake_ctgov_server --port 8095 --latency 0.2
+    python -m utils.ingest_clinical_trial --base-url http://127.0.0.1:8095/api/v2 --conditions Diabetes Obesity
+
+Studies come from a recordings file (a JSON list of raw API study objects,
+see record()) or, by default, are rebuilt from data/raw/trials_filtered.json.
+query.cond matches case-insensitively against conditions, title and criteria;
+pageToken is the offset of the next page.
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_TRIALS = "data/raw/trials_filtered.json"
+
+
+def studies_from_trials(path: str = DEFAULT_TRIALS) -> List[Dict]:
+    """Wraps flattened trial records back into the API's study shape."""
+    with open(path, "r", encoding="utf-8") as f:
+        trials = json.load(f)
+    return [{
+        "protocolSection": {
+            "identificationModule": {"nctId": t["nct_id"], "briefTitle": t.get("title")},
+            "conditionsModule": {"conditions": t.get("conditions", [])},
+            "eligibilityModule": {
+                "eligibilityCriteria": t.get("eligibilityCriteria"),
+                "minimumAge": t.get("minimumAge"),
+                "maximumAge": t.get("maximumAge"),
+                "sex": t.get("sex"),
+                "healthyVolunteers": t.get("healthyVolunteers"),
+            },
+        }
+    } for t in trials]
+
+
+def record(path: str, conditions: List[str], max_pages: int = 5, base_url: str = "https://clinicaltrials.gov/api/v2"):
+    """Saves real API studies for the given conditions as a recordings file."""
+    import requests
+
+    studies, seen = [], set()
+    for condition in conditions:
+        token = None
+        for _ in range(max_pages):
+            params = {"query.cond": condition, "filter.overallStatus": "RECRUITING", "pageSize": 100, "format": "json"}
+            if token:
+                params["pageToken"] = token
+            data = requests.get(f"{base_url}/studies", params=params, timeout=30).json()
+            for s in data.get("studies", []):
+                nct_id = s.get("protocolSection", {}).get("identificationModule", {}).get("nctId")
+                if nct_id not in seen:
+                    seen.add(nct_id)
+                    studies.append(s)
+            token = data.get("nextPageToken")
+            if not token:
+                break
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(studies, f)
+    return len(studies)
+
+
+def _searchable(study: Dict) -> str:
+    p = study.get("protocolSection", {})
+    parts = p.get("conditionsModule", {}).get("conditions", []) + [
+        p.get("identificationModule", {}).get("briefTitle") or "",
+        p.get("eligibilityModule", {}).get("eligibilityCriteria") or "",
+    ]
+    return " ".join(parts).lower()
+
+
+class FakeCtGovHandler(BaseHTTPRequestHandler):
+    studies: List[Dict] = []
+    latency = 0.0
+    counters = {"requests": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if not url.path.endswith("/studies"):
+            self._send({"error": f"Unknown route {url.path}"}, status=404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.counters["requests"] += 1
+
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        cond = params.get("query.cond", "").lower()
+        size = int(params.get("pageSize", 10))
+        offset = int(params.get("pageToken", 0))
+
+        matching = [s for s in self.studies if cond in _searchable(s)]
+        page = matching[offset:offset + size]
+        payload = {"studies": page}
+        if offset + size < len(matching):
+            payload["nextPageToken"] = str(offset + size)
+        self._send(payload)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8095, studies: List[Dict] = None, latency: float = 0.0) -> ThreadingHTTPServer:
+    """Starts the server on a daemon thread and returns it (call .shutdown() to stop)."""
+    FakeCtGovHandler.studies = studies if studies is not None else studies_from_trials()
+    FakeCtGovHandler.latency = latency
+    server = ThreadingHTTPServer((host, port), FakeCtGovHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake ClinicalTrials.gov API serving recorded pages")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8095)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every page")
+    parser.add_argument("--recordings", default=None, help="JSON list of API study objects")
+    parser.add_argument("--record", nargs="+", metavar="CONDITION", help="record live pages into --recordings and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        n = record(args.recordings or "data/raw/ctgov_recordings.json", args.record)
+        print(f"📼 Recorded {n} studies")
+        raise SystemExit
+
+    if args.recordings and os.path.exists(args.recordings):
+        with open(args.recordings, "r", encoding="utf-8") as f:
+            FakeCtGovHandler.studies = json.load(f)
+    else:
+        FakeCtGovHandler.studies = studies_from_trials()
+    FakeCtGovHandler.latency = args.latency
+    print(f"🧪 Fake ClinicalTrials.gov API on http://{args.host}:{args.port}/api/v2 "
+          f"({len(FakeCtGovHandler.studies)} studies, latency {args.latency}s)")
+    ThreadingHTTPServer((args.host, args.port), FakeCtGovHandler).serve_forever()
@@ -0,0 +1,200 @@
+# utils/fake_openai_server.py
+"""
+Local stand-in for the OpenAI HTTP API, for offline runs and load checks.
+
+    python -m utils.fake_openai_server --port 8089 --latency 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python run_workflow.py
+
+Embeddings are deterministic (seeded by the text hash), so repeated runs
+produce identical vectors. /responses answers criteria-extraction prompts by
+lifting the bullet lists under "Inclusion/Exclusion Criteria" headings;
+/chat/completions answers eligibility-audit prompts (single or batched) with
+verdicts seeded by the trial id, and anything else like /responses.
+"""
+import re
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBED_DIM = 1536
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def fake_criteria(text: str) -> dict:
+    """Bullets under the inclusion/exclusion headings of a protocol text."""
+    criteria = {"inclusion": [], "exclusion": []}
+    section = None
+    for line in text.splitlines():
+        heading = line.strip().lower()
+        if heading.startswith("inclusion criteria"):
+            section = "inclusion"
+        elif heading.startswith("exclusion criteria"):
+            section = "exclusion"
+        elif section and re.match(r"^\s*(?:[*\-•]|\d+\.)\s+", line):
+            criteria[section].append(re.sub(r"^\s*(?:[*\-•]|\d+\.)\s+", "", line).strip())
+    return criteria
+
+
+def _last_user_text(messages) -> str:
+    if isinstance(messages, str):
+        return messages
+    for msg in reversed(messages or []):
+        if msg.get("role") == "user":
+            content = msg.get("content", "")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content
+    return ""
+
+
+def _usage(prompt: str, completion: str) -> tuple:
+    return len(prompt) // 4 + 1, len(completion) // 4 + 1
+
+
+def fake_verdict(key: str) -> dict:
+    """Deterministic eligible/ineligible answer, seeded by the trial id (or prompt)."""
+    eligible = hashlib.sha256(key.encode()).digest()[0] % 2 == 0
+    return {"eligible": eligible, "reasoning": "Fake auditor verdict (meets criteria)." if eligible else "Fake auditor verdict (exclusion applies)."}
+
+
+def fake_audit(prompt: str) -> dict:
+    """Single audits get a verdict; batched ones ("results") one item per listed trial."""
+    if '"results"' in prompt:
+        ids = re.findall(r"\[\d+\] (NCT\d+):", prompt)
+        return {"results": [{"nct_id": nct_id, **fake_verdict(nct_id)} for nct_id in ids]}
+    nct_id = re.search(r"NCT\d+", prompt)
+    return fake_verdict(nct_id.group(0) if nct_id else prompt)
+
+
+def fake_chat_completion(body: dict) -> dict:
+    """chat.completions payload with JSON content."""
+    prompt = _last_user_text(body.get("messages"))
+    answer = fake_audit(prompt) if '"eligible"' in prompt else fake_criteria(prompt)
+    text = json.dumps(answer)
+    prompt_tokens, completion_tokens = _usage(prompt, text)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def fake_response(body: dict) -> dict:
+    """Responses API payload whose output_text is the extracted criteria JSON."""
+    prompt = _last_user_text(body.get("input"))
+    text = json.dumps(fake_criteria(prompt))
+    input_tokens, output_tokens = _usage(prompt, text)
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model"),
+        "status": "completed",
+        "output": [{
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                  "total_tokens": input_tokens + output_tokens},
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    counters = {"requests": 0, "embedding_inputs": 0, "responses": 0, "chat_completions": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.counters["requests"] += 1
+
+        if self.path.endswith("/embeddings"):
+            inputs = body.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            with self.lock:
+                self.counters["embedding_inputs"] += len(inputs)
+            self._send({
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                    for i, t in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        elif self.path.endswith("/responses"):
+            with self.lock:
+                self.counters["responses"] += 1
+            self._send(fake_response(body))
+        elif self.path.endswith("/chat/completions"):
+            with self.lock:
+                self.counters["chat_completions"] += 1
+            self._send(fake_chat_completion(body))
+        else:
+            self._send({"error": {"message": f"Unknown route {self.path}"}}, status=404)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # concurrent benchmark clients open many connections at once
+
+
+def serve(host: str = "127.0.0.1", port: int = 8089, latency: float = 0.0) -> ThreadingHTTPServer:
+    """Starts the server on a daemon thread and returns it (call .shutdown() to stop)."""
+    FakeOpenAIHandler.latency = latency
+    server = FakeOpenAIServer((host, port), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI API for local runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.latency = args.latency
+    print(f"🧪 Fake OpenAI API on http://{args.host}:{args.port}/v1 (latency {args.latency}s)")
+    FakeOpenAIServer((args.host, args.port), FakeOpenAIHandler).serve_forever()
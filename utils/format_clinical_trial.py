@@ -3,27 +3,40 @@ import sys
 import json
 import os
 import html
+import time
+import hashlib
+import argparse
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
 
 # Project root
 PROJECT_ROOT = Path(r"C:\Projects\clinical_trial_agent")
 sys.path.append(str(PROJECT_ROOT))
 
+from utils import llm_client
 from utils.schema_validation import validate_data
+from utils.job_queue import JobQueue
+from utils.trial_manifest import manifest_path, record_changes
 
-# Environment & GPT Client
+# Environment (GPT calls go through utils.llm_client)
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # Project Paths
-INPUT_FILE = PROJECT_ROOT / "data" / "raw" / "trials_filtered.json"
+INPUT_FILE = PROJECT_ROOT / "data" / "raw" / "trials_filtered.ndjson"  # written by ingest_clinical_trial
+LEGACY_INPUT_FILE = PROJECT_ROOT / "data" / "raw" / "trials_filtered.json"
 OUTPUT_FILE = PROJECT_ROOT / "data" / "processed" / "trials_agent_ready.json"
 CACHE_FILE = PROJECT_ROOT / "data" / "processed" / "trials_gpt_cache.json"
+JOB_QUEUE_FILE = PROJECT_ROOT / "data" / "processed" / "extraction_jobs.db"
 OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
+# Extraction pipeline: worker threads share the llm_client RPM/TPM limits, sized to the account
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "8"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "200000"))
+
 # Schema defination
 CRITERIA_SCHEMA = {
     "type": "object",
@@ -35,8 +48,11 @@ CRITERIA_SCHEMA = {
 }
 
 # GPT Extraction Logic
+def needs_llm(protocol_text: str) -> bool:
+    return bool(protocol_text) and len(protocol_text.strip()) >= 20
+
 def extract_criteria(protocol_text: str) -> Dict:
-    if not protocol_text or len(protocol_text.strip()) < 20:
+    if not needs_llm(protocol_text):
         return {"inclusion": [], "exclusion": []}
     
 #Text cleaning: convert html entities to normal characters
@@ -68,77 +84,223 @@ Protocol Text:
 \"\"\"
 """
 
-#GPT API call
-    response = client.responses.create(
+#GPT API call (pooled, rate-limited and retried by llm_client). Not response-cached:
+#good results are kept by the job queue and GPT cache, and a bad reply must not be replayed
+    response = llm_client.complete(
+        system_prompt,
+        user_prompt,
         model="gpt-4o-mini",
         temperature=0,
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
+        api="responses",
+        caller="format_clinical_trial",
+        cache=False,
     )
-#Parse & Validate GPT output
+#Parse & Validate GPT output; raising lets the job queue record the failure for a retry
     try:
         parsed = json.loads(response.output_text)
         validate_data(CRITERIA_SCHEMA, parsed)
-        return parsed
     except Exception as e:
-        print(f"⚠️ Extraction failed: {e}")
-        return {"inclusion": [], "exclusion": []}
+        raise ValueError(f"Unusable extraction output: {e}") from e
+    return parsed
+
+# Raw Trial Loading (NDJSON from the streaming ingester, or the older JSON array)
+def load_raw_trials(path: Path) -> List[Dict]:
+    if not path.exists() and path == INPUT_FILE:
+        path = LEGACY_INPUT_FILE
+    if not path.exists():
+        raise FileNotFoundError(f"Missing input file: {path}")
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix != ".ndjson":
+            return json.load(f)
+        trials = {}
+        for line in f:
+            try:
+                trial = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted ingest
+            trials[trial["nct_id"]] = trial  # updated studies are appended; the last version wins
+        return list(trials.values())
 
 # GPT Cache Handling
-def load_gpt_cache() -> Dict:
-    if CACHE_FILE.exists():
+# Entries are {"fingerprint": sha256 of the eligibility text, "criteria": {...}};
+# a trial is re-extracted whenever its text no longer matches the fingerprint.
+def criteria_fingerprint(protocol_text: str) -> str:
+    """Whitespace-insensitive hash of a trial's eligibilityCriteria."""
+    return hashlib.sha256(" ".join((protocol_text or "").split()).encode()).hexdigest()
+
+def upgrade_gpt_cache(cache: Dict, trials: List[Dict]) -> int:
+    """
+    Wraps old {nct_id: criteria} entries with the fingerprint of the text
+    they are assumed to come from (the current one), so upgrading does not
+    trigger a full re-extraction.
+    """
+    texts = {t["nct_id"]: t.get("eligibilityCriteria", "") for t in trials}
+    upgraded = 0
+    for nct_id, entry in cache.items():
+        if "fingerprint" not in entry:
+            cache[nct_id] = {"fingerprint": criteria_fingerprint(texts.get(nct_id, "")), "criteria": entry}
+            upgraded += 1
+    return upgraded
+
+def cached_criteria(cache: Dict, nct_id: str, fingerprint: str):
+    entry = cache.get(nct_id)
+    if entry and entry.get("fingerprint") == fingerprint:
+        return entry["criteria"]
+    return None
+
+def load_gpt_cache(path: Path = CACHE_FILE) -> Dict:
+    if path.exists():
         try:
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except json.JSONDecodeError:
             return {}
     return {}    
 
-def save_gpt_cache(cache: Dict):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+def save_gpt_cache(cache: Dict, path: Path = CACHE_FILE):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
+
+# Parallel Extraction Pipeline
+def _job_id(nct_id: str, fingerprint: str) -> str:
+    # Fingerprinted, so a stale result for old text is never reused
+    return f"{nct_id}@{fingerprint}"
+
+def _extraction_worker(queue: JobQueue, progress: Dict):
+    while (job := queue.claim()) is not None:
+        job_id, criteria_text = job
+        nct_id = job_id.split("@", 1)[0]
+
+        try:
+            # Throttling and transient API errors are retried inside llm_client
+            criteria = extract_criteria(criteria_text)
+            queue.complete(job_id, criteria)  # committed now; survives a crash
+            ok = True
+        except Exception as e:
+            print(f"❌ Extraction failed for {nct_id}: {e}")
+            queue.fail(job_id, str(e))
+            ok = False
+
+        with progress["lock"]:
+            progress["done" if ok else "failed"] += 1
+            finished = progress["done"] + progress["failed"]
+            if finished % 25 == 0 or finished == progress["total"]:
+                elapsed = time.perf_counter() - progress["started"]
+                print(f"⏱️ {finished}/{progress['total']} extractions | {finished / elapsed * 60:,.0f}/min")
+
+def run_extraction(
+    trials: List[Dict],
+    gpt_cache: Dict,
+    queue_path: Path = JOB_QUEUE_FILE,
+    workers: int = EXTRACT_WORKERS,
+    rpm: float = OPENAI_RPM,
+    tpm: float = OPENAI_TPM,
+) -> List[str]:
+    """
+    Extracts criteria for every new trial, or trial whose eligibility text
+    changed, with a pool of rate-limited workers. Jobs live in an on-disk
+    queue: each result is committed as it finishes, and a restarted run
+    resumes the leftover jobs. Returns the ids (re-)extracted into gpt_cache.
+    """
+    queue = JobQueue(queue_path)
+    if (recovered := queue.recover()):
+        print(f"♻️ Resuming {recovered} extractions interrupted by the previous run")
+    queue.requeue_failed()
+
+    todo = {}
+    for t in trials:
+        text = t.get("eligibilityCriteria", "")
+        fingerprint = criteria_fingerprint(text)
+        if cached_criteria(gpt_cache, t["nct_id"], fingerprint) is None:
+            todo[_job_id(t["nct_id"], fingerprint)] = text
+    # Leftover jobs for trials or texts this build no longer has are not worth a call
+    if (pruned := queue.prune(todo)):
+        print(f"🧹 Dropped {pruned} queued extractions not needed by this build")
+    queue.enqueue(todo)
+    pending = queue.counts()["pending"]
+
+    if pending:
+        print(f"🧵 Extracting {pending} trials with {workers} workers ({rpm:,.0f} RPM / {tpm:,.0f} TPM)")
+        llm_client.configure(max_concurrency=workers, rpm=rpm, tpm=tpm)
+        progress = {"lock": threading.Lock(), "done": 0, "failed": 0, "total": pending, "started": time.perf_counter()}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as pool:
+            futures = [pool.submit(_extraction_worker, queue, progress) for _ in range(workers)]
+            for fut in futures:
+                fut.result()
+
+    # Includes jobs finished by an earlier run that died before writing the cache
+    results = queue.results()
+    extracted = []
+    for job_id in todo:
+        if job_id in results:
+            nct_id, fingerprint = job_id.split("@", 1)
+            gpt_cache[nct_id] = {"fingerprint": fingerprint, "criteria": results[job_id]}
+            extracted.append(nct_id)
+    if (failed := queue.counts()["failed"]):
+        print(f"⚠️ {failed} extractions failed; they will be retried on the next run")
+    queue.close()
+    return extracted
 
 # Main Execution
 if __name__ == "__main__":
-    if not INPUT_FILE.exists():
-        raise FileNotFoundError(f"Missing input file: {INPUT_FILE}")
+    parser = argparse.ArgumentParser(description="GPT criteria extraction for raw trials")
+    parser.add_argument("--input", type=Path, default=INPUT_FILE)
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE)
+    parser.add_argument("--cache", type=Path, default=CACHE_FILE)
+    parser.add_argument("--queue", type=Path, default=JOB_QUEUE_FILE)
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS)
+    parser.add_argument("--rpm", type=float, default=OPENAI_RPM)
+    parser.add_argument("--tpm", type=float, default=OPENAI_TPM)
+    args = parser.parse_args()
 
     # Load raw trials and GPT cache
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        trials = json.load(f)
+    trials = load_raw_trials(args.input)
 
-    gpt_cache = load_gpt_cache()
+    gpt_cache = load_gpt_cache(args.cache)
+    if (upgraded := upgrade_gpt_cache(gpt_cache, trials)):
+        print(f"🔖 Fingerprinted {upgraded} cached extractions from the old cache format")
     print(f"🚀 Formatting {len(trials)} clinical trials with GPT extraction...")
 
+    extracted = run_extraction(trials, gpt_cache, args.queue, args.workers, args.rpm, args.tpm)
+
+    previous = {}
+    if args.output.exists():
+        with open(args.output, "r", encoding="utf-8") as f:
+            previous = {t["nct_id"]: t for t in json.load(f)}
+
 #Processed each trial
     processed = []
-    new_extractions = 0
     for trial in trials:
         nct_id = trial["nct_id"]
-        criteria_text = trial.get("eligibilityCriteria", "")
+        entry = gpt_cache.get(nct_id)
 
-        #Check cache first
-        if nct_id in gpt_cache:
-            trial["Criteria"] = gpt_cache[nct_id]
-        else:    
-            criteria = extract_criteria(criteria_text)
-            trial["Criteria"] = criteria
-            gpt_cache[nct_id] = criteria
-            new_extractions +=1
+        # Failed extractions stay out of the cache, so they are retried next run
+        trial["Criteria"] = entry["criteria"] if entry else {"inclusion": [], "exclusion": []}
 
         # Remove large unused fields for RAG efficiency
         trial.pop("protocolSection", None)
         processed.append(trial)
 
-    # Save agent_ready trials
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(processed, f, indent=2)
+    # Diff against the last build: new or modified records, and dropped ones
+    changed = [t["nct_id"] for t in processed if previous.get(t["nct_id"]) != t]
+    current_ids = {t["nct_id"] for t in processed}
+    removed = [nct_id for nct_id in previous if nct_id not in current_ids]
+
+    # Save agent_ready trials (untouched when nothing changed)
+    if changed or removed or not args.output.exists():
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        tmp = args.output.with_name(args.output.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(processed, f, indent=2)
+        os.replace(tmp, args.output)
+        manifest = record_changes(manifest_path(args.output), changed, removed)
+        print(f"🧾 Manifest: {len(manifest['changed'])} changed / {len(manifest['removed'])} removed pending ingest")
     
     # Save GPT cache for next runs
-    save_gpt_cache(gpt_cache)
+    save_gpt_cache(gpt_cache, args.cache)
 
-    print(f"✅ SUCCESS: Agent-ready trials saved to:{OUTPUT_FILE}")
-    print(f"📂GPT calls made this run: {new_extractions}")
-    print(f"Total cached trials: {len(gpt_cache)}")
\ No newline at end of file
+    print(f"✅ SUCCESS: Agent-ready trials saved to:{args.output} ({len(changed)} changed, {len(removed)} removed)")
+    print(f"📂GPT calls made this run: {len(extracted)}")
+    print(f"Total cached trials: {len(gpt_cache)}")
@@ -2,103 +2,228 @@
 import requests
 import json
 import os
+import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
+# Add the project root to the search path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.format_clinical_trial import criteria_fingerprint
+
 #Configuration
-load_dotenv()  #read .env so store config values 
+load_dotenv()  #read .env so store config values
 
 BASE_DIR = r"C:\Projects\clinical_trial_agent"
-OUTPUT_FILE = os.path.join(BASE_DIR, "data", "raw", "trials_filtered.json")
+OUTPUT_FILE = os.path.join(BASE_DIR, "data", "raw", "trials_filtered.json")  # legacy JSON array
+NDJSON_FILE = os.path.join(BASE_DIR, "data", "raw", "trials_filtered.ndjson")  # one trial per line, appended; last line per nct_id wins
 os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
 
+# API (point CTGOV_BASE_URL at utils/fake_ctgov_server.py for offline runs)
+BASE_URL = os.getenv("CTGOV_BASE_URL", "https://clinicaltrials.gov/api/v2")
+CONDITIONS = ["Diabetes"]
+MAXIMUM_TRIALS = 100
+PAGE_SIZE = 50  # Maximize per-call efficiency
+POOL_SIZE = 8   # pooled keep-alive connections (condition workers + their prefetches)
+
+#HTTP Session (connection pooling + retries on throttling / 5xx)
+def make_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    retries = Retry(total=4, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 #Loading Existing Trials (Caching)
-def load_existing_trials():
+def load_existing_trials(path: str = OUTPUT_FILE) -> List[Dict]:
     """THE CATCH: Load existing data to avoid redundant processing."""
-    if os.path.exists(OUTPUT_FILE):
+    if os.path.exists(path):
         try:
-            with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except json.JSONDecodeError:
             return []
     return []
 
+def iter_ndjson(path: str = NDJSON_FILE) -> Iterator[Dict]:
+    """Streams trials from the NDJSON file (a torn last line from a crash is skipped)."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def migrate_legacy_json(ndjson_path: str = NDJSON_FILE, json_path: str = OUTPUT_FILE) -> int:
+    """One-off: seeds the NDJSON file from the old JSON array."""
+    if os.path.exists(ndjson_path):
+        return 0
+    legacy = load_existing_trials(json_path)
+    tmp = ndjson_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for trial in legacy:
+            f.write(json.dumps(trial) + "\n")
+    os.replace(tmp, ndjson_path)
+    return len(legacy)
+
+#Extract trial metadata
+def to_trial_info(study: Dict) -> Optional[Dict]:
+    protocol = study.get("protocolSection", {})
+    ident = protocol.get("identificationModule", {})
+    nct_id = ident.get("nctId")
+    if not nct_id:
+        return None
+    eligibility = protocol.get("eligibilityModule", {})
+    return {
+        "nct_id": nct_id,
+        "title": ident.get("briefTitle"),
+        "eligibilityCriteria": eligibility.get("eligibilityCriteria", "No criteria listed"),
+        "minimumAge": eligibility.get("minimumAge"),
+        "maximumAge": eligibility.get("maximumAge"),
+        "sex": eligibility.get("sex"),
+        "healthyVolunteers": eligibility.get("healthyVolunteers")
+    }
+
+#Paging with prefetch
+def fetch_page(session: requests.Session, condition: str, page_token: Optional[str], base_url: str = BASE_URL, page_size: int = PAGE_SIZE) -> Dict:
+    params = {
+        "query.cond": condition,
+        "filter.overallStatus": "RECRUITING",
+        "pageSize": page_size,
+        "format": "json"
+    }
+    if page_token:
+        params["pageToken"] = page_token
+    response = session.get(f"{base_url}/studies", params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def iter_pages(session: requests.Session, condition: str, base_url: str = BASE_URL, page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """
+    Yields each page's studies while the next page is already in flight, so
+    network time overlaps with processing.
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"prefetch-{condition}") as prefetch:
+        future = prefetch.submit(fetch_page, session, condition, None, base_url, page_size)
+        try:
+            while future is not None:
+                data = future.result()
+                page_token = data.get("nextPageToken")
+                future = prefetch.submit(fetch_page, session, condition, page_token, base_url, page_size) if page_token else None
+                studies = data.get("studies", [])
+                if not studies:
+                    break
+                yield studies
+        finally:
+            if future is not None:
+                future.cancel()
+
+#Shared state across condition workers
+class _TrialSink:
+    """
+    Stored {nct_id: eligibility hash} + appending NDJSON writer + global
+    budget, shared by all workers. A known trial whose eligibility text
+    changed is appended again (readers keep the last line per nct_id) and
+    does not count against the budget of new trials.
+    """
+
+    def __init__(self, path: str, seen: Dict[str, str], maximum_trials: int):
+        self.seen = seen
+        self.remaining = maximum_trials
+        self.added = 0
+        self.updated = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    @property
+    def full(self) -> bool:
+        return self.remaining <= 0
+
+    def add(self, trial: Dict) -> bool:
+        """True for a new trial; updates are written but not counted as new."""
+        line = json.dumps(trial) + "\n"
+        digest = criteria_fingerprint(trial.get("eligibilityCriteria", ""))
+        with self._lock:
+            stored = self.seen.get(trial["nct_id"])
+            if stored == digest:
+                return False
+            is_new = stored is None
+            if is_new and self.remaining <= 0:
+                return False
+            self._file.write(line)
+            self._file.flush()  # on disk as it arrives
+            self.seen[trial["nct_id"]] = digest
+            if is_new:
+                self.remaining -= 1
+                self.added += 1
+            else:
+                self.updated += 1
+            return is_new
+
+    def close(self):
+        self._file.close()
+
+def _ingest_condition(session: requests.Session, condition: str, sink: _TrialSink, base_url: str, page_size: int) -> int:
+    added = 0
+    for studies in iter_pages(session, condition, base_url, page_size):
+        for study in studies:
+            trial_info = to_trial_info(study)
+            # CATCH LOGIC: Skip if we already have this NCT ID with the same eligibility text
+            if trial_info and sink.add(trial_info):
+                added += 1
+        if sink.full:
+            break
+    print(f"  🔎 {condition}: {added} new trials")
+    return added
+
 #Main Ingestion Function
-def ingest_raw_trials(maximum_trials=100):
+def ingest_raw_trials(
+    maximum_trials: int = MAXIMUM_TRIALS,
+    conditions: List[str] = CONDITIONS,
+    base_url: str = BASE_URL,
+    ndjson_path: str = NDJSON_FILE,
+    page_size: int = PAGE_SIZE,
+    session: Optional[requests.Session] = None,
+) -> int:
     print("🚀 STARTING API INGESTION...", flush=True)
-    
-    # Load existing "Catch" to prevent duplicates
-    existing_data = load_existing_trials()
-    existing_ids = {t["nct_id"] for t in existing_data if "nct_id" in t}
-    print(f"📦 Found {len(existing_ids)} trials already in local storage.")
-    
-    #API Call Setup
-    url = "https://clinicaltrials.gov/api/v2/studies"
-    page_token = None   # used for pagination, 
-    total_added = 0
-
-    #Pagination Loop
-    while total_added < maximum_trials:
-        params = {
-            "query.cond": "Diabetes",
-            "filter.overallStatus": "RECRUITING",
-            "pageSize": 50, # Maximize per-call efficiency
-            "format": "json"
-        }
-        if page_token:
-            params ["pageToken"] = page_token
-        
-        #Make API Call
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()        
-        data = response.json()
-        
-        #Extract studies & pagination token
-        studies = data.get("studies", [])
-        page_token = data.get("nextPageToken")
-        if not studies:
-            break
 
-        #Process each trial
-        for study in studies:
-            if total_added >= maximum_trials:
-                break
-            
-        #Extracts
-            protocol = study.get("protocolSection", {})
-            ident = protocol.get("identificationModule", {})
-            nct_id = ident.get("nctId")
-        
-        # CATCH LOGIC: Skip if we already have this NCT ID
-            if not nct_id or nct_id in existing_ids:
-                continue    
-
-        #Extarct trial metadata        
-            eligibility = protocol.get("eligibilityModule", {})
-            trial_info = {
-                "nct_id": nct_id,
-                "title": ident.get("briefTitle"),
-                "eligibilityCriteria": eligibility.get("eligibilityCriteria", "No criteria listed"),
-                "minimumAge": eligibility.get("minimumAge"),
-                "maximumAge": eligibility.get("maximumAge"),
-                "sex": eligibility.get("sex"),
-                "healthyVolunteers": eligibility.get("healthyVolunteers")
-            }
-            existing_data.append(trial_info)
-            existing_ids.add(nct_id)
-            total_added += 1
-
-        #Stop condition for pagination
-        if not page_token:
-            break    
-
-        #Write JSON File
-    if total_added > 0:
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(existing_data, f, indent=2)
-       
+    if (migrated := migrate_legacy_json(ndjson_path)):
+        print(f"📦 Moved {migrated} trials from {OUTPUT_FILE} to {ndjson_path}")
+
+    # Load existing "Catch" to prevent duplicates (ID -> text hash; records stay on disk)
+    seen = {t["nct_id"]: criteria_fingerprint(t.get("eligibilityCriteria", "")) for t in iter_ndjson(ndjson_path) if "nct_id" in t}
+    print(f"📦 Found {len(seen)} trials already in local storage.")
+
+    session = session or make_session(max(POOL_SIZE, 2 * len(conditions)))
+    sink = _TrialSink(ndjson_path, seen, maximum_trials)
+    try:
+        with ThreadPoolExecutor(max_workers=len(conditions), thread_name_prefix="ctgov") as pool:
+            futures = [pool.submit(_ingest_condition, session, c, sink, base_url, page_size) for c in conditions]
+            for fut in futures:
+                fut.result()
+    finally:
+        sink.close()
+
         #Final log
-    print(f"✅ Added {total_added} new trials (total_stored: {len(existing_data)})")
-    
+    print(f"✅ Added {sink.added} new trials, updated {sink.updated} (total_stored: {len(sink.seen)}) -> {ndjson_path}")
+    return sink.added
+
     #Run script
 if __name__ == "__main__":
-    ingest_raw_trials()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Stream recruiting trials from ClinicalTrials.gov")
+    parser.add_argument("--conditions", nargs="+", default=CONDITIONS)
+    parser.add_argument("--max", type=int, default=MAXIMUM_TRIALS, help="new trials to add across all conditions")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output", default=NDJSON_FILE)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    ingest_raw_trials(args.max, args.conditions, args.base_url, args.output, args.page_size)
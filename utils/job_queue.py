@@ -0,0 +1,125 @@
+# utils/job_queue.py
+
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+# -----------------------------
+# Persistent Job Queue
+# -----------------------------
+# A small SQLite-backed work queue for long LLM batch jobs. Every state change
+# commits immediately, so a crashed or interrupted run keeps all finished
+# results; on restart, jobs left "running" by the dead process go back to
+# "pending" and the remaining work continues where it stopped.
+#
+#   pending -> running -> done
+#                     \-> failed  (retried on the next run via requeue_failed)
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id       TEXT PRIMARY KEY,
+    payload  TEXT NOT NULL,
+    status   TEXT NOT NULL,
+    result   TEXT,
+    error    TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+"""
+
+
+class JobQueue:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # ---------- setup ----------
+    def enqueue(self, jobs: Dict[str, Any]) -> int:
+        """Adds {id: payload} jobs; ids already queued (in any state) are left alone."""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (id, payload, status, updated) VALUES (?, ?, ?, ?)",
+                [(job_id, json.dumps(payload), PENDING, now) for job_id, payload in jobs.items()],
+            )
+            return self._conn.total_changes - before
+
+    def recover(self) -> int:
+        """Returns jobs a dead run left in 'running' to the queue."""
+        return self._set_all(RUNNING, PENDING)
+
+    def requeue_failed(self) -> int:
+        return self._set_all(FAILED, PENDING)
+
+    def prune(self, keep) -> int:
+        """Drops unfinished jobs whose id is not in keep (work a newer build no longer needs)."""
+        keep = set(keep)
+        with self._lock:
+            stale = [
+                (job_id,) for (job_id,) in self._conn.execute("SELECT id FROM jobs WHERE status != ?", (DONE,))
+                if job_id not in keep
+            ]
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", stale)
+            return len(stale)
+
+    def _set_all(self, old: str, new: str) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE status = ?", (new, time.time(), old)
+            )
+            return cur.rowcount
+
+    # ---------- workers ----------
+    def claim(self) -> Optional[Tuple[str, Any]]:
+        """Atomically takes the next pending job (None when the queue is drained)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, payload FROM jobs WHERE status = ? ORDER BY rowid LIMIT 1", (PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (RUNNING, time.time(), row[0]),
+            )
+            return row[0], json.loads(row[1])
+
+    def complete(self, job_id: str, result: Any):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, updated = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                (FAILED, error[:2000], time.time(), job_id),
+            )
+
+    # ---------- results ----------
+    def results(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, result FROM jobs WHERE status = ?", (DONE,)).fetchall()
+        return {job_id: json.loads(result) for job_id, result in rows}
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
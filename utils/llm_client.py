@@ -1,14 +1,349 @@
 import os
-from openai import OpenAI
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+
+from utils import disk_cache
+from utils.app_logger import get_logger
+from utils.rate_limit import TokenBucket
+from utils.retry import aretry, retry
 
 load_dotenv()
+logger = get_logger("LLMClient")
+
+# -----------------------------
+# Configuration
+# -----------------------------
+# Every OpenAI call in the project goes through this module: one pooled HTTP
+# client per process, shared concurrency + RPM/TPM limits, jittered retries,
+# and a deterministic response cache for temperature-0 calls.
+DEFAULT_MODEL = "gpt-4o"
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RPM = float(os.getenv("LLM_RPM", os.getenv("OPENAI_RPM", "500")))
+LLM_TPM = float(os.getenv("LLM_TPM", os.getenv("OPENAI_TPM", "200000")))
+RETRIES = int(os.getenv("LLM_RETRIES", "4"))
+TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT", "60"))
+DEFAULT_OUTPUT_TOKENS = 500  # TPM estimate when max_tokens is not given
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+CACHE_NAMESPACE = "llm_responses"
+
+# Transient failures worth another attempt; anything else (bad request, auth) is raised at once
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    cached: bool = False
+    latency: float = 0.0
+
+    @property
+    def output_text(self) -> str:
+        """Same accessor as the Responses API object call_llm used to return."""
+        return self.text
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+# -----------------------------
+# Shared clients & limits
+# -----------------------------
+_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+_client_pid = None
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()  # event loop -> (client, semaphore)
+_semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_limits = {"concurrency": MAX_CONCURRENCY, "rpm": TokenBucket.per_minute(LLM_RPM), "tpm": TokenBucket.per_minute(LLM_TPM, burst=LLM_TPM / 60 * 5)}
+
+
+def _api_key() -> str:
+    key = os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY not found in environment")
+    return key
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_limits["concurrency"] * 2, max_keepalive_connections=_limits["concurrency"])
+
+
+def get_client() -> OpenAI:
+    """Process-wide sync client over one pooled httpx connection pool (created on first use)."""
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = OpenAI(
+                api_key=_api_key(),
+                max_retries=0,  # retries happen here, with jitter, outside the concurrency slot
+                timeout=TIMEOUT_SECONDS,
+                http_client=httpx.Client(limits=_pool_limits(), timeout=TIMEOUT_SECONDS),
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def _get_async():
+    """Async client + semaphore for the running event loop (httpx pools are loop-bound)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            client = AsyncOpenAI(
+                api_key=_api_key(),
+                max_retries=0,
+                timeout=TIMEOUT_SECONDS,
+                http_client=httpx.AsyncClient(limits=_pool_limits(), timeout=TIMEOUT_SECONDS),
+            )
+            _async_clients[loop] = (client, asyncio.Semaphore(_limits["concurrency"]))
+        return _async_clients[loop]
+
+
+def configure(max_concurrency: int = None, rpm: float = None, tpm: float = None):
+    """Adjusts the shared limits (e.g. to a batch job's account tier). Call before heavy use."""
+    global _semaphore
+    with _lock:
+        if max_concurrency:
+            _limits["concurrency"] = max_concurrency
+            _semaphore = threading.BoundedSemaphore(max_concurrency)
+            _async_clients.clear()
+        if rpm:
+            _limits["rpm"] = TokenBucket.per_minute(rpm)
+        if tpm:
+            _limits["tpm"] = TokenBucket.per_minute(tpm, burst=tpm / 60 * 5)
+
+
+# -----------------------------
+# Per-caller metrics
+# -----------------------------
+_metrics: Dict[str, Dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+
+
+def record(caller: str, latency: float = 0.0, input_tokens: int = 0, output_tokens: int = 0,
+           cached: bool = False, error: bool = False):
+    with _metrics_lock:
+        m = _metrics.setdefault(caller, {
+            "calls": 0, "cache_hits": 0, "errors": 0,
+            "input_tokens": 0, "output_tokens": 0, "latency_total": 0.0, "latency_max": 0.0,
+        })
+        m["calls"] += 1
+        m["cache_hits"] += int(cached)
+        m["errors"] += int(error)
+        m["input_tokens"] += input_tokens
+        m["output_tokens"] += output_tokens
+        if not cached and not error:
+            m["latency_total"] += latency
+            m["latency_max"] = max(m["latency_max"], latency)
+
+
+def metrics(caller: str = None) -> Dict[str, Dict[str, float]]:
+    """Counters per caller, plus cache hit rate and mean latency of live calls."""
+    with _metrics_lock:
+        out = {}
+        for name, m in _metrics.items():
+            if caller is not None and name != caller:
+                continue
+            live = m["calls"] - m["cache_hits"] - m["errors"]
+            out[name] = {
+                **m,
+                "cache_hit_rate": round(m["cache_hits"] / m["calls"], 3) if m["calls"] else 0.0,
+                "latency_avg": round(m["latency_total"] / live, 4) if live else 0.0,
+            }
+        return out
+
+
+# -----------------------------
+# Requests
+# -----------------------------
+def _request(api: str, model: str, system_prompt: str, user_prompt: str, temperature: float,
+             response_format: Optional[Dict], max_tokens: Optional[int]) -> Dict[str, Any]:
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    if api == "chat":
+        kwargs = {"model": model, "messages": messages, "temperature": temperature}
+        if response_format:
+            kwargs["response_format"] = response_format
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+    elif api == "responses":
+        # Note: In Responses API, 'input' replaces 'messages'
+        kwargs = {"model": model, "input": messages, "temperature": temperature}
+        if response_format:
+            kwargs["text"] = {"format": response_format}
+        if max_tokens:
+            kwargs["max_output_tokens"] = max_tokens
+    else:
+        raise ValueError(f"Unknown LLM api: {api}")
+    return kwargs
+
+
+def _cache_key(api: str, kwargs: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps({"api": api, **kwargs}, sort_keys=True).encode()).hexdigest()
+
+
+def _parse(api: str, response) -> LLMResponse:
+    usage = getattr(response, "usage", None)
+    if api == "chat":
+        text = response.choices[0].message.content or ""
+        tokens = {"input_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                  "output_tokens": getattr(usage, "completion_tokens", 0) or 0}
+    else:
+        text = response.output_text
+        tokens = {"input_tokens": getattr(usage, "input_tokens", 0) or 0,
+                  "output_tokens": getattr(usage, "output_tokens", 0) or 0}
+    return LLMResponse(text=text, model=getattr(response, "model", "") or "", usage=tokens)
+
+
+def _token_estimate(system_prompt: str, user_prompt: str, max_tokens: Optional[int]) -> int:
+    return (len(system_prompt) + len(user_prompt)) // 4 + 1 + (max_tokens or DEFAULT_OUTPUT_TOKENS)
+
+
+def _cached(caller: str, key: Optional[str]) -> Optional[LLMResponse]:
+    if key is None:
+        return None
+    hit = disk_cache.load(CACHE_NAMESPACE, key)
+    if hit is None:
+        return None
+    record(caller, cached=True)
+    return LLMResponse(text=hit["text"], model=hit["model"], usage=hit.get("usage", {}), cached=True)
+
+
+def _store(caller: str, key: Optional[str], result: LLMResponse):
+    record(caller, result.latency, result.usage.get("input_tokens", 0), result.usage.get("output_tokens", 0))
+    if key is not None:
+        disk_cache.save(CACHE_NAMESPACE, key, {"text": result.text, "model": result.model, "usage": result.usage})
+
+
+def complete(
+    system_prompt: str,
+    user_prompt: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0,
+    response_format: Optional[Dict[str, Any]] = None,
+    max_tokens: Optional[int] = None,
+    api: str = "responses",
+    caller: str = "default",
+    cache: Optional[bool] = None,
+) -> LLMResponse:
+    """
+    One system + user turn through the shared client. api="responses" or
+    "chat" (chat.completions). Responses are cached by (api, model, prompts,
+    params) when cache is on; by default only for temperature 0, where
+    repeating the call would give the same answer anyway.
+    """
+    kwargs = _request(api, model, system_prompt, user_prompt, temperature, response_format, max_tokens)
+    use_cache = CACHE_ENABLED and (temperature == 0 if cache is None else cache)
+    key = _cache_key(api, kwargs) if use_cache else None
+    if (hit := _cached(caller, key)) is not None:
+        return hit
+
+    client = get_client()
+    endpoint = client.chat.completions if api == "chat" else client.responses
+    tokens = _token_estimate(system_prompt, user_prompt, max_tokens)
+
+    def attempt():
+        _limits["rpm"].acquire()
+        _limits["tpm"].acquire(tokens)
+        with _semaphore:
+            started = time.perf_counter()
+            result = _parse(api, endpoint.create(**kwargs))
+            result.latency = time.perf_counter() - started
+            return result
+
+    try:
+        result = retry(attempt, attempts=RETRIES, retry_on=RETRYABLE, label=f"{caller} {model}")
+    except Exception:
+        record(caller, error=True)
+        raise
+    _store(caller, key, result)
+    return result
+
+
+async def acomplete(
+    system_prompt: str,
+    user_prompt: str,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0,
+    response_format: Optional[Dict[str, Any]] = None,
+    max_tokens: Optional[int] = None,
+    api: str = "responses",
+    caller: str = "default",
+    cache: Optional[bool] = None,
+) -> LLMResponse:
+    """Async twin of complete(); shares its limits, cache and metrics."""
+    kwargs = _request(api, model, system_prompt, user_prompt, temperature, response_format, max_tokens)
+    use_cache = CACHE_ENABLED and (temperature == 0 if cache is None else cache)
+    key = _cache_key(api, kwargs) if use_cache else None
+    if (hit := _cached(caller, key)) is not None:
+        return hit
+
+    client, semaphore = _get_async()
+    endpoint = client.chat.completions if api == "chat" else client.responses
+    tokens = _token_estimate(system_prompt, user_prompt, max_tokens)
+
+    async def attempt():
+        await _limits["rpm"].acquire_async()
+        await _limits["tpm"].acquire_async(tokens)
+        async with semaphore:
+            started = time.perf_counter()
+            result = _parse(api, await endpoint.create(**kwargs))
+            result.latency = time.perf_counter() - started
+            return result
+
+    try:
+        result = await aretry(attempt, attempts=RETRIES, retry_on=RETRYABLE, label=f"{caller} {model}")
+    except Exception:
+        record(caller, error=True)
+        raise
+    _store(caller, key, result)
+    return result
+
+
+def embed(
+    texts: List[str],
+    model: str,
+    caller: str = "embeddings",
+    client: Optional[OpenAI] = None,
+) -> List[List[float]]:
+    """
+    One embeddings.create request through the shared limits and retries.
+    Vectors come back in input order; no response cache (callers keep their
+    own vector stores).
+    """
+    client = client or get_client()
+    tokens = sum(len(t) // 4 + 1 for t in texts)
+
+    def attempt():
+        _limits["rpm"].acquire()
+        _limits["tpm"].acquire(tokens)
+        with _semaphore:
+            started = time.perf_counter()
+            resp = client.embeddings.create(model=model, input=texts)
+            return resp, time.perf_counter() - started
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    try:
+        resp, latency = retry(attempt, attempts=RETRIES, retry_on=RETRYABLE, label=f"{caller} {model}")
+    except Exception:
+        record(caller, error=True)
+        raise
+    usage = getattr(resp, "usage", None)
+    record(caller, latency, getattr(usage, "prompt_tokens", 0) or 0)
+    return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
 
-if not os.getenv("OPENAI_API_KEY"):
-    raise RuntimeError("OPENAI_API_KEY not found in environment")
 
 def call_llm(
     system_prompt: str,
@@ -16,18 +351,11 @@ def call_llm(
     model: str = "gpt-4o",
     temperature: float = 0,
     response_format: Optional[Dict[str, Any]] = None,
-):
+    caller: str = "default",
+) -> LLMResponse:
     """
     Canonical OpenAI Responses API interface.
     Safe for agentic workflows, schema validation, and LangGraph.
     """
-    # Note: In Responses API, 'input' replaces 'messages'
-    response = client.responses.create(
-        model=model,
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-
-    return response
+    return complete(system_prompt, user_prompt, model=model, temperature=temperature,
+                    response_format=response_format, api="responses", caller=caller)
@@ -0,0 +1,108 @@
+# utils/load_test.py
+"""
+Load test for the eligibility API: fires requests at a running server with a
+fixed number of concurrent clients and reports throughput and latency
+percentiles.
+
+    uvicorn fastapi_app:app --port 8000 --workers 1
+    python -m utils.load_test --url http://127.0.0.1:8000 --endpoint match --requests 2000 --concurrency 64
+
+Payloads are built from the synthetic cohort (match / check) or cycle over
+the catalog trials (recruit).
+"""
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import httpx
+import numpy as np
+
+PATIENTS_PATH = "data/patients/synthetic_patients.json"
+TRIALS_PATH = "data/processed/trials_agent_ready.json"
+
+
+def _patient_body(p: Dict) -> Dict:
+    demo = p.get("demographics") or {}
+    return {
+        "patient_id": p["patient_id"],
+        "age": demo.get("age"),
+        "sex": demo.get("sex"),
+        "conditions": p.get("conditions", []),
+        "medications": p.get("medications", []),
+    }
+
+
+def build_requests(endpoint: str, n: int) -> List[Tuple[str, str, Dict]]:
+    """(method, path, json body) for n requests."""
+    if endpoint == "recruit":
+        with open(TRIALS_PATH, "r", encoding="utf-8") as f:
+            ids = [t["nct_id"] for t in json.load(f)]
+        return [("GET", f"/trials/{ids[i % len(ids)]}/patients?page_size=50", None) for i in range(n)]
+
+    with open(PATIENTS_PATH, "r", encoding="utf-8") as f:
+        patients = json.load(f)
+    path = {"match": "/match", "check": "/check_eligibility"}[endpoint]
+    return [("POST", path, _patient_body(patients[i % len(patients)])) for i in range(n)]
+
+
+async def run(url: str, requests: List[Tuple[str, str, Dict]], concurrency: int, timeout: float = 60.0) -> Dict:
+    queue: asyncio.Queue = asyncio.Queue()
+    for r in requests:
+        queue.put_nowait(r)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            while not queue.empty():
+                method, path, body = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    res = await client.request(method, path, json=body)
+                    statuses[res.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {
+        "requests": len(requests),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "rps": round(len(requests) / elapsed, 1),
+        "p50_ms": round(p50, 2),
+        "p90_ms": round(p90, 2),
+        "p99_ms": round(p99, 2),
+        "max_ms": round(float(ms.max()), 2),
+        "statuses": dict(statuses),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eligibility API load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["match", "recruit", "check"], default="match")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=0, help="requests sent (and not counted) before measuring")
+    args = parser.parse_args()
+
+    reqs = build_requests(args.endpoint, args.warmup + args.requests)
+    if args.warmup:
+        asyncio.run(run(args.url, reqs[:args.warmup], args.concurrency))
+    report = asyncio.run(run(args.url, reqs[args.warmup:], args.concurrency))
+
+    print(f"🎯 {args.endpoint}: {report['requests']} requests @ {report['concurrency']} concurrent in {report['seconds']}s")
+    print(f"⚡ {report['rps']} req/s | p50 {report['p50_ms']} ms | p90 {report['p90_ms']} ms | "
+          f"p99 {report['p99_ms']} ms | max {report['max_ms']} ms")
+    print(f"📬 Statuses: {report['statuses']}")
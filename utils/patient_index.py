@@ -0,0 +1,222 @@
+# utils/patient_index.py
+
+import os
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.app_logger import get_logger
+from utils.eligibility_matrix import SEX_CODES, parse_age, terms
+from utils.med_vocab import normalize as vocab_normalize
+from utils.trial_catalog import TrialRecord
+
+logger = get_logger("PatientIndex")
+
+# -----------------------------
+# Reverse Recruitment Index
+# -----------------------------
+# Trial -> patient search for sponsors ("top N eligible patients for NCT...").
+# Built once over the cohort:
+#   term -> sorted patient rows   (inverted index: conditions and medications)
+#   age / sex arrays              (demographic bounds, vectorized)
+#   phenotype vectors             (one query embedding per distinct query text)
+# A lookup finds the vocabulary terms named by the trial's criteria, ORs their
+# posting lists into masks (same rules as utils.eligibility_matrix) and ranks
+# the survivors by cosine similarity of the trial vector to their phenotype.
+PATIENTS_PATH = Path(os.getenv("PATIENTS_PATH", "data/patients/synthetic_patients.json"))
+
+
+def _criteria_terms(vocab: List[str], texts) -> List[str]:
+    texts = [vocab_normalize(t).strip() for t in texts if t]
+    return [term for term in vocab if any(term in t for t in texts)]
+
+
+class PatientIndex:
+    def __init__(
+        self,
+        patients: List[Dict],
+        query_text: Optional[Callable[[Dict], str]] = None,
+        index=None,
+    ):
+        """
+        query_text: the retrieval query a patient produces (reasoning_engine's
+        build_query_text), embedded once per distinct text for ranking.
+        index: vector index holding the trial embeddings. Without either,
+        candidates are ranked by cohort order.
+        """
+        self.patients = patients
+        self.patient_ids = np.array([p["patient_id"] for p in patients], dtype=object)
+        self._index = index
+        self._lock = threading.Lock()
+        self._trial_terms: Dict[str, tuple] = {}
+        self._trial_vectors: Dict[str, Optional[np.ndarray]] = {}
+
+        # Inverted index: term -> patient rows
+        conditions: Dict[str, List[int]] = {}
+        medications: Dict[str, List[int]] = {}
+        for row, p in enumerate(patients):
+            for term in dict.fromkeys(terms(p.get("conditions", []))):
+                conditions.setdefault(term, []).append(row)
+            for term in dict.fromkeys(terms(p.get("medications", []))):
+                medications.setdefault(term, []).append(row)
+        self.conditions = {t: np.array(rows, dtype=np.intp) for t, rows in conditions.items()}
+        self.medications = {t: np.array(rows, dtype=np.intp) for t, rows in medications.items()}
+        self.vocabulary = list(dict.fromkeys([*self.conditions, *self.medications]))
+
+        demographics = [p.get("demographics") or {} for p in patients]
+        self.age = np.array([parse_age(d.get("age"), np.nan) for d in demographics])
+        self.sex = np.array([SEX_CODES.get(str(d.get("sex", "")).upper(), 0) for d in demographics])
+
+        # Phenotype vectors (unit length), one per distinct query text
+        self.phenotype_of = np.zeros(len(patients), dtype=np.intp)
+        self.phenotype_vectors: Optional[np.ndarray] = None
+        if query_text is not None:
+            self._embed_phenotypes([query_text(p) for p in patients])
+
+    @classmethod
+    def from_file(cls, path: Path = PATIENTS_PATH, **kwargs) -> "PatientIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def _embed_phenotypes(self, texts: List[str]):
+        from utils.query_embedding_cache import get_query_embeddings
+
+        distinct = {t: i for i, t in enumerate(dict.fromkeys(texts))}
+        try:
+            vectors = np.asarray(get_query_embeddings(list(distinct)), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"⚠️ Patient embeddings unavailable, ranking by cohort order: {e}")
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.phenotype_vectors = vectors / np.where(norms == 0, 1, norms)
+        self.phenotype_of = np.array([distinct[t] for t in texts], dtype=np.intp)
+
+    # ---------- trial side ----------
+    def _terms_for(self, trial: TrialRecord) -> tuple:
+        key = f"{trial.nct_id}@{trial.criteria_version}"
+        found = self._trial_terms.get(key)
+        if found is None:
+            found = self._trial_terms[key] = (
+                _criteria_terms(self.vocabulary, trial.inclusion),
+                _criteria_terms(self.vocabulary, trial.exclusion),
+            )
+        return found
+
+    def _fetch_vectors(self, ids: List[str], batch_size: int = 100):
+        """Unit trial vectors into the memo (None for trials the index lacks)."""
+        if self._index is None or self.phenotype_vectors is None:
+            fetched = {}
+        else:
+            from vector_store.vector_index import fetch_vectors
+
+            fetched = {}
+            for start in range(0, len(ids), batch_size):
+                fetched.update(fetch_vectors(self._index, ids[start:start + batch_size]))
+        with self._lock:
+            for nct_id in ids:
+                vec = fetched.get(nct_id)
+                if vec is not None:
+                    vec = np.asarray(vec, dtype=np.float32)
+                    vec /= np.linalg.norm(vec) or 1.0
+                self._trial_vectors[nct_id] = vec
+
+    def _vector_for(self, nct_id: str) -> Optional[np.ndarray]:
+        if nct_id not in self._trial_vectors:
+            self._fetch_vectors([nct_id])
+        return self._trial_vectors[nct_id]
+
+    def warm(self, trials) -> int:
+        """Criteria terms and trial vectors up front (batched), so searches never touch the network."""
+        trials = list(trials)
+        for t in trials:
+            self._terms_for(t)
+        ids = [t.nct_id for t in trials if t.nct_id not in self._trial_vectors]
+        self._fetch_vectors(ids)
+        return len(ids)
+
+    def _rows(self, postings: Dict[str, np.ndarray], found: List[str]) -> np.ndarray:
+        mask = np.zeros(len(self.patients), dtype=bool)
+        for term in found:
+            rows = postings.get(term)
+            if rows is not None:
+                mask[rows] = True
+        return mask
+
+    # ---------- queries ----------
+    def eligible(self, trial: TrialRecord) -> np.ndarray:
+        """Boolean mask over patients: an inclusion hit, no exclusion hit, age and sex in bounds."""
+        inclusion, exclusion = self._terms_for(trial)
+        mask = self._rows(self.conditions, inclusion)
+        mask &= ~self._rows(self.conditions, exclusion)
+        mask &= ~self._rows(self.medications, exclusion)
+
+        min_age, max_age = parse_age(trial.min_age, 0.0), parse_age(trial.max_age, np.inf)
+        mask &= np.isnan(self.age) | ((self.age >= min_age) & (self.age <= max_age))
+        trial_sex = SEX_CODES.get(str(trial.sex).upper(), 0)
+        if trial_sex:
+            mask &= (self.sex == 0) | (self.sex == trial_sex)
+        return mask
+
+    def search(self, trial: TrialRecord, page: int = 1, page_size: int = 20) -> Dict:
+        """Eligible patients for a trial, best similarity first, one page at a time."""
+        rows = np.flatnonzero(self.eligible(trial))
+        vec = self._vector_for(trial.nct_id)
+        if vec is not None:
+            scores = (self.phenotype_vectors @ vec)[self.phenotype_of[rows]]
+            order = np.lexsort((rows, -scores))  # ties keep cohort order
+            rows, scores = rows[order], scores[order]
+        else:
+            scores = None
+
+        start = (page - 1) * page_size
+        window = slice(start, start + page_size)
+        results = []
+        for i, row in enumerate(rows[window]):
+            p = self.patients[row]
+            results.append({
+                "patient_id": p["patient_id"],
+                "score": round(float(scores[window][i]), 4) if scores is not None else None,
+                "age": (p.get("demographics") or {}).get("age"),
+                "sex": (p.get("demographics") or {}).get("sex"),
+                "conditions": p.get("conditions", []),
+            })
+        return {
+            "nct_id": trial.nct_id,
+            "title": trial.title,
+            "total": int(len(rows)),
+            "page": page,
+            "page_size": page_size,
+            "pages": -(-len(rows) // page_size),
+            "ranked_by": "similarity" if scores is not None else "cohort_order",
+            "results": results,
+        }
+
+
+# -----------------------------
+# Latency check (full cohort, every catalog trial)
+# -----------------------------
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from agents.reasoning_engine import build_query_text, index
+    from utils.trial_catalog import get_catalog
+
+    started = time.perf_counter()
+    pidx = PatientIndex.from_file(query_text=build_query_text, index=index)
+    print(f"🗂️ Indexed {len(pidx.patients):,} patients ({len(pidx.vocabulary)} terms) in {time.perf_counter() - started:,.2f}s")
+
+    trials = list(get_catalog())
+    pidx.warm(trials)
+
+    timings = []
+    for _ in range(20):
+        for t in trials:
+            started = time.perf_counter()
+            pidx.search(t, page=2, page_size=50)
+            timings.append((time.perf_counter() - started) * 1000)
+    p50, p99 = np.percentile(timings, [50, 99])
+    print(f"⚡ {len(timings):,} searches: p50 {p50:.2f} ms | p99 {p99:.2f} ms")
@@ -0,0 +1,101 @@
+# utils/query_embedding_cache.py
+
+import os
+import re
+import atexit
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from utils.embedding_service import EMBED_MODEL, embed, embed_many
+from utils.embedding_store import EmbeddingStore
+
+# -----------------------------
+# Content-Addressed Query Embeddings
+# -----------------------------
+# Vectors are keyed by sha256(model + normalized query text), so every
+# patient with the same condition list shares one embedding and a changed
+# condition list can never be served a stale vector. Which key a patient
+# used lives in the small patient -> key map the workflow carries around.
+# The old patient_id-keyed caches are not imported: they record neither the
+# query text nor the model a vector came from, so filing one under a shared
+# content key could serve a stale vector to every patient with that text.
+STORE_PATH = Path(os.getenv("QUERY_EMBED_STORE", "data/cache/query_embeddings"))
+STORE_DTYPE = os.getenv("QUERY_EMBED_DTYPE", "float32")  # or float16 for half the size
+SAVE_EVERY = 256  # new vectors buffered before the files are rewritten
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+_unsaved = 0
+_unsaved_lock = threading.Lock()
+
+
+def normalize_query(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def query_key(text: str, model: str = EMBED_MODEL) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_query(text)}".encode()).hexdigest()
+
+
+def get_store() -> EmbeddingStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(STORE_PATH, dtype=STORE_DTYPE)
+        return _store
+
+
+def save():
+    global _unsaved
+    with _unsaved_lock:
+        get_store().save()
+        _unsaved = 0
+
+
+atexit.register(lambda: _store is not None and save())
+
+
+def _record_new(n: int):
+    global _unsaved
+    with _unsaved_lock:
+        _unsaved += n
+        due = _unsaved >= SAVE_EVERY
+    if due:
+        save()
+
+
+# -----------------------------
+# Lookups
+# -----------------------------
+def get_query_embedding(text: str) -> List[float]:
+    store = get_store()
+    key = query_key(text)
+    vec = store.get(key)
+    if vec is None:
+        vec = embed(text)
+        store.put(key, vec)
+        _record_new(1)
+        return list(vec)
+    return vec.tolist()
+
+
+def get_query_embeddings(texts: List[str]) -> np.ndarray:
+    """Batch variant: each distinct uncached text is embedded once. Returns (N x dim) float32."""
+    store = get_store()
+    keys = [query_key(t) for t in texts]
+
+    missing = {}
+    for k, t in zip(keys, texts):
+        if k not in store and k not in missing:
+            missing[k] = t
+    if missing:
+        for k, vec in zip(missing, embed_many(list(missing.values()))):
+            store.put(k, vec)
+        _record_new(len(missing))
+
+    return store.get_many(keys)
+
@@ -0,0 +1,55 @@
+# utils/retry.py
+
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Tuple, Type, TypeVar
+
+from utils.app_logger import get_logger
+
+logger = get_logger("Retry")
+
+T = TypeVar("T")
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry(
+    fn: Callable[[], T],
+    attempts: int = 3,
+    base: float = 0.5,
+    cap: float = 30.0,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    label: str = "call",
+) -> T:
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base, cap)
+            logger.warning(f"🔁 {label} failed ({e}); retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def aretry(
+    fn: Callable[[], Awaitable[T]],
+    attempts: int = 3,
+    base: float = 0.5,
+    cap: float = 30.0,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    label: str = "call",
+) -> T:
+    for attempt in range(attempts):
+        try:
+            return await fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt, base, cap)
+            logger.warning(f"🔁 {label} failed ({e}); retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,108 @@
+# utils/trial_catalog.py
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# -----------------------------
+# Trial Catalog
+# -----------------------------
+# trials_agent_ready.json is parsed once per process into compact, read-only
+# records. Retrieval only needs trial IDs back from the vector index; title
+# and criteria are resolved here instead of being shipped (and json.loads'd)
+# in every match's metadata. Lowercased criteria are interned, so identical
+# boilerplate rules across trials share one string. criteria_version is a
+# short content hash of the criteria, computed once here, so caches can key
+# on (nct_id, criteria_version) without re-serializing criteria per lookup.
+CATALOG_PATH = Path(os.getenv("TRIAL_CATALOG_PATH", "data/processed/trials_agent_ready.json"))
+
+
+def criteria_version(criteria: Dict) -> str:
+    """Short, stable hash of a Criteria dict."""
+    return hashlib.sha256(json.dumps(criteria, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class TrialRecord:
+    __slots__ = (
+        "nct_id", "title", "min_age", "max_age", "sex",
+        "inclusion", "exclusion", "inclusion_lc", "exclusion_lc", "criteria_version", "_criteria_keys",
+    )
+
+    def __init__(self, trial: Dict):
+        criteria = trial.get("Criteria") or {}
+        inclusion = tuple(criteria.get("inclusion", []))
+        exclusion = tuple(criteria.get("exclusion", []))
+        values = {
+            "nct_id": str(trial.get("nct_id") or trial.get("NCTId")),
+            "title": str(trial.get("title") or ""),
+            "min_age": str(trial.get("minimumAge") or "0"),
+            "max_age": trial.get("maximumAge"),
+            "sex": trial.get("sex") or "ALL",
+            "inclusion": inclusion,
+            "exclusion": exclusion,
+            "inclusion_lc": tuple(sys.intern(c.lower()) for c in inclusion),
+            "exclusion_lc": tuple(sys.intern(c.lower()) for c in exclusion),
+            "criteria_version": criteria_version(criteria),
+            "_criteria_keys": tuple(criteria),
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    @property
+    def criteria(self) -> Dict[str, List[str]]:
+        """Fresh dict shaped exactly like the source `Criteria` (callers may hash or mutate it)."""
+        lists = {"inclusion": self.inclusion, "exclusion": self.exclusion}
+        return {k: list(lists[k]) for k in self._criteria_keys}
+
+    def __repr__(self) -> str:
+        return f"TrialRecord({self.nct_id!r}, {len(self.inclusion)} inclusion, {len(self.exclusion)} exclusion)"
+
+
+class TrialCatalog:
+    def __init__(self, records: Dict[str, TrialRecord]):
+        self._records = records
+
+    @classmethod
+    def from_file(cls, path: Path = CATALOG_PATH) -> "TrialCatalog":
+        if not Path(path).exists():
+            return cls({})
+        with open(path, "r", encoding="utf-8") as f:
+            trials = json.load(f)
+        records = (TrialRecord(t) for t in trials)
+        return cls({r.nct_id: r for r in records})
+
+    def get(self, nct_id: str) -> Optional[TrialRecord]:
+        return self._records.get(nct_id)
+
+    def resolve(self, ids: List[str]) -> Tuple[List[Optional[TrialRecord]], List[str]]:
+        """Records for ids (None where unknown) and the list of unknown ids."""
+        records = [self._records.get(i) for i in ids]
+        return records, [i for i, r in zip(ids, records) if r is None]
+
+    def __contains__(self, nct_id: str) -> bool:
+        return nct_id in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[TrialRecord]:
+        return iter(self._records.values())
+
+
+_catalog: Optional[TrialCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> TrialCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = TrialCatalog.from_file(CATALOG_PATH)
+        return _catalog
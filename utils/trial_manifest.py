@@ -0,0 +1,59 @@
+# utils/trial_manifest.py
+
+import os
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+# -----------------------------
+# Changed-Trials Manifest
+# -----------------------------
+# format_clinical_trial records which trials it added, re-extracted or
+# dropped; pinecone_ingest re-embeds and upserts only those and then marks
+# the manifest consumed. Changes accumulate across builds until an ingest
+# succeeds, so two builds in a row never hide the first diff.
+MANIFEST_NAME = "trials_manifest.json"
+
+
+def manifest_path(trials_path: Path) -> Path:
+    """The manifest lives next to trials_agent_ready.json."""
+    return Path(trials_path).with_name(MANIFEST_NAME)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def load_manifest(path: Path) -> Dict:
+    if Path(path).exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"changed": [], "removed": []}
+
+
+def _write(path: Path, manifest: Dict):
+    tmp = Path(path).with_name(Path(path).name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def record_changes(path: Path, changed: Iterable[str], removed: Iterable[str]) -> Dict:
+    """Merges a build's diff into the pending (not yet ingested) changes."""
+    manifest = load_manifest(path)
+    changed, removed = set(changed), set(removed)
+    manifest["changed"] = sorted((set(manifest.get("changed", [])) - removed) | changed)
+    manifest["removed"] = sorted((set(manifest.get("removed", [])) - changed) | removed)
+    manifest["built_at"] = _now()
+    _write(path, manifest)
+    return manifest
+
+
+def mark_ingested(path: Path, ids: List[str], removed: List[str]):
+    """Clears the ids an ingest handled (changes recorded meanwhile stay pending)."""
+    manifest = load_manifest(path)
+    manifest["changed"] = sorted(set(manifest.get("changed", [])) - set(ids))
+    manifest["removed"] = sorted(set(manifest.get("removed", [])) - set(removed))
+    manifest["ingested_at"] = _now()
+    _write(path, manifest)
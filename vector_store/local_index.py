@@ -0,0 +1,380 @@
+# vector_store/local_index.py
+
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils.embedding_store import EmbeddingStore
+from vector_store.vector_index import get_trial_store, import_json_vectors, trial_metadata
+
+# -----------------------------
+# Configuration
+# -----------------------------
+TRIALS_PATH = Path(os.getenv("LOCAL_TRIALS_PATH", "data/processed/trials_agent_ready.json"))
+
+# Legacy JSON caches, imported into the binary trial store on first use.
+# First existing file wins; both use the {nct_id: {"values": [...]}} layout
+VECTOR_CACHE_CANDIDATES = [
+    Path(p) for p in [
+        os.getenv("LOCAL_VECTOR_CACHE", ""),
+        "data/cache/trial_vector_cache.json",
+        "data/vector_cache.json",
+    ] if p
+]
+
+# Exact search is a single mat-vec; IVF only pays off for large corpora
+IVF_MIN_ROWS = 20_000
+# Rows of the (queries x trials) score block held in memory at once
+QUERY_CHUNK_SIZE = 512
+IVF_NPROBE = 8
+KMEANS_ITERS = 15
+
+
+def _load_trials(trials_path: Path) -> Dict[str, Dict]:
+    if not Path(trials_path).exists():
+        return {}
+    with open(trials_path, "r", encoding="utf-8") as f:
+        return {str(t.get("nct_id")): t for t in json.load(f)}
+
+
+# -----------------------------
+# Metadata Filters (Pinecone syntax)
+# -----------------------------
+def _matches(meta: Dict, flt: Dict) -> bool:
+    for field, cond in flt.items():
+        if field == "$and":
+            if not all(_matches(meta, c) for c in cond):
+                return False
+        elif field == "$or":
+            if not any(_matches(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = meta.get(field)
+            for op, target in cond.items():
+                if not _compare(op, value, target):
+                    return False
+        elif meta.get(field) != cond:
+            return False
+    return True
+
+
+def _compare(op: str, value, target) -> bool:
+    if op == "$eq":
+        return value == target
+    if op == "$ne":
+        return value != target
+    if op == "$in":
+        return value in target
+    if op == "$nin":
+        return value not in target
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > target
+    if op == "$gte":
+        return value >= target
+    if op == "$lt":
+        return value < target
+    if op == "$lte":
+        return value <= target
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+# -----------------------------
+# Index
+# -----------------------------
+class LocalVectorIndex:
+    """
+    In-memory cosine index with the Pinecone query/upsert surface.
+    Rows are L2-normalized float32, so scores are plain dot products.
+    mode="exact" scans every row; mode="ivf" probes the nearest k-means
+    cells first (approximate, for large trial corpora).
+    """
+
+    def __init__(self, dim: int = 1536, mode: str = "exact", nlist: Optional[int] = None, nprobe: int = IVF_NPROBE):
+        self.dim = dim
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self.ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.metadata: List[Dict] = []
+
+        self._mask_cache: Dict[str, np.ndarray] = {}
+        self._centroids = None
+        self._cells = None
+
+    # ---------- construction ----------
+    @classmethod
+    def from_cache_files(cls, vector_cache: Optional[Path] = None, trials_path: Path = TRIALS_PATH, **kwargs):
+        """
+        Builds the index from the cached trial embeddings, no network needed.
+        Reads the binary trial store (importing the JSON cache into it the
+        first time); pass vector_cache to read a JSON cache directly instead.
+        """
+        if vector_cache is not None:
+            return cls.from_json(vector_cache, trials_path, **kwargs)
+
+        store = get_trial_store()
+        if len(store) == 0:
+            legacy = next((p for p in VECTOR_CACHE_CANDIDATES if p.exists()), None)
+            if legacy is None:
+                raise FileNotFoundError(f"No trial vectors in {store.npy_path} or {VECTOR_CACHE_CANDIDATES}")
+            import_json_vectors(legacy, store)
+        return cls.from_store(store, trials_path, **kwargs)
+
+    @classmethod
+    def from_store(cls, store: EmbeddingStore, trials_path: Path = TRIALS_PATH, **kwargs):
+        """Serves float32 stores straight from the mmap; other dtypes are dequantized once."""
+        ids, matrix = store.matrix()
+        norms = np.linalg.norm(matrix, axis=1)
+        if matrix.dtype != np.float32 or not np.allclose(norms, 1.0, atol=1e-3):
+            matrix = (matrix / np.where(norms == 0, 1.0, norms)[:, None]).astype(np.float32)
+
+        trials = _load_trials(trials_path)
+        if "mode" not in kwargs and len(ids) >= IVF_MIN_ROWS:
+            kwargs["mode"] = "ivf"
+        index = cls(dim=store.dim, **kwargs)
+        index._matrix = matrix
+        index._size = len(ids)
+        index.ids = list(ids)
+        index._rows = {vid: row for row, vid in enumerate(ids)}
+        index.metadata = [trial_metadata(trials.get(vid, {"nct_id": vid})) for vid in ids]
+        return index
+
+    @classmethod
+    def from_json(cls, vector_cache: Path, trials_path: Path = TRIALS_PATH, **kwargs):
+        with open(vector_cache, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+
+        trials = _load_trials(trials_path)
+        vectors = []
+        for nct_id, entry in cached.items():
+            values = entry["values"] if isinstance(entry, dict) else entry
+            trial = trials.get(nct_id, {"nct_id": nct_id})
+            vectors.append({"id": nct_id, "values": values, "metadata": trial_metadata(trial)})
+
+        dim = len(vectors[0]["values"]) if vectors else 1536
+        if "mode" not in kwargs and len(vectors) >= IVF_MIN_ROWS:
+            kwargs["mode"] = "ivf"
+        index = cls(dim=dim, **kwargs)
+        index.upsert(vectors)
+        return index
+
+    # ---------- Pinecone surface ----------
+    def upsert(self, vectors: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        vectors = list(vectors)
+        with self._lock:
+            self._ensure_writable()
+            self._reserve(self._size + len(vectors))
+            for v in vectors:
+                vec = np.asarray(v["values"], dtype=np.float32)
+                norm = np.linalg.norm(vec)
+                if norm:
+                    vec = vec / norm
+
+                row = self._rows.get(v["id"])
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[v["id"]] = row
+                    self.ids.append(v["id"])
+                    self.metadata.append(dict(v.get("metadata") or {}))
+                elif "metadata" in v:
+                    self.metadata[row] = dict(v["metadata"] or {})
+                self._matrix[row] = vec
+            self._invalidate()
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, **_) -> Dict:
+        with self._lock:
+            if delete_all:
+                self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+                self._size = 0
+                self.ids, self._rows, self.metadata = [], {}, []
+            else:
+                self._ensure_writable()
+                for vid in ids or []:
+                    row = self._rows.pop(vid, None)
+                    if row is None:
+                        continue
+                    # Swap-remove keeps the matrix dense
+                    last = self._size - 1
+                    if row != last:
+                        self._matrix[row] = self._matrix[last]
+                        self.ids[row] = self.ids[last]
+                        self.metadata[row] = self.metadata[last]
+                        self._rows[self.ids[row]] = row
+                    self.ids.pop()
+                    self.metadata.pop()
+                    self._size -= 1
+            self._invalidate()
+        return {}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        return {"dimension": self.dim, "total_vector_count": self._size}
+
+    def fetch(self, ids: List[str]) -> Dict[str, Any]:
+        with self._lock:
+            return {"vectors": {
+                vid: {"id": vid, "values": self._matrix[row].tolist(), "metadata": self.metadata[row]}
+                for vid in ids if (row := self._rows.get(vid)) is not None
+            }}
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        **_,
+    ) -> Dict[str, Any]:
+        q = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm:
+            q = q / norm
+
+        with self._lock:
+            matrix = self._matrix[:self._size]
+            candidates = self._ivf_candidates(q) if self.mode == "ivf" else None
+            mask = self._filter_mask(filter) if filter else None
+
+            if candidates is not None:
+                if mask is not None:
+                    candidates = candidates[mask[candidates]]
+                scores = matrix[candidates] @ q
+                rows = candidates
+            else:
+                scores = matrix @ q
+                rows = None
+                if mask is not None:
+                    scores = np.where(mask, scores, -np.inf)
+
+            k = min(top_k, int(np.isfinite(scores).sum()))
+            if k <= 0:
+                return {"matches": []}
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            matches = []
+            for i in top:
+                row = int(rows[i]) if rows is not None else int(i)
+                match = {"id": self.ids[row], "score": float(scores[i])}
+                if include_metadata:
+                    match["metadata"] = self.metadata[row]
+                matches.append(match)
+        return {"matches": matches}
+
+    def query_batch(
+        self,
+        vectors: List[List[float]],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        chunk_size: int = QUERY_CHUNK_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k for many queries at once: one (chunk x N) matrix product per
+        chunk and a row-wise argpartition. Chunking bounds the score block to
+        chunk_size * N floats. IVF mode falls back to per-query probing.
+        """
+        if self.mode == "ivf":
+            return [self.query(v, top_k, include_metadata, filter) for v in vectors]
+
+        q = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(norms == 0, 1.0, norms)
+
+        results = []
+        with self._lock:
+            matrix = self._matrix[:self._size]
+            mask = self._filter_mask(filter) if filter else None
+            k = min(top_k, self._size if mask is None else int(mask.sum()))
+
+            for start in range(0, len(q), chunk_size):
+                scores = q[start:start + chunk_size] @ matrix.T
+                if k <= 0:
+                    results.extend({"matches": []} for _ in range(len(scores)))
+                    continue
+                if mask is not None:
+                    scores[:, ~mask] = -np.inf
+
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1, kind="stable")
+                top = np.take_along_axis(top, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+                for rows, row_scores in zip(top, top_scores):
+                    matches = []
+                    for row, score in zip(rows.tolist(), row_scores.tolist()):
+                        match = {"id": self.ids[row], "score": score}
+                        if include_metadata:
+                            match["metadata"] = self.metadata[row]
+                        matches.append(match)
+                    results.append({"matches": matches})
+        return results
+
+    # ---------- internals ----------
+    def _ensure_writable(self):
+        # Indexes built from the store start on its read-only mmap; copy on first write
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix)
+
+    def _reserve(self, n: int):
+        if n <= len(self._matrix):
+            return
+        grown = np.zeros((max(n, 2 * len(self._matrix)), self.dim), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def _invalidate(self):
+        self._mask_cache.clear()
+        self._centroids = None
+        self._cells = None
+
+    def _filter_mask(self, flt: Dict) -> np.ndarray:
+        key = json.dumps(flt, sort_keys=True)
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            mask = np.fromiter((_matches(m, flt) for m in self.metadata), dtype=bool, count=self._size)
+            self._mask_cache[key] = mask
+        return mask
+
+    def _ivf_candidates(self, q: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            self._train_ivf()
+        if self._centroids is None:
+            return np.arange(self._size)
+        nearest = np.argsort(-(self._centroids @ q))[:self.nprobe]
+        return np.concatenate([self._cells[c] for c in nearest])
+
+    def _train_ivf(self):
+        """Spherical k-means over the rows; cells hold row ids per centroid."""
+        n = self._size
+        if n == 0:
+            return
+        data = self._matrix[:n]
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+
+        rng = np.random.default_rng(0)
+        centroids = data[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERS):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assign = np.argmax(data @ centroids.T, axis=1)
+        self._centroids = centroids
+        self._cells = [np.flatnonzero(assign == c) for c in range(nlist)]
@@ -1,115 +1,295 @@
 #Import libraries
 import os
+import sys
 import json
+import time
+import queue
 import hashlib
+import argparse
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
-import pinecone
-from openai import OpenAI
+
+# Add the project root to the search path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import disk_cache
+from utils.embedding_service import embed, embed_many
+from utils.embedding_store import EmbeddingStore
+from utils.retry import retry
+from utils.trial_manifest import load_manifest, manifest_path, mark_ingested
+from vector_store.vector_index import (
+    INDEX_NAME, VECTOR_BACKEND, VectorIndex, get_index, get_trial_store, import_json_vectors, trial_metadata,
+)
 
 # 1. Environment & Config
 load_dotenv()
 
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("PINECONE_INDEX", "clinical-trials")
 TRIALS_PATH = Path(r"C:\Projects\clinical_trial_agent\data\processed\trials_agent_ready.json")
 
-# THE CATCH: Persistent Trial Embedding Cache
+# THE CATCH: Persistent Trial Embedding Cache (binary store, see vector_index.get_trial_store)
+# The old JSON cache is imported into the store the first time it is found.
 CACHE_PATH = Path(r"C:\Projects\clinical_trial_agent\data\cache\trial_vector_cache.json")
 
-pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
-
-# 2. Ensure Index Exists
-if INDEX_NAME not in [idx.name for idx in pc.list_indexes()]:
-    print(f"⚡ Creating Pinecone index '{INDEX_NAME}'...")
-    from pinecone import ServerlessSpec
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=1536,
-        metric='cosine',
-        spec=ServerlessSpec(cloud='aws', region='us-east-1')
-    )
+# Pipeline: embed workers -> batcher -> upsert workers, joined by bounded queues
+BATCH_SIZE = 50
+EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "8"))
+UPSERT_WORKERS = int(os.getenv("INGEST_UPSERT_WORKERS", "4"))
+EMBED_BATCH = 64  # trials an embed worker drains per request
+QUEUE_SIZE = 4 * BATCH_SIZE
+UPSERT_RETRIES = 4
 
-index = pc.Index(INDEX_NAME)
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Delta detection: hash of the last successfully upserted (text, metadata) per trial
+UPSERTED_NAMESPACE = "pinecone_upserted"
+
+# 2. Index (Pinecone or local, per VECTOR_BACKEND); created on first ingest
+def get_ingest_index() -> VectorIndex:
+    return get_index(create=True)
 
 # 3. Embedding Function
-def get_embedding(text: str, nct_id: str, cache: dict):
+def get_embedding(text: str, nct_id: str, cache: EmbeddingStore):
     """Checks the 'catch' before calling OpenAI API."""
 
     # Generate a hash of the text to detect if trial content changed
     content_hash = hashlib.md5(text.encode()).hexdigest()
     
-    if nct_id in cache and cache[nct_id].get("hash") == content_hash:
-        return cache[nct_id]["values"]
+    if cache.tag(nct_id) == content_hash:
+        return cache.get(nct_id).tolist()
 
     print(f"💸 API CALL: Embedding Trial {nct_id}...")
     try:
-        res = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        vector = res.data[0].embedding
+        vector = embed(text)
 
         # Update catch
-        cache[nct_id] = {"values": vector, "hash": content_hash}
+        cache.put(nct_id, vector, tag=content_hash)
         return vector
     except Exception as e:
         print(f"❌ Embedding failed for {nct_id}: {e}")
         return None
 
+def embedding_text(trial: dict) -> str:
+    return f"{trial.get('title', '')} {json.dumps(trial.get('Criteria', {}))}"[:8000]
+
+def upsert_hash(text: str, metadata: Dict) -> str:
+    """Everything an upsert writes for a trial: embedded text + metadata."""
+    return hashlib.md5(f"{text}\n{json.dumps(metadata, sort_keys=True)}".encode()).hexdigest()
+
 # 4. Ingest Logic
-def ingest_structured_trials():
-    if not TRIALS_PATH.exists():
-        print(f"❌ Error: {TRIALS_PATH} not found.")
-        return
-
-    # Load Catch
-    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    cached_vectors = {}
-    if CACHE_PATH.exists():
-        with open(CACHE_PATH, "r", encoding="utf-8") as f:
-            cached_vectors = json.load(f)
-
-    with open(TRIALS_PATH, "r", encoding="utf-8") as f:
+_DONE = object()  # end-of-stream marker between stages
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.upserted = self.batches = self.failed = self.embed_failed = 0
+
+def _embed_stage(work: queue.Queue, out: queue.Queue, cache: EmbeddingStore, stats: _Stats):
+    """Drains up to EMBED_BATCH trials at a time and embeds the uncached ones in one request."""
+    finished = False
+    try:
+        while not finished:
+            items = []
+            while len(items) < EMBED_BATCH:
+                try:
+                    item = work.get() if not items else work.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True  # one marker per worker: stop draining after ours
+                    break
+                items.append(item)
+
+            hashes = [hashlib.md5(text.encode()).hexdigest() for _, text, _, _ in items]
+            missing = [i for i, (item, h) in enumerate(zip(items, hashes)) if cache.tag(item[0]) != h]
+            fresh = {}
+            if missing:
+                print(f"💸 API CALL: Embedding {len(missing)} trials...")
+                try:
+                    vectors = embed_many([items[i][1] for i in missing])
+                    for i, vector in zip(missing, vectors):
+                        cache.put(items[i][0], vector, tag=hashes[i])
+                        fresh[i] = vector
+                except Exception as e:
+                    print(f"❌ Batch embedding failed, falling back to per-trial calls: {e}")
+
+            for i, (nct_id, text, metadata, marker) in enumerate(items):
+                vector_values = fresh.get(i)
+                if vector_values is None:
+                    vector_values = get_embedding(text, nct_id, cache)
+                if vector_values is None:
+                    with stats.lock:
+                        stats.embed_failed += 1
+                    continue
+                out.put(({"id": nct_id, "values": [float(x) for x in vector_values], "metadata": metadata}, marker))
+    except BaseException:
+        # Keep the feeder from blocking on a full queue: discard our share up to our marker
+        while not finished:
+            finished = work.get() is _DONE
+        raise
+    finally:
+        out.put(_DONE)  # the batcher counts one per worker, even when this one failed
+
+def _upsert_batch(index: VectorIndex, batch: List, scope: str, stats: _Stats):
+    vectors = [v for v, _ in batch]
+    try:
+        retry(lambda: index.upsert(vectors=vectors), attempts=UPSERT_RETRIES, label=f"upsert of {len(vectors)} vectors")
+    except Exception as e:
+        print(f"❌ Upsert failed for {len(vectors)} vectors: {e}")
+        with stats.lock:
+            stats.failed += len(vectors)
+        return []
+    # Only after the index accepted them: next run skips these unless they change
+    for v, marker in batch:
+        disk_cache.save(UPSERTED_NAMESPACE, f"{scope}:{v['id']}", marker)
+    with stats.lock:
+        stats.upserted += len(vectors)
+        stats.batches += 1
+        print(f"✅ Upserted batch {stats.batches} ({len(vectors)} vectors)")
+    return [v["id"] for v in vectors]
+
+def _batch_stage(vectors: queue.Queue, index: VectorIndex, scope: str, stats: _Stats, embedders: int) -> List[str]:
+    """Groups embedded vectors into BATCH_SIZE upserts run on UPSERT_WORKERS threads."""
+    upserted, futures, batch = [], [], []
+    in_flight = threading.BoundedSemaphore(UPSERT_WORKERS * 2)  # backpressure on the embed stage
+
+    def submit(b):
+        in_flight.acquire()
+        fut = pool.submit(_upsert_batch, index, b, scope, stats)
+        fut.add_done_callback(lambda _: in_flight.release())
+        futures.append(fut)
+
+    with ThreadPoolExecutor(max_workers=UPSERT_WORKERS, thread_name_prefix="upsert") as pool:
+        finished = 0
+        try:
+            while finished < embedders:
+                item = vectors.get()
+                if item is _DONE:
+                    finished += 1
+                    continue
+                batch.append(item)
+                if len(batch) == BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+        finally:
+            # On failure, keep draining so embed workers never block on a full queue
+            while finished < embedders:
+                finished += vectors.get() is _DONE
+        for fut in futures:
+            upserted.extend(fut.result())
+    return upserted
+
+def ingest_structured_trials(
+    full: bool = False,
+    force: bool = False,
+    index: Optional[VectorIndex] = None,
+    trials_path: Path = TRIALS_PATH,
+    cache: Optional[EmbeddingStore] = None,
+    scope: Optional[str] = None,
+) -> Dict:
+    """
+    Embeds and upserts the trials listed in the build manifest (written by
+    format_clinical_trial) and deletes the removed ones. Without a manifest,
+    or with full=True, every trial is considered. Trials whose text and
+    metadata match their last successful upsert are skipped (force=True
+    upserts them anyway). Embedding, batching and upserting run
+    concurrently; returns the run's counters. A custom index needs its own
+    scope, the namespace of its upsert markers.
+    """
+    if index is not None and scope is None:
+        raise ValueError("ingest_structured_trials: pass scope= with a custom index, "
+                         "or its upsert markers would mark trials done in the configured index")
+    if not trials_path.exists():
+        print(f"❌ Error: {trials_path} not found.")
+        return {}
+
+    index = index if index is not None else get_ingest_index()
+    scope = scope or f"{VECTOR_BACKEND}:{INDEX_NAME}"  # upsert markers are per index
+    manifest_file = manifest_path(trials_path)
+    incremental = manifest_file.exists() and not full
+    manifest = load_manifest(manifest_file)
+
+    # Load Catch (mmap'd, no per-float parsing)
+    cached_vectors = cache if cache is not None else get_trial_store()
+    if len(cached_vectors) == 0 and CACHE_PATH.exists():
+        print(f"📦 Importing {CACHE_PATH} into {cached_vectors.npy_path}...")
+        import_json_vectors(CACHE_PATH, cached_vectors)
+
+    with open(trials_path, "r", encoding="utf-8") as f:
         trials = json.load(f)
 
-    print(f"🚀 Upserting {len(trials)} trials (Checking catch first)...")
-    vectors_to_upsert = []
+    if manifest["removed"]:
+        index.delete(ids=manifest["removed"])
+        print(f"🗑️ Deleted {len(manifest['removed'])} trials no longer in the build")
+        for nct_id in manifest["removed"]:
+            disk_cache.save(UPSERTED_NAMESPACE, f"{scope}:{nct_id}", None)
 
+    if incremental:
+        changed = set(manifest["changed"])
+        trials = [t for t in trials if str(t.get("nct_id") or t.get("NCTId")) in changed]
+
+    # Delta detection against the last successful upsert
+    work, unchanged = [], []
     for trial in trials:
         nct_id = str(trial.get("nct_id") or trial.get("NCTId"))
         if not nct_id: continue
 
-        # Standardized text for embedding
-        text_to_embed = f"{trial.get('title', '')} {json.dumps(trial.get('Criteria', {}))}"[:8000]
-        
-        vector_values = get_embedding(text_to_embed, nct_id, cached_vectors)
-        if not vector_values: continue
+        # Standardized text + metadata for the Reasoning Engine
+        text_to_embed = embedding_text(trial)
+        metadata = trial_metadata(trial)
+        marker = upsert_hash(text_to_embed, metadata)
+        if not force and disk_cache.load(UPSERTED_NAMESPACE, f"{scope}:{nct_id}") == marker:
+            unchanged.append(nct_id)
+            continue
+        work.append((nct_id, text_to_embed, metadata, marker))
 
-        # Standardized Metadata for Reasoning Engine
-        metadata = {
-            "nct_id": nct_id,
-            "title": str(trial.get("title") or ""),
-            "min_age": str(trial.get("minimumAge") or "0"),
-            # 🛠️ CRITICAL: Named 'structured_criteria' for Reasoning Engine handoff
-            "structured_criteria": json.dumps(trial.get("Criteria") or {})
-        }
+    print(f"🚀 Upserting {len(work)} trials ({len(unchanged)} unchanged since their last upsert)...")
+    stats = _Stats()
+    started = time.perf_counter()
+    upserted: List[str] = []
+    if work:
+        embed_q: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        vector_q: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        embedders = min(EMBED_WORKERS, len(work))
+        with ThreadPoolExecutor(max_workers=embedders + 1, thread_name_prefix="ingest") as pool:
+            batcher = pool.submit(_batch_stage, vector_q, index, scope, stats, embedders)
+            stages = [pool.submit(_embed_stage, embed_q, vector_q, cached_vectors, stats) for _ in range(embedders)]
 
-        vectors_to_upsert.append({"id": nct_id, "values": vector_values, "metadata": metadata})
+            for item in work:
+                embed_q.put(item)  # blocks while the pipeline is full
+            for _ in range(embedders):
+                embed_q.put(_DONE)
+            for fut in stages:
+                fut.result()  # each stage sends its own end marker, even when it fails
+            upserted = batcher.result()
 
-    # Batch Upsert
-    BATCH_SIZE = 50
-    for i in range(0, len(vectors_to_upsert), BATCH_SIZE):
-        batch = vectors_to_upsert[i:i + BATCH_SIZE]
-        index.upsert(vectors=batch)
-        print(f"✅ Upserted batch {i//BATCH_SIZE + 1}")
+    # Save updated catch + upsert markers
+    cached_vectors.save()
+    disk_cache.flush(UPSERTED_NAMESPACE)
+    elapsed = time.perf_counter() - started
 
-    # Save updated catch
-    with open(CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump(cached_vectors, f, indent=2)
+    # Only what this run handled; builds recorded meanwhile (or failures) stay pending
+    if manifest_file.exists():
+        mark_ingested(manifest_file, upserted + unchanged, manifest["removed"])
 
-    print(f"✅ Ingestion complete. Credits saved via hashlib content matching.")
+    rate = stats.upserted / elapsed if elapsed else 0.0
+    print(
+        f"✅ Ingestion complete: {stats.upserted} upserted in {stats.batches} batches, {len(unchanged)} skipped, "
+        f"{stats.embed_failed + stats.failed} failed | {elapsed:,.1f}s, {rate:,.0f} vectors/sec"
+    )
+    return {
+        "upserted": stats.upserted,
+        "skipped": len(unchanged),
+        "failed": stats.embed_failed + stats.failed,
+        "seconds": round(elapsed, 3),
+        "vectors_per_sec": round(rate, 1),
+    }
 
 if __name__ == "__main__":
-    ingest_structured_trials()
+    parser = argparse.ArgumentParser(description="Embed and upsert agent-ready trials")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and consider every trial")
+    parser.add_argument("--force", action="store_true", help="upsert even trials unchanged since their last upsert")
+    args = parser.parse_args()
+    ingest_structured_trials(full=args.full, force=args.force)
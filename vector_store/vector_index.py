@@ -0,0 +1,179 @@
+# vector_store/vector_index.py
+
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Protocol
+
+from dotenv import load_dotenv
+
+from utils.embedding_store import EmbeddingStore
+
+load_dotenv()
+
+# -----------------------------
+# Configuration
+# -----------------------------
+# VECTOR_BACKEND=pinecone (default) talks to the hosted index;
+# VECTOR_BACKEND=local serves the cached trial embeddings from memory.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+INDEX_NAME = os.getenv("PINECONE_INDEX", "clinical-trials")
+EMBED_DIM = 1536
+
+# Binary trial embeddings (mmap'd .npy + id index), tagged with content hashes
+TRIAL_STORE_PATH = Path(os.getenv("TRIAL_VECTOR_STORE", "data/cache/trial_vectors"))
+TRIAL_STORE_DTYPE = os.getenv("TRIAL_EMBED_DTYPE", "float32")  # float16 / int8 to shrink it
+
+
+# -----------------------------
+# Interface
+# -----------------------------
+class VectorIndex(Protocol):
+    """
+    The subset of the Pinecone Index API the agents rely on.
+    query() returns {"matches": [{"id", "score", "metadata"}]}.
+    """
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        include_metadata: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]: ...
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> Any: ...
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> Any: ...
+
+    def describe_index_stats(self) -> Dict[str, Any]: ...
+
+    def fetch(self, ids: List[str]) -> Any: ...
+
+
+def query_many(
+    index: VectorIndex,
+    vectors: List[List[float]],
+    top_k: int,
+    include_metadata: bool = False,
+    filter: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Batched query when the backend supports it, one query per vector otherwise."""
+    if hasattr(index, "query_batch"):
+        return index.query_batch(vectors, top_k=top_k, include_metadata=include_metadata, filter=filter)
+    return [
+        index.query(vector=[float(x) for x in v], top_k=top_k, include_metadata=include_metadata, filter=filter)
+        for v in vectors
+    ]
+
+
+def fetch_metadata(index: VectorIndex, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """{id: metadata} for ids the trial catalog doesn't know (Pinecone or local fetch)."""
+    if not ids:
+        return {}
+    res = index.fetch(ids=ids)
+    vectors = res["vectors"] if isinstance(res, dict) else res.vectors
+    return {
+        vid: (v.get("metadata") if isinstance(v, dict) else v.metadata) or {}
+        for vid, v in vectors.items()
+    }
+
+
+def fetch_vectors(index: VectorIndex, ids: List[str]) -> Dict[str, List[float]]:
+    """{id: values} for the ids the index holds (Pinecone or local fetch)."""
+    if not ids:
+        return {}
+    res = index.fetch(ids=ids)
+    vectors = res["vectors"] if isinstance(res, dict) else res.vectors
+    return {
+        vid: v.get("values") if isinstance(v, dict) else v.values
+        for vid, v in vectors.items()
+    }
+
+
+def trial_metadata(trial: Dict) -> Dict[str, str]:
+    """
+    Standardized metadata (shared by every backend). Kept to filterable
+    fields: criteria are resolved by ID through utils.trial_catalog.
+    """
+    return {
+        "nct_id": str(trial.get("nct_id") or trial.get("NCTId")),
+        "title": str(trial.get("title") or ""),
+        "min_age": str(trial.get("minimumAge") or "0"),
+    }
+
+
+# -----------------------------
+# Trial Embedding Store
+# -----------------------------
+_trial_store: Optional[EmbeddingStore] = None
+_trial_store_lock = threading.Lock()
+
+
+def get_trial_store() -> EmbeddingStore:
+    global _trial_store
+    with _trial_store_lock:
+        if _trial_store is None:
+            _trial_store = EmbeddingStore(TRIAL_STORE_PATH, dim=EMBED_DIM, dtype=TRIAL_STORE_DTYPE)
+        return _trial_store
+
+
+def import_json_vectors(path: Path, store: EmbeddingStore) -> int:
+    """Loads a {nct_id: {"values": [...], "hash": ...}} JSON cache into the binary store."""
+    with open(path, "r", encoding="utf-8") as f:
+        cached = json.load(f)
+    for nct_id, entry in cached.items():
+        if isinstance(entry, dict):
+            store.put(nct_id, entry["values"], tag=entry.get("hash"))
+        else:
+            store.put(nct_id, entry)
+    store.save()
+    return len(cached)
+
+
+# -----------------------------
+# Factory
+# -----------------------------
+_indexes: Dict[tuple, VectorIndex] = {}
+
+
+def get_index(backend: Optional[str] = None, name: Optional[str] = None, create: bool = False) -> VectorIndex:
+    """
+    Returns the process-wide index for the configured backend.
+    create=True provisions a missing Pinecone index (ingestion only).
+    """
+    backend = (backend or VECTOR_BACKEND).lower()
+    name = name or INDEX_NAME
+
+    if (backend, name) in _indexes:
+        return _indexes[(backend, name)]
+
+    if backend == "local":
+        from vector_store.local_index import LocalVectorIndex
+        index = LocalVectorIndex.from_cache_files()
+    elif backend == "pinecone":
+        index = _pinecone_index(name, create)
+    else:
+        raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+
+    _indexes[(backend, name)] = index
+    return index
+
+
+def _pinecone_index(name: str, create: bool):
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+
+    if create and name not in [idx.name for idx in pc.list_indexes()]:
+        print(f"⚡ Creating Pinecone index '{name}'...")
+        from pinecone import ServerlessSpec
+        pc.create_index(
+            name=name,
+            dimension=EMBED_DIM,
+            metric='cosine',
+            spec=ServerlessSpec(cloud='aws', region='us-east-1')
+        )
+
+    return pc.Index(name)